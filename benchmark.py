@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2013 Tomo Krajina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Times bulk elevation lookups of random points, for example:
+
+    $ python benchmark.py --local-cache-dir test_files --points 100000
+    $ python benchmark.py --area 44 48 5 16 --backend chunked --batch-mode
+    $ python benchmark.py --local-cache-dir test_files --startup
+
+Every run uses a new GeoElevationData (files are loaded again, but if they
+are not in the local cache they are downloaded only once).
+"""
+
+import argparse as mod_argparse
+import gc         as mod_gc
+import json       as mod_json
+import os         as mod_os
+import random     as mod_random
+import shutil     as mod_shutil
+import statistics as mod_statistics
+import subprocess as mod_subprocess
+import sys        as mod_sys
+import tempfile   as mod_tempfile
+import time       as mod_time
+
+import srtm as mod_srtm
+from srtm import chunked as mod_chunked
+from srtm import shared  as mod_shared
+from srtm import utils   as mod_utils
+
+from typing import *
+
+MEMORY = 'memory'
+CHUNKED = 'chunked'
+SHARED = 'shared'
+
+def benchmark(points: List[Tuple[float, float]], order: Optional[str], backend: str, batch_mode: bool, local_cache_dir: str) -> float:
+    if backend != SHARED:
+        return _get_elevations(points, order, backend, batch_mode, local_cache_dir, None)
+    tile_store = mod_shared.SharedTileStore(f'srtm-benchmark-{mod_os.getpid()}', create=True)
+    try:
+        return _get_elevations(points, order, backend, batch_mode, local_cache_dir, tile_store)
+    finally:
+        # Files (referencing the shared memory) must be garbage collected before closing the store:
+        mod_gc.collect()
+        tile_store.close()
+
+def _get_elevations(points: List[Tuple[float, float]], order: Optional[str], backend: str, batch_mode: bool, local_cache_dir: str,
+                    tile_store: Optional[mod_shared.SharedTileStore]) -> float:
+    geo_elevation_data = mod_srtm.get_data(local_cache_dir=local_cache_dir, batch_mode=batch_mode,
+                                           chunked=backend == CHUNKED, tile_store=tile_store)
+    start = mod_time.time()
+    geo_elevation_data.get_elevations(points, order=order)
+    return mod_time.time() - start
+
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import srtm
+imported = time.perf_counter()
+elevation = srtm.get_data(local_cache_dir=sys.argv[1]).get_elevation(float(sys.argv[2]), float(sys.argv[3]))
+done = time.perf_counter()
+print(json.dumps({'import': imported - start, 'first_elevation': done - imported, 'modules': len(sys.modules)}))
+"""
+
+def startup_benchmark(local_cache_dir: str, latitude: float, longitude: float, runs: int) -> None:
+    """ Import time and time to the first elevation, in new processes (median of runs). """
+    results = []
+    for _ in range(runs):
+        start = mod_time.perf_counter()
+        output = mod_subprocess.check_output([mod_sys.executable, '-c', STARTUP_SCRIPT, local_cache_dir, str(latitude), str(longitude)])
+        result = mod_json.loads(output.decode().strip().splitlines()[-1])
+        result['process'] = mod_time.perf_counter() - start
+        results.append(result)
+    for key in ('import', 'first_elevation', 'process'):
+        print(f'{key:16s} {mod_statistics.median(result[key] for result in results) * 1000:8.1f}ms')
+    print(f'{"modules":16s} {results[0]["modules"]:8d}')
+
+def main() -> None:
+    parser = mod_argparse.ArgumentParser(description='Bulk elevation lookup benchmark')
+    parser.add_argument('--area', type=float, nargs=4, default=[44., 45., -72., -71.],
+                        metavar=('LAT_MIN', 'LAT_MAX', 'LON_MIN', 'LON_MAX'), help='Random points are in this area')
+    parser.add_argument('--points', type=int, default=100000, help='Number of points')
+    parser.add_argument('--backend', choices=[MEMORY, CHUNKED, SHARED], default=MEMORY,
+                        help='Files loaded in memory, chunked files or files in a shared tile store')
+    parser.add_argument('--batch-mode', action='store_true', help='Keep only the last file in memory')
+    parser.add_argument('--local-cache-dir', default='', help='Local cache dir (default ~/.cache/srtm)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--startup', action='store_true', help='Time import and the first elevation (in the middle of the area)')
+    parser.add_argument('--runs', type=int, default=10, help='Number of processes for --startup')
+    args = parser.parse_args()
+
+    latitude_min, latitude_max, longitude_min, longitude_max = args.area
+    if args.startup:
+        startup_benchmark(args.local_cache_dir or mod_utils.FileHandler().local_cache_dir,
+                          (latitude_min + latitude_max) / 2, (longitude_min + longitude_max) / 2, args.runs)
+        return
+
+    random = mod_random.Random(args.seed)
+    points = [(random.uniform(latitude_min, latitude_max), random.uniform(longitude_min, longitude_max)) for _ in range(args.points)]
+
+    local_cache_dir = args.local_cache_dir or mod_utils.FileHandler().local_cache_dir
+    temp_dir = None
+    if args.backend == CHUNKED:
+        # Don't add .chunked files to the cache dir:
+        temp_dir = mod_tempfile.mkdtemp()
+        for file_name in mod_os.listdir(local_cache_dir):
+            if file_name.endswith('.hgt') or file_name.endswith('.hgt.zip'):
+                mod_shutil.copy(mod_os.path.join(local_cache_dir, file_name), temp_dir)
+        mod_chunked.convert(mod_utils.FileHandler(temp_dir), remove=True)
+        local_cache_dir = temp_dir
+
+    try:
+        print(f'{len(points)} points, backend={args.backend}, batch_mode={args.batch_mode}')
+        for order in (None, mod_utils.Z_ORDER, mod_utils.HILBERT):
+            seconds = benchmark(points, order, args.backend, args.batch_mode, local_cache_dir)
+            print(f'{order or "input order":12s} {seconds:8.3f}s {len(points) / seconds:12.0f} points/s')
+    finally:
+        if temp_dir:
+            mod_shutil.rmtree(temp_dir)
+
+if __name__ == '__main__':
+    main()
@@ -33,6 +33,6 @@ mod_distutilscore.setup(
         "Programming Language :: Python :: 3",
     ],
     install_requires=['requests'],
-    scripts=['gpxelevations']
+    scripts=['gpxelevations', 'srtmwarmup']
 )
 
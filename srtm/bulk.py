@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2013 Tomo Krajina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Elevations of very many points in parallel processes. Points are split by
+file and every file is always processed by the same worker process, so
+every file is loaded (and decoded) only once, by only one process.
+"""
+
+import concurrent.futures as mod_futures
+import logging            as mod_logging
+import multiprocessing    as mod_multiprocessing
+import os                 as mod_os
+
+from . import data as mod_data
+from . import main as mod_main
+
+from typing import *
+
+# GeoElevationData of the worker process:
+_geo_elevation_data: Optional[mod_data.GeoElevationData] = None
+
+def _init_worker(get_data_args: Dict[str, Any], tile_store_name: Optional[str]) -> None:
+    global _geo_elevation_data
+    tile_store = None
+    if tile_store_name:
+        from . import shared as mod_shared
+        tile_store = mod_shared.SharedTileStore(tile_store_name)
+    _geo_elevation_data = mod_main.get_data(tile_store=tile_store, **get_data_args)
+
+def _get_elevations_array(latitudes: Any, longitudes: Any, height_reference: Optional[str]) -> Any:
+    assert _geo_elevation_data is not None
+    return _geo_elevation_data.get_elevations_array(latitudes, longitudes, height_reference=height_reference)
+
+def _get_loaded_file_names() -> List[str]:
+    assert _geo_elevation_data is not None
+    return sorted(_geo_elevation_data.files)
+
+class BulkEngine:
+    """
+    A pool of worker processes, every one with its own GeoElevationData
+    (created with srtm.get_data(**get_data_args)).
+
+    Files are assigned to workers when they are first needed (to the worker
+    with the least points so far) and they stay with that worker. With
+    tile_store_name workers attach to that SharedTileStore (created by
+    another process), so that files loaded by them can also be used by
+    other processes.
+
+    Use it as a context manager, or call close().
+    """
+
+    def __init__(self, workers: Optional[int]=None, tile_store_name: Optional[str]=None, start_method: Optional[str]=None,
+                 **get_data_args: Any) -> None:
+        self.workers = workers or mod_os.cpu_count() or 1
+        context = mod_multiprocessing.get_context(start_method)
+        # One executor (with one process) per worker, so that tasks can be
+        # sent to a chosen worker:
+        self.executors = [mod_futures.ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=_init_worker,
+                                                          initargs=(get_data_args, tile_store_name))
+                          for _ in range(self.workers)]
+        # File position (see _get_file_keys) -> worker:
+        self.file_workers: Dict[int, int] = {}
+        # Number of points sent to every worker:
+        self.worker_points = [0] * self.workers
+
+    def __enter__(self) -> "BulkEngine":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        for executor in self.executors:
+            executor.shutdown()
+
+    def get_elevations_array(self, latitudes: Any, longitudes: Any, height_reference: Optional[str]=None) -> Any:
+        """ Same as GeoElevationData.get_elevations_array, computed by the workers. """
+        import numpy as np # type: ignore
+
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        if latitudes.shape != longitudes.shape:
+            raise Exception(f'Latitudes and longitudes have different shapes {latitudes.shape} and {longitudes.shape}')
+
+        result = np.full(latitudes.shape, np.nan)
+        flat_latitudes, flat_longitudes, flat_result = latitudes.ravel(), longitudes.ravel(), result.reshape(-1)
+
+        indexes = np.flatnonzero(np.isfinite(flat_latitudes) & np.isfinite(flat_longitudes))
+        keys = _get_file_keys(flat_latitudes[indexes], flat_longitudes[indexes])
+        unique_keys, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+
+        # New files go to the least busy workers (the largest first):
+        for n in np.argsort(-counts, kind='stable').tolist():
+            key = int(unique_keys[n])
+            if key not in self.file_workers:
+                self.file_workers[key] = min(range(self.workers), key=lambda worker: self.worker_points[worker])
+            self.worker_points[self.file_workers[key]] += int(counts[n])
+
+        point_workers = np.array([self.file_workers[key] for key in unique_keys.tolist()], dtype=np.int64)[inverse.reshape(-1)]
+        futures = []
+        for worker in range(self.workers):
+            worker_indexes = indexes[point_workers == worker]
+            if len(worker_indexes):
+                future = self.executors[worker].submit(_get_elevations_array, flat_latitudes[worker_indexes],
+                                                       flat_longitudes[worker_indexes], height_reference)
+                futures.append((worker_indexes, future))
+        for worker_indexes, future in futures:
+            flat_result[worker_indexes] = future.result()
+        mod_logging.debug(f'{len(indexes)} points in {len(unique_keys)} files computed by {len(futures)} workers')
+        return result
+
+    def get_elevations(self, points: Sequence[Tuple[float, float]], height_reference: Optional[str]=None) -> List[Optional[float]]:
+        """ Elevations of (latitude, longitude) points, None for points without elevation. """
+        import numpy as np
+
+        array = np.array(points, dtype=np.float64).reshape((-1, 2))
+        elevations = self.get_elevations_array(array[:, 0], array[:, 1], height_reference=height_reference)
+        return [None if elevation != elevation else elevation for elevation in elevations.tolist()]
+
+    def get_loaded_file_names(self) -> List[List[str]]:
+        """ Files loaded by every worker. """
+        return [executor.submit(_get_loaded_file_names).result() for executor in self.executors]
+
+def _get_file_keys(latitudes: Any, longitudes: Any) -> Any:
+    """ A number for every file (position of the lower left corner). """
+    import numpy as np
+
+    return (np.floor(latitudes).astype(np.int64) + 90) * 360 + np.floor(longitudes).astype(np.int64) + 180
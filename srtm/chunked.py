@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2013 Tomo Krajina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compressed SRTM file format with random access.
+
+The file is split into square blocks (by default 256x256 points), every
+block is compressed separately and an index with the offsets of all blocks
+is stored at the beginning of the file. Reading a single point decompresses
+only one block.
+"""
+
+import array       as mod_array
+import collections as mod_collections
+import logging     as mod_logging
+import math        as mod_math
+import struct      as mod_struct
+import sys         as mod_sys
+import zlib        as mod_zlib
+
+from . import tracing as mod_tracing
+from . import utils   as mod_utils
+
+from typing import *
+
+EXTENSION = '.chunked'
+
+MAGIC = b'SRTC'
+VERSION = 1
+
+DEFAULT_BLOCK_SIZE = 256
+DEFAULT_CACHED_BLOCKS = 16
+
+HEADER = mod_struct.Struct('>4sBII')
+INDEX_ENTRY = mod_struct.Struct('>QI')
+
+def decode(data: Union[bytes, memoryview]) -> "mod_array.array[int]":
+    """ Decodes big endian int16 values (like in .hgt files) in a native array('h'). """
+    values = mod_array.array('h')
+    values.frombytes(data)
+    if mod_sys.byteorder == 'little':
+        values.byteswap()
+    return values
+
+def encode(values: "mod_array.array[int]") -> bytes:
+    """ The opposite of decode. """
+    if mod_sys.byteorder == 'little':
+        values = mod_array.array('h', values)
+        values.byteswap()
+    return values.tobytes()
+
+def compress(data: bytes, block_size: int=DEFAULT_BLOCK_SIZE, level: int=6) -> bytes:
+    """ Converts the contents of a .hgt file in the chunked format. """
+    square_side = int(round(mod_math.sqrt(len(data) / 2.)))
+    if square_side * square_side * 2 != len(data):
+        raise Exception(f'Invalid file size: {len(data)}')
+
+    blocks_per_side = (square_side + block_size - 1) // block_size
+    blocks = []
+    for block_row in range(blocks_per_side):
+        for block_column in range(blocks_per_side):
+            rows = range(block_row * block_size, min(square_side, (block_row + 1) * block_size))
+            start_column = block_column * block_size
+            end_column = min(square_side, start_column + block_size)
+            block = b''.join(data[(row * square_side + start_column) * 2 : (row * square_side + end_column) * 2] for row in rows)
+            blocks.append(mod_zlib.compress(block, level))
+
+    offset = HEADER.size + len(blocks) * INDEX_ENTRY.size
+    header = [HEADER.pack(MAGIC, VERSION, square_side, block_size)]
+    for block in blocks:
+        header.append(INDEX_ENTRY.pack(offset, len(block)))
+        offset += len(block)
+
+    return b''.join(header + blocks)
+
+class ChunkedFile:
+    """
+    Contents of a file in the chunked format. It behaves like the (read only)
+    contents of the original .hgt file: len() is the uncompressed size and
+    slicing returns the uncompressed bytes, but only the blocks needed are
+    read and decompressed. The most recently used blocks are kept in memory
+    (decoded, see ChunkedValues).
+
+    read_range is a function (offset, length) -> bytes reading from the
+    chunked file, for example FileHandler.read_range for a file on disk.
+    """
+
+    def __init__(self, read_range: Callable[[int, int], bytes], cached_blocks: int=DEFAULT_CACHED_BLOCKS) -> None:
+        self.read_range = read_range
+        self.cached_blocks = cached_blocks
+
+        magic, version, square_side, block_size = HEADER.unpack(read_range(0, HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise Exception('Invalid chunked file')
+        self.square_side: int = square_side
+        self.block_size: int = block_size
+
+        self.blocks_per_side: int = (self.square_side + self.block_size - 1) // self.block_size
+        index = read_range(HEADER.size, self.blocks_per_side ** 2 * INDEX_ENTRY.size)
+        self.index = [INDEX_ENTRY.unpack_from(index, n * INDEX_ENTRY.size) for n in range(self.blocks_per_side ** 2)]
+
+        self.blocks: "mod_collections.OrderedDict[int, mod_array.array[int]]" = mod_collections.OrderedDict()
+
+    @classmethod
+    def from_bytes(cls, data: bytes, cached_blocks: int=DEFAULT_CACHED_BLOCKS) -> "ChunkedFile":
+        return cls(lambda offset, length: data[offset : offset + length], cached_blocks)
+
+    @classmethod
+    def from_file_handler(cls, file_handler: mod_utils.FileHandler, file_name: str, cached_blocks: int=DEFAULT_CACHED_BLOCKS) -> "ChunkedFile":
+        return cls(lambda offset, length: file_handler.read_range(file_name, offset, length), cached_blocks)
+
+    def get_block(self, block_no: int) -> "mod_array.array[int]":
+        """ Decoded values of the block (row by row). """
+        block = self.blocks.get(block_no)
+        if block is not None:
+            try:
+                self.blocks.move_to_end(block_no)
+            except KeyError:
+                # Removed by another thread (see srtm.prefetch)
+                pass
+            return block
+
+        offset, length = self.index[block_no]
+        with mod_tracing.span(mod_tracing.BLOCK, block_no=block_no, bytes=length):
+            block = decode(mod_zlib.decompress(self.read_range(offset, length)))
+        self.blocks[block_no] = block
+        if len(self.blocks) > self.cached_blocks:
+            self.blocks.popitem(last=False)
+        return block
+
+    def __len__(self) -> int:
+        return self.square_side * self.square_side * 2
+
+    def __getitem__(self, key: slice) -> bytes:
+        if not isinstance(key, slice):
+            raise TypeError('Only slices are supported')
+        start, stop, step = key.indices(len(self))
+        if step != 1:
+            raise TypeError('Only contiguous slices are supported')
+        if start >= stop:
+            return b''
+
+        # Whole values from start to stop, the first/last byte is removed later:
+        result = []
+        cell, stop_cell = start // 2, (stop + 1) // 2
+        while cell < stop_cell:
+            row, column = divmod(cell, self.square_side)
+            block_row, block_column = row // self.block_size, column // self.block_size
+            block_width = min(self.block_size, self.square_side - block_column * self.block_size)
+
+            block = self.get_block(block_row * self.blocks_per_side + block_column)
+            block_cell = (row % self.block_size) * block_width + column % self.block_size
+            # Till the end of the row in this block (or the end of the slice):
+            length = min(stop_cell - cell, block_width - column % self.block_size)
+            result.append(encode(block[block_cell : block_cell + length]))
+            cell += length
+
+        contents = b''.join(result)
+        return contents[start % 2 : start % 2 + stop - start]
+
+    def get_block_no(self, row: int, column: int) -> int:
+        return (row // self.block_size) * self.blocks_per_side + column // self.block_size
+
+    def get_value(self, n: int) -> int:
+        """ n-th value (row * square_side + column) of the file. """
+        row, column = divmod(n, self.square_side)
+        block_column = column // self.block_size
+        block = self.get_block((row // self.block_size) * self.blocks_per_side + block_column)
+        block_width = min(self.block_size, self.square_side - block_column * self.block_size)
+        return block[(row % self.block_size) * block_width + column % self.block_size]
+
+class ChunkedValues:
+    """ Values of a chunked file, indexed like an array('h') with all the values of the file. """
+
+    def __init__(self, chunked_file: ChunkedFile) -> None:
+        self.chunked_file = chunked_file
+
+    def __len__(self) -> int:
+        return self.chunked_file.square_side ** 2
+
+    def __getitem__(self, n: int) -> int:
+        if not 0 <= n < len(self):
+            raise IndexError(n)
+        return self.chunked_file.get_value(n)
+
+def convert(file_handler: mod_utils.FileHandler, remove: bool=False, block_size: int=DEFAULT_BLOCK_SIZE) -> List[str]:
+    """
+    Converts all .hgt and .hgt.zip files stored by the file handler in the
+    chunked format. If remove is True the original files are removed.
+
+    Returns the names of the converted files.
+    """
+    file_names = file_handler.list_files()
+    result = []
+    for file_name in file_names:
+        if file_name.endswith('.hgt'):
+            hgt_file_name = file_name
+        elif file_name.endswith('.hgt.zip'):
+            hgt_file_name = file_name[:-len('.zip')]
+        else:
+            continue
+        if hgt_file_name + EXTENSION in file_names or hgt_file_name in result:
+            continue
+
+        data = file_handler.read(file_name)
+        if file_name.endswith('.zip'):
+            data = mod_utils.unzip(data)
+        file_handler.write(hgt_file_name + EXTENSION, compress(data, block_size))
+        mod_logging.info(f'Converted {file_name} to {hgt_file_name + EXTENSION}')
+        result.append(hgt_file_name)
+
+        if remove:
+            for original in (hgt_file_name, hgt_file_name + '.zip'):
+                if original in file_names:
+                    file_handler.remove(original)
+
+    return result
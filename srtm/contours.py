@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2013 Tomo Krajina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Contour lines (marching squares) of SRTM points. Large areas are processed
+file by file (from north to south), lines are joined across file borders.
+"""
+
+import collections as mod_collections
+import math        as mod_math
+
+from . import data as mod_data
+
+from typing import *
+
+# A list of (latitude, longitude) points, closed lines end with the first point:
+Polyline = List[Tuple[float, float]]
+
+# Geotransform in the GDAL order (see GeoElevationData.get_region):
+GeoTransform = Tuple[float, float, float, float, float, float]
+
+# Edges between grid points are identified by (row * MAX_COLUMNS + column) * 2
+# (+ 1 for vertical edges), where (row, column) is the upper/left point:
+MAX_COLUMNS = 2 ** 22
+
+# Edges (T)op, (R)ight, (B)ottom and (L)eft of a cell crossed by the line
+# for every marching squares case (tl * 8 + tr * 4 + br * 2 + bl, with 1 for
+# corners at or above the level). Saddles (5 and 10) have two variants, the
+# first one is used if the center of the cell is at or above the level:
+CASES: Dict[int, List[str]] = {
+    1: ['LB'], 2: ['BR'], 3: ['LR'], 4: ['TR'], 6: ['TB'], 7: ['TL'],
+    8: ['TL'], 9: ['TB'], 11: ['TR'], 12: ['LR'], 13: ['BR'], 14: ['LB'],
+}
+SADDLES: Dict[int, Tuple[List[str], List[str]]] = {
+    5: (['TL', 'BR'], ['TR', 'LB']),
+    10: (['TR', 'LB'], ['TL', 'BR']),
+}
+
+class _Line:
+    def __init__(self, start: int, end: int, points: "mod_collections.deque[Tuple[float, float]]") -> None:
+        self.start = start
+        self.end = end
+        self.points = points
+
+    def reverse(self) -> None:
+        self.points.reverse()
+        self.start, self.end = self.end, self.start
+
+class _Lines:
+    """ Joins segments (with ends on the same edges) into lines. """
+
+    def __init__(self) -> None:
+        # Edge -> line ending on it:
+        self.ends: Dict[int, _Line] = {}
+        self.finished: List[Polyline] = []
+
+    def add(self, edge_1: int, edge_2: int, point_1: Tuple[float, float], point_2: Tuple[float, float]) -> None:
+        line_1 = self.ends.pop(edge_1, None)
+        line_2 = self.ends.pop(edge_2, None)
+        if line_1 is None and line_2 is None:
+            line = _Line(edge_1, edge_2, mod_collections.deque((point_1, point_2)))
+            self.ends[edge_1] = self.ends[edge_2] = line
+        elif line_1 is not None and line_2 is not None:
+            if line_1 is line_2:
+                line_1.points.append(line_1.points[0])
+                self.finished.append(list(line_1.points))
+                return
+            # line_1 ... edge_1 - edge_2 ... line_2:
+            if line_1.start == edge_1:
+                line_1.reverse()
+            if line_2.end == edge_2:
+                line_2.reverse()
+            line_1.points.extend(line_2.points)
+            line_1.end = line_2.end
+            self.ends[line_1.end] = line_1
+        else:
+            line, line_edge, edge, point = (line_1, edge_1, edge_2, point_2) if line_1 is not None else (cast(_Line, line_2), edge_2, edge_1, point_1)
+            if line.start == line_edge:
+                line.points.appendleft(point)
+                line.start = edge
+            else:
+                line.points.append(point)
+                line.end = edge
+            self.ends[edge] = line
+
+    def pop_finished(self, is_open: Optional[Callable[[int], bool]]=None) -> List[Polyline]:
+        """ Closed lines and lines without ends on edges where is_open (all if None). """
+        result, self.finished = self.finished, []
+        lines = {id(line): line for line in self.ends.values()}
+        for line in lines.values():
+            if is_open is None or not (is_open(line.start) or is_open(line.end)):
+                del self.ends[line.start], self.ends[line.end]
+                result.append(list(line.points))
+        return result
+
+def _get_segments(values: Any, level: float, row: int, column: int, geo_transform: GeoTransform) -> Tuple[List[int], List[int], Any, Any]:
+    """
+    Segments of the contour line in values (a float array with NaN for
+    invalid points), where values[0, 0] is the point (row, column) of the
+    grid. Returns edges of both ends, and (latitude, longitude) arrays of both
+    ends.
+    """
+    import numpy as np # type: ignore
+
+    tl, tr, br, bl = values[:-1, :-1], values[:-1, 1:], values[1:, 1:], values[1:, :-1]
+    above = values >= level
+    cases = above[:-1, :-1] * 8 + above[:-1, 1:] * 4 + above[1:, 1:] * 2 + above[1:, :-1]
+    # Lines end at cells with invalid points:
+    cases[np.isnan(tl) | np.isnan(tr) | np.isnan(br) | np.isnan(bl)] = 0
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        def crossing(a: Any, b: Any) -> Any:
+            return np.where(a == b, .5, (level - a) / (b - a))
+
+        def edge(name: str, i: Any, j: Any) -> Tuple[Any, Any, Any]:
+            """ Edges and (row, column) of the crossing point on the edge of cells i, j. """
+            if name == 'T':
+                return (((row + i) * MAX_COLUMNS + column + j) * 2, row + i, column + j + crossing(tl[i, j], tr[i, j]))
+            if name == 'B':
+                return (((row + i + 1) * MAX_COLUMNS + column + j) * 2, row + i + 1, column + j + crossing(bl[i, j], br[i, j]))
+            if name == 'L':
+                return (((row + i) * MAX_COLUMNS + column + j) * 2 + 1, row + i + crossing(tl[i, j], bl[i, j]), column + j)
+            return (((row + i) * MAX_COLUMNS + column + j + 1) * 2 + 1, row + i + crossing(tr[i, j], br[i, j]), column + j + 1)
+
+        edges_1: List[Any] = []
+        edges_2: List[Any] = []
+        rows_1: List[Any] = []
+        columns_1: List[Any] = []
+        rows_2: List[Any] = []
+        columns_2: List[Any] = []
+        def add(edge_names: str, i: Any, j: Any) -> None:
+            for name, edges, rows, columns in zip(edge_names, (edges_1, edges_2), (rows_1, rows_2), (columns_1, columns_2)):
+                e, r, c = edge(name, i, j)
+                edges.append(e)
+                rows.append(np.broadcast_to(r, e.shape))
+                columns.append(np.broadcast_to(c, e.shape))
+
+        for case, edge_names_list in CASES.items():
+            i, j = np.nonzero(cases == case)
+            if len(i):
+                for edge_names in edge_names_list:
+                    add(edge_names, i, j)
+        for case, (center_above, center_below) in SADDLES.items():
+            i, j = np.nonzero(cases == case)
+            if len(i):
+                center = (tl[i, j] + tr[i, j] + br[i, j] + bl[i, j]) / 4 >= level
+                for mask, edge_names_list in ((center, center_above), (~center, center_below)):
+                    for edge_names in edge_names_list:
+                        add(edge_names, i[mask], j[mask])
+
+    if not edges_1:
+        return [], [], np.empty((0, 2)), np.empty((0, 2))
+
+    x, pixel_width, _, y, _, pixel_height = geo_transform
+    def points(rows: List[Any], columns: List[Any]) -> Any:
+        return np.stack((y + (np.concatenate(rows) + .5) * pixel_height, x + (np.concatenate(columns) + .5) * pixel_width), axis=1)
+
+    return (np.concatenate(edges_1).tolist(), np.concatenate(edges_2).tolist(),
+            points(rows_1, columns_1), points(rows_2, columns_2))
+
+def _add_segments(lines: _Lines, values: Any, level: float, row: int, column: int, geo_transform: GeoTransform) -> None:
+    edges_1, edges_2, points_1, points_2 = _get_segments(values, level, row, column, geo_transform)
+    for edge_1, edge_2, point_1, point_2 in zip(edges_1, edges_2, map(tuple, points_1.tolist()), map(tuple, points_2.tolist())):
+        lines.add(edge_1, edge_2, point_1, point_2)
+
+def _to_float(values: Any, nodata: int) -> Any:
+    import numpy as np
+
+    result = values.astype(np.float64)
+    result[values == nodata] = np.nan
+    return result
+
+def get_region_contours(values: Any, geo_transform: GeoTransform, levels: Iterable[float], nodata: int=mod_data.NODATA) -> Dict[float, List[Polyline]]:
+    """
+    Contour lines of a region (for example from GeoElevationData.get_region),
+    level -> list of polylines.
+    """
+    float_values = _to_float(values, nodata)
+    result = {}
+    for level in levels:
+        lines = _Lines()
+        _add_segments(lines, float_values, level, 0, 0, geo_transform)
+        result[level] = lines.pop_finished()
+    return result
+
+def iter_contours(geo_elevation_data: mod_data.GeoElevationData, levels: Iterable[float], latitude_min: float, latitude_max: float,
+                  longitude_min: float, longitude_max: float, samples_per_degree: Optional[int]=None) -> Iterator[Tuple[float, Polyline]]:
+    """
+    Yields (level, polyline) for all contour lines in the interval.
+
+    The interval is processed file by file, from north to south. Lines are
+    yielded as soon as they can't continue in files not processed yet, so
+    only the lines crossing the current row of files are kept in memory
+    (use batch_mode=True for large intervals).
+    """
+    levels = list(levels)
+    if latitude_min > latitude_max or longitude_min > longitude_max:
+        raise Exception(f'Invalid interval ({latitude_min}, {latitude_max}), ({longitude_min}, {longitude_max})')
+
+    s = samples_per_degree or geo_elevation_data.get_samples_per_degree(latitude_min, latitude_max, longitude_min, longitude_max)
+    # Same as in GeoElevationData.get_region:
+    k_max = mod_math.floor(latitude_max * s + 1e-6)
+    k_min = mod_math.ceil(latitude_min * s - 1e-6)
+    m_min = mod_math.ceil(longitude_min * s - 1e-6)
+    m_max = mod_math.floor(longitude_max * s + 1e-6)
+    geo_transform = ((m_min - .5) / s, 1. / s, 0., (k_max + .5) / s, 0., -1. / s)
+
+    lines = {level: _Lines() for level in levels}
+    k_to = k_max
+    while k_to > k_min:
+        # Files overlap in one row (column), so are the blocks of points:
+        k_from = max(k_min, (k_to - 1) // s * s)
+        m_from = m_min
+        while m_from < m_max:
+            m_to = min(m_max, (m_from // s + 1) * s)
+            values, _ = geo_elevation_data.get_region(k_from / s, k_to / s, m_from / s, m_to / s, samples_per_degree=s)
+            float_values = _to_float(values, mod_data.NODATA)
+            for level in levels:
+                _add_segments(lines[level], float_values, level, k_max - k_to, m_from - m_min, geo_transform)
+            m_from = m_to
+
+        # Only lines ending on the south border can continue:
+        south_row = k_max - k_from
+        def is_open(edge: int) -> bool:
+            return edge % 2 == 0 and edge // 2 // MAX_COLUMNS == south_row
+        for level in levels:
+            for polyline in lines[level].pop_finished(is_open if k_from > k_min else None):
+                yield level, polyline
+        k_to = k_from
+
+def get_contours(geo_elevation_data: mod_data.GeoElevationData, levels: Iterable[float], latitude_min: float, latitude_max: float,
+                 longitude_min: float, longitude_max: float, samples_per_degree: Optional[int]=None) -> Dict[float, List[Polyline]]:
+    """ Same as iter_contours, but returns level -> list of polylines. """
+    levels = list(levels)
+    result: Dict[float, List[Polyline]] = {level: [] for level in levels}
+    for level, polyline in iter_contours(geo_elevation_data, levels, latitude_min, latitude_max, longitude_min, longitude_max,
+                                         samples_per_degree=samples_per_degree):
+        result[level].append(polyline)
+    return result
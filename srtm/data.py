@@ -18,16 +18,61 @@
 Classes containing parsed elevation data.
 """
 
+import array as mod_array
+import collections as mod_collections
 import logging as mod_logging
 import math as mod_math
 import re as mod_re
-import struct as mod_struct
-import requests as mod_requests
+import time as mod_time
 
 from . import utils as mod_utils
+from . import chunked as mod_chunked
+from . import failures as mod_failures
+from . import geoid as mod_geoid
+from . import tracing as mod_tracing
 
 from typing import *
 
+if TYPE_CHECKING:
+    from . import shared as mod_shared
+
+# Contents of a .hgt file (or an object which behaves like one), or its
+# decoded values (array('h') or a memoryview with the 'h' format):
+TileData = Union[bytes, memoryview, "mod_array.array[int]", mod_chunked.ChunkedFile]
+
+# Sizes of SRTM1 and SRTM3 files:
+VALID_FILE_SIZES = (3601 * 3601 * 2, 1201 * 1201 * 2)
+
+SRTM1 = 'SRTM1'
+SRTM3 = 'SRTM3'
+
+# Distance between points (meters, along meridians), file sizes and the
+# number of points per side of the datasets:
+DATASET_RESOLUTIONS = {SRTM1: 30., SRTM3: 90.}
+DATASET_FILE_SIZES = {SRTM1: 3601 * 3601 * 2, SRTM3: 1201 * 1201 * 2}
+DATASET_SQUARE_SIDES = {SRTM1: 3601, SRTM3: 1201}
+
+# Files with more invalid points are used only if there is no other file:
+DEFAULT_MAX_VOID_FRACTION = .1
+
+# The memo is off by default (it slows down points which are not repeated),
+# MEMO_SIZE is a good size for GPS logs and similar:
+DEFAULT_MEMO_SIZE = 0
+MEMO_SIZE = 2 ** 14
+
+class MemoStats(NamedTuple):
+    hits: int
+    misses: int
+    # Number of cells memoized:
+    size: int
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / (self.hits + self.misses) if self.hits + self.misses else 0.
+
+# SRTM value for points without a valid elevation:
+NODATA = -32768
+
 class GeoElevationData:
     """
     The main class with utility methods for elevations. Note that files are
@@ -35,21 +80,84 @@ class GeoElevationData:
     the earth -- this will load *many* files in memory!
     """
 
-    def __init__(self, srtm1_files: Dict[str, str], srtm3_files: Dict[str, str], file_handler: mod_utils.FileHandler,
-                 leave_zipped: bool=False, batch_mode: bool=False, timeout: int = 0) -> None:
+    def __init__(self, srtm1_files: MutableMapping[str, str], srtm3_files: MutableMapping[str, str], file_handler: mod_utils.FileHandler,
+                 leave_zipped: bool=False, batch_mode: bool=False, timeout: int = 0,
+                 tile_store: Optional["mod_shared.SharedTileStore"]=None, chunked: bool=False,
+                 height_reference: str=mod_geoid.GEOID, geoid: Optional[mod_geoid.Geoid]=None,
+                 resolution: Optional[float]=None, max_void_fraction: float=DEFAULT_MAX_VOID_FRACTION,
+                 memo_size: int=DEFAULT_MEMO_SIZE, failure_policy: str=mod_failures.RAISE,
+                 failures: Optional[mod_failures.Failures]=None) -> None:
         self.srtm1_files = srtm1_files
         self.srtm3_files = srtm3_files
         self.leave_zipped = leave_zipped
+        self.chunked = chunked
         self.file_handler = file_handler # TODO: file_handler mypy
         self.timeout = timeout
 
         # Lazy loaded files used in current app:
         self.files: Dict[str, GeoElevationFile] = {}
+        # Files which don't exist:
+        self.missing_file_names: Set[str] = set()
 
         self.batch_mode = batch_mode
 
-    def get_elevation(self, latitude: float, longitude: float, approximate: bool=False) -> Optional[float]:
-        geo_elevation_file = self.get_file(float(latitude), float(longitude))
+        # If set, files are shared with other processes using the same store:
+        self.tile_store = tile_store
+
+        # Elevations are above the geoid (like in SRTM files) or above the
+        # ellipsoid (geoid is lazy loaded if needed):
+        if height_reference not in (mod_geoid.GEOID, mod_geoid.ELLIPSOID):
+            raise Exception(f'Invalid height reference {height_reference}')
+        self.height_reference = height_reference
+        self.geoid = geoid
+
+        # Target distance between points in meters (see get_datasets), None
+        # to always use SRTM1 if there is a SRTM1 file:
+        self.resolution = resolution
+        self.max_void_fraction = max_void_fraction
+
+        # Elevations of the memo_size most recently used cells (see get_cell),
+        # 0 to disable:
+        self.memo_size = memo_size
+        self.memo: "mod_collections.OrderedDict[Tuple[int, int, int, int, int, int, Optional[float]], Optional[float]]" = mod_collections.OrderedDict()
+        self.memo_hits = 0
+        self.memo_misses = 0
+
+        # Points in files which can't be retrieved raise an exception (RAISE)
+        # or have no elevation (NONE). Failed files and servers are not
+        # retried for some time (see srtm.failures):
+        if failure_policy not in (mod_failures.RAISE, mod_failures.NONE):
+            raise Exception(f'Invalid failure policy {failure_policy}')
+        self.failure_policy = failure_policy
+        self.failures = failures or mod_failures.Failures(file_handler)
+        # Files which failed with the NONE policy -> time until which they
+        # aren't tried again (by this object):
+        self.failed_files: Dict[str, float] = {}
+
+    def get_geoid(self) -> mod_geoid.Geoid:
+        if self.geoid is None:
+            self.geoid = mod_geoid.get_geoid(local_cache_dir=self.file_handler.local_cache_dir)
+        return self.geoid
+
+    def get_elevation(self, latitude: float, longitude: float, approximate: bool=False, height_reference: Optional[str]=None,
+                      resolution: Optional[float]=None) -> Optional[float]:
+        """
+        height_reference is GEOID or ELLIPSOID (see srtm.geoid), by default
+        the height_reference of this object.
+
+        resolution is the target distance between points in meters (see
+        get_file), by default the resolution of this object.
+
+        Without approximation, elevations of recently used cells are
+        memoized (see get_memo_stats).
+        """
+        if not approximate and self.memo_size:
+            elevation = self._get_cell_elevation(float(latitude), float(longitude), resolution)
+            if elevation is not None and (height_reference or self.height_reference) == mod_geoid.ELLIPSOID:
+                return elevation + self.get_geoid().undulation(float(latitude), float(longitude))
+            return elevation
+
+        geo_elevation_file = self.get_file(float(latitude), float(longitude), resolution=resolution)
 
         #mod_logging.debug('File for ({0}, {1}) -> {2}'.format(
         #                  latitude, longitude, geo_elevation_file))
@@ -57,7 +165,136 @@ class GeoElevationData:
         if not geo_elevation_file:
             return None
 
-        return geo_elevation_file.get_elevation(float(latitude), float(longitude), approximate)
+        return self._get_file_elevation(geo_elevation_file, latitude, longitude, approximate, height_reference)
+
+    def _get_cell_elevation(self, latitude: float, longitude: float, resolution: Optional[float]) -> Optional[float]:
+        """ Elevation (above the geoid) of the cell with the point, memoized. """
+        # Same as get_cell (inlined):
+        file_latitude, file_longitude = mod_math.floor(latitude), mod_math.floor(longitude)
+        y, x = file_latitude + 1 - latitude, longitude - file_longitude
+        key = (file_latitude, file_longitude, mod_math.floor(y * 3600), mod_math.floor(y * 1200), mod_math.floor(x * 3600), mod_math.floor(x * 1200),
+               self.resolution if resolution is None else resolution)
+        memo = self.memo
+        # (NODATA is never an elevation, invalid points are None)
+        elevation = memo.get(key, NODATA)
+        if elevation != NODATA:
+            memo.move_to_end(key)
+            self.memo_hits += 1
+            return elevation
+
+        self.memo_misses += 1
+        geo_elevation_file = self.get_file(latitude, longitude, resolution=resolution)
+        elevation = geo_elevation_file.get_elevation(latitude, longitude) if geo_elevation_file else None
+        memo[key] = elevation
+        if len(memo) > self.memo_size:
+            memo.popitem(last=False)
+        return elevation
+
+    def get_memo_stats(self) -> MemoStats:
+        return MemoStats(self.memo_hits, self.memo_misses, len(self.memo))
+
+    def clear_memo(self) -> None:
+        self.memo.clear()
+        self.memo_hits = self.memo_misses = 0
+
+    def get_failure_stats(self) -> mod_failures.FailureStats:
+        return self.failures.get_stats()
+
+    def get_elevation_and_dataset(self, latitude: float, longitude: float, approximate: bool=False, height_reference: Optional[str]=None,
+                                  resolution: Optional[float]=None) -> Tuple[Optional[float], Optional[str]]:
+        """ Same as get_elevation, but also returns the dataset used (SRTM1 or SRTM3, None if there is no file). """
+        geo_elevation_file = self.get_file(float(latitude), float(longitude), resolution=resolution)
+        if not geo_elevation_file:
+            return None, None
+        return self._get_file_elevation(geo_elevation_file, latitude, longitude, approximate, height_reference), geo_elevation_file.dataset
+
+    def _get_file_elevation(self, geo_elevation_file: "GeoElevationFile", latitude: float, longitude: float, approximate: bool,
+                            height_reference: Optional[str]) -> Optional[float]:
+        elevation = geo_elevation_file.get_elevation(float(latitude), float(longitude), approximate)
+        if elevation is not None and (height_reference or self.height_reference) == mod_geoid.ELLIPSOID:
+            return elevation + self.get_geoid().undulation(float(latitude), float(longitude))
+        return elevation
+
+    def get_elevations(self, points: Sequence[Tuple[float, float]], approximate: bool=False, height_reference: Optional[str]=None,
+                       order: Optional[str]=None, resolution: Optional[float]=None) -> List[Optional[float]]:
+        """
+        Elevations of many (latitude, longitude) points, in the same order as
+        points.
+
+        If order is mod_utils.HILBERT or mod_utils.Z_ORDER, points are
+        processed sorted along that curve, so points in the same file (and
+        in the same part of the file) are processed together. This helps
+        when points are spread randomly over a large area and not all files
+        can be kept in memory (batch_mode, chunked files, a tile store).
+
+        Without approximation, the elevation of every cell (see get_cell) is
+        found only once, even if the memo is disabled.
+        """
+        if order:
+            indexes = mod_utils.get_locality_order(points, order)
+        else:
+            indexes = list(range(len(points)))
+
+        result: List[Optional[float]] = [None] * len(points)
+        if approximate:
+            for i in indexes:
+                latitude, longitude = points[i]
+                result[i] = self.get_elevation(latitude, longitude, approximate=approximate, height_reference=height_reference, resolution=resolution)
+            return result
+
+        ellipsoid = (height_reference or self.height_reference) == mod_geoid.ELLIPSOID
+        cells: Dict[Tuple[int, int, int, int, int, int], Optional[float]] = {}
+        for i in indexes:
+            latitude, longitude = float(points[i][0]), float(points[i][1])
+            cell = get_cell(latitude, longitude)
+            if cell in cells:
+                elevation = cells[cell]
+            else:
+                elevation = cells[cell] = self.get_elevation(latitude, longitude, height_reference=mod_geoid.GEOID, resolution=resolution)
+            if elevation is not None and ellipsoid:
+                elevation += self.get_geoid().undulation(latitude, longitude)
+            result[i] = elevation
+        return result
+
+    def get_elevations_array(self, latitudes: Any, longitudes: Any, height_reference: Optional[str]=None, resolution: Optional[float]=None) -> Any:
+        """
+        Same as get_elevation (without approximation) for numpy arrays of
+        latitudes and longitudes. Returns a float64 numpy array, with NaN for
+        points without an elevation.
+
+        Points are grouped by file, every file is loaded once and its
+        elevations are read without a Python loop over the points.
+        """
+        import numpy as np # type: ignore
+
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        if latitudes.shape != longitudes.shape:
+            raise Exception(f'Latitudes and longitudes have different shapes {latitudes.shape} and {longitudes.shape}')
+
+        result = np.full(latitudes.shape, np.nan)
+        flat_latitudes, flat_longitudes, flat_result = latitudes.ravel(), longitudes.ravel(), result.reshape(-1)
+
+        indexes = np.flatnonzero(np.isfinite(flat_latitudes) & np.isfinite(flat_longitudes))
+        file_latitudes = np.floor(flat_latitudes[indexes])
+        file_longitudes = np.floor(flat_longitudes[indexes])
+        order = np.argsort((file_latitudes + 90) * 1000 + file_longitudes + 180, kind='stable')
+        indexes, file_latitudes, file_longitudes = indexes[order], file_latitudes[order], file_longitudes[order]
+
+        starts = np.flatnonzero((np.diff(file_latitudes) != 0) | (np.diff(file_longitudes) != 0)) + 1
+        for start, end in zip([0] + starts.tolist(), starts.tolist() + [len(indexes)]):
+            if start == end:
+                continue
+            geo_file = self.get_file(float(file_latitudes[start]) + .5, float(file_longitudes[start]) + .5, resolution=resolution)
+            if not geo_file:
+                continue
+            file_indexes = indexes[start : end]
+            flat_result[file_indexes] = geo_file.get_elevations_array(flat_latitudes[file_indexes], flat_longitudes[file_indexes])
+
+        if (height_reference or self.height_reference) == mod_geoid.ELLIPSOID:
+            valid = ~np.isnan(result)
+            result[valid] += self.get_geoid().undulations(latitudes[valid], longitudes[valid])
+        return result
 
     def _IDW(self, latitude: float, longitude: float, radius: float=1) -> Optional[float]:
         """
@@ -84,92 +321,250 @@ class GeoElevationData:
             return None
         return tile._InverseDistanceWeighted(latitude, longitude, radius)
 
-    def get_file(self, latitude: float, longitude: float) -> Optional["GeoElevationFile"]:
+    def get_file(self, latitude: float, longitude: float, resolution: Optional[float]=None) -> Optional["GeoElevationFile"]:
         """
         If the file can't be found -- it will be retrieved from the server.
+
+        Without a resolution (here or in this object) the SRTM1 file is used
+        if there is one. With a resolution (the target distance between
+        points in meters) files of the datasets are tried in the order of
+        get_datasets, so the smallest file good enough is used. A dataset
+        is skipped if the file doesn't exist or if more than
+        max_void_fraction of its points are invalid (unless there is no
+        other file).
         """
-        file_name = self.get_file_name(latitude, longitude)
+        file_name = get_file_name(latitude, longitude)
+
+        if resolution is None:
+            resolution = self.resolution
+        if resolution is None:
+            return self._get_file(file_name, None)
+
+        result = None
+        for dataset in get_datasets(resolution):
+            geo_file = self._get_file(file_name, dataset)
+            if not geo_file:
+                continue
+            if geo_file.get_void_fraction() <= self.max_void_fraction:
+                return geo_file
+            mod_logging.debug(f'{geo_file} has {geo_file.get_void_fraction():.0%} invalid points')
+            result = result or geo_file
+        return result
 
-        if not file_name:
-            return None
+    def _get_file(self, file_name: str, dataset: Optional[str]) -> Optional["GeoElevationFile"]:
+        """ The file of the dataset (or of any dataset if None). """
+        key = get_dataset_file_name(file_name, dataset)
 
-        if (file_name in self.files):
-            return self.files[file_name]
+        if (key in self.files):
+            return self.files[key]
+        elif key in self.missing_file_names:
+            return None
+        elif key in self.failed_files and mod_time.time() < self.failed_files[key]:
+            self.failures.fast_failures += 1
+            return None
         else:
-            data = self.retrieve_or_load_file_data(file_name)
-            if not data:
+            # Stored files are used without checking the urls (so they are
+            # loaded only when a file must be retrieved):
+            if not self.is_file_stored(file_name, dataset) and self.get_file_url(file_name, dataset) is None:
+                self.missing_file_names.add(key)
                 return None
-
-            result = GeoElevationFile(file_name, data, self)
+            with mod_tracing.span(mod_tracing.LOAD_FILE, file_name=key):
+                try:
+                    data = self.load_file_data(file_name, dataset)
+                except Exception as e:
+                    if self.failure_policy == mod_failures.RAISE:
+                        raise
+                    mod_logging.debug(f'No elevations in {key}: {e}')
+                    self.failed_files[key] = self.failures.get_retry_time(key)
+                    return None
+                if not data:
+                    if dataset:
+                        self.missing_file_names.add(key)
+                    return None
+
+                result = GeoElevationFile(file_name, data, self)
 
             # Store file (if in batch mode, just keep most recent)
             if self.batch_mode:
-                self.files = {file_name: result}
+                if self.tile_store is not None:
+                    for previous_key in self.files:
+                        self.tile_store.release(previous_key)
+                self.files = {key: result}
             else:
-                self.files[file_name] = result
+                self.files[key] = result
 
             return result
 
-    def retrieve_or_load_file_data(self, file_name: str) -> Optional[bytes]:
+    def get_dataset_file(self, file_name: str, dataset: str) -> Optional["GeoElevationFile"]:
+        """ The file of the dataset (None if there is no such file). """
+        geo_file = self.files.get(file_name)
+        if geo_file is not None and geo_file.dataset == dataset:
+            return geo_file
+        return self._get_file(file_name, dataset)
+
+    def unload_files(self, keys: Iterable[str]) -> None:
+        """ Removes loaded files (keys of self.files), they are loaded again when needed. """
+        for key in list(keys):
+            if self.files.pop(key, None) is not None and self.tile_store is not None:
+                self.tile_store.release(key)
+
+    def load_file_data(self, file_name: str, dataset: Optional[str]=None) -> Optional[TileData]:
+        """
+        Same as retrieve_or_load_file_data, but when a tile store is used the
+        file is taken from (or published to) the shared memory.
+        """
+        if self.tile_store is None:
+            return self.retrieve_or_load_file_data(file_name, dataset)
+
+        # Files are stored decoded (in the native byte order):
+        key = get_dataset_file_name(file_name, dataset)
+        shared_data = self.tile_store.get(key)
+        if shared_data is not None:
+            return shared_data.cast('h')
+
+        data = self.retrieve_or_load_file_data(file_name, dataset)
+        if not data:
+            return None
+        if isinstance(data, mod_chunked.ChunkedFile):
+            data = data[0 : len(data)]
+        values = data if isinstance(data, mod_array.array) else _decode(key, data)
+        return self.tile_store.put(key, memoryview(values).cast('B')).cast('h')
+
+    def retrieve_or_load_file_data(self, file_name: str, dataset: Optional[str]=None) -> Optional[TileData]:
+        data = self.load_stored_file_data(file_name, dataset)
+        if data is not None:
+            return data
+        return self.retrieve_file_data(file_name, dataset=dataset)
+
+    def load_stored_file_data(self, file_name: str, dataset: Optional[str]=None) -> Optional[TileData]:
+        """
+        Loads the file from the file handler, None if it is not stored.
+
+        Files of a dataset are stored with the dataset in the name (see
+        get_dataset_file_name), but a file stored without it is used if it
+        is of that dataset.
+        """
+        if dataset:
+            data = self.load_stored_file_data(get_dataset_file_name(file_name, dataset))
+            if data is None:
+                data = self.load_stored_file_data(file_name)
+                if data is not None and len(data) != DATASET_FILE_SIZES[dataset]:
+                    return None
+            return data
+
         data_file_name = file_name
         zip_data_file_name = '{0}.zip'.format(file_name)
+        chunked_data_file_name = file_name + mod_chunked.EXTENSION
+
+        if self.chunked and self._exists(chunked_data_file_name):
+            return mod_chunked.ChunkedFile.from_file_handler(self.file_handler, chunked_data_file_name)
+        elif self._exists(data_file_name):
+            return self._read(data_file_name)
+        elif self._exists(zip_data_file_name):
+            byts = self._read(zip_data_file_name)
+            return _unzip(zip_data_file_name, byts)
+        elif not self.chunked and self._exists(chunked_data_file_name):
+            return mod_chunked.ChunkedFile.from_file_handler(self.file_handler, chunked_data_file_name)
+        return None
 
-        data: Optional[bytes] = None
-        if self.file_handler.exists(data_file_name):
-            return self.file_handler.read(data_file_name)
-        elif self.file_handler.exists(zip_data_file_name):
-            byts = self.file_handler.read(zip_data_file_name)
-            return mod_utils.unzip(byts)
+    def _exists(self, file_name: str) -> bool:
+        with mod_tracing.span(mod_tracing.EXISTS, file_name=file_name):
+            return self.file_handler.exists(file_name)
 
-        url = None
+    def _read(self, file_name: str) -> bytes:
+        with mod_tracing.span(mod_tracing.READ, file_name=file_name) as span:
+            result = self.file_handler.read(file_name)
+            span.set(bytes=len(result))
+            return result
 
-        if (file_name in self.srtm1_files):
-            url = self.srtm1_files[file_name]
-        elif (file_name in self.srtm3_files):
-            url = self.srtm3_files[file_name]
+    def is_file_stored(self, file_name: str, dataset: Optional[str]=None) -> bool:
+        """ With a dataset, a file stored without the dataset in the name may be of another dataset. """
+        if dataset and self.is_file_stored(get_dataset_file_name(file_name, dataset)):
+            return True
+        return any(self._exists(file_name + extension) for extension in ('', '.zip', mod_chunked.EXTENSION))
+
+    def get_file_url(self, file_name: str, dataset: Optional[str]=None) -> Optional[str]:
+        """ Url of the file of the dataset (of SRTM1 if there is one, if dataset is None). """
+        for files_dataset, files in ((SRTM1, self.srtm1_files), (SRTM3, self.srtm3_files)):
+            if dataset in (None, files_dataset) and file_name in files:
+                return files[file_name]
+        return None
+
+    def retrieve_file_data(self, file_name: str, leave_zipped: Optional[bool]=None, chunked: Optional[bool]=None,
+                           dataset: Optional[str]=None) -> Optional[bytes]:
+        """
+        Downloads the file, checks it and saves it with the file handler (as
+        .hgt, .hgt.zip or chunked, by default depending on leave_zipped and
+        chunked of this object). Returns the unzipped contents.
+
+        With a dataset the file of that dataset is downloaded, and saved with
+        the dataset in the name.
+        """
+        data_file_name = get_dataset_file_name(file_name, dataset)
+        chunked_data_file_name = data_file_name + mod_chunked.EXTENSION
+
+        import requests as mod_requests
+
+        url = self.get_file_url(file_name, dataset)
 
         if not url:
             #mod_logging.error('No file found: {0}'.format(file_name))
             return None
 
-        try:
-            r = mod_requests.get(url, timeout=self.timeout or mod_utils.DEFAULT_TIMEOUT)
-        except mod_requests.exceptions.Timeout:
-            raise Exception('Connection to %s failed (timeout)' % url)
-        if r.status_code < 200 or 300 <= r.status_code:
-            raise Exception('Cannot retrieve %s' % url)
-        mod_logging.info('Retrieving {0}'.format(url))
-        data = r.content
-        mod_logging.info('Retrieved {0} ({1} bytes)'.format(url, len(data)))
-
-        if not data:
+        error = self.failures.get_file_failure(data_file_name)
+        if error is not None:
+            raise Exception(f'{data_file_name} failed recently ({error})')
+        self.failures.check_server(url)
+
+        with mod_tracing.span(mod_tracing.FETCH, file_name=data_file_name, url=url) as span:
+            try:
+                r = mod_requests.get(url, timeout=self.timeout or mod_utils.DEFAULT_TIMEOUT)
+            except mod_requests.exceptions.Timeout:
+                self.failures.add_server_failure(url)
+                raise Exception('Connection to %s failed (timeout)' % url)
+            except mod_requests.exceptions.RequestException:
+                self.failures.add_server_failure(url)
+                raise
+            if r.status_code >= 500:
+                self.failures.add_server_failure(url)
+                raise Exception('Cannot retrieve %s' % url)
+            self.failures.add_server_success(url)
+            if r.status_code < 200 or 300 <= r.status_code:
+                self.failures.add_file_failure(data_file_name, f'HTTP status {r.status_code}')
+                raise Exception('Cannot retrieve %s' % url)
+            mod_logging.info('Retrieving {0}'.format(url))
+            zipped_data = r.content
+            span.set(bytes=len(zipped_data))
+        mod_logging.info('Retrieved {0} ({1} bytes)'.format(url, len(zipped_data)))
+
+        if not zipped_data:
             return None
 
         # data is zipped:
-
-        if self.leave_zipped:
-            self.file_handler.write(data_file_name + '.zip', data)
-            data = mod_utils.unzip(data)
-        else:
-            data = mod_utils.unzip(data)
-            self.file_handler.write(data_file_name, data)
+        try:
+            data = _unzip(data_file_name, zipped_data)
+            check_file_data(file_name, data, dataset)
+        except Exception as e:
+            self.failures.add_file_failure(data_file_name, str(e) or repr(e))
+            raise
+
+        with mod_tracing.span(mod_tracing.WRITE, file_name=data_file_name) as span:
+            if self.chunked if chunked is None else chunked:
+                contents = mod_chunked.compress(data)
+                self.file_handler.write(chunked_data_file_name, contents)
+            elif self.leave_zipped if leave_zipped is None else leave_zipped:
+                contents = zipped_data
+                self.file_handler.write(data_file_name + '.zip', contents)
+            else:
+                contents = data
+                self.file_handler.write(data_file_name, contents)
+            span.set(bytes=len(contents))
 
         return data
 
     def get_file_name(self, latitude: float, longitude: float) -> Optional[str]:
-        # Decide the file name:
-        if latitude >= 0:
-            north_south = 'N'
-        else:
-            north_south = 'S'
-
-        if longitude >= 0:
-            east_west = 'E'
-        else:
-            east_west = 'W'
-
-        file_name = '%s%s%s%s.hgt' % (north_south, str(int(abs(mod_math.floor(latitude)))).zfill(2),
-                                      east_west, str(int(abs(mod_math.floor(longitude)))).zfill(3))
+        """ Name of the file with the point, None if there is no such file. """
+        file_name = get_file_name(latitude, longitude)
 
         if not (file_name in self.srtm1_files) and not (file_name in self.srtm3_files):
             #mod_logging.debug('No file found for ({0}, {1}) (file_name: {2})'.format(latitude, longitude, file_name))
@@ -177,6 +572,93 @@ class GeoElevationData:
 
         return file_name
 
+    def get_region(self, latitude_min: float, latitude_max: float, longitude_min: float, longitude_max: float,
+                   nodata: int=NODATA, samples_per_degree: Optional[int]=None,
+                   height_reference: Optional[str]=None) -> Tuple[Any, Tuple[float, float, float, float, float, float]]:
+        """
+        Returns a numpy int16 array with elevations of all SRTM points in the
+        interval and its geotransform (in the GDAL order: longitude of the
+        upper left corner, pixel width, 0, latitude of the upper left corner,
+        0, -pixel height).
+
+        Row 0 is the northernmost row. The first/last row and column of
+        adjacent files are the same points, they are used only once. Points
+        without a file (for example oceans) or with invalid elevations are
+        set to nodata.
+
+        samples_per_degree is the resolution of the result (3600 for SRTM1,
+        1200 for SRTM3). By default the resolution of the first file found is
+        used. Files with another resolution are resampled (nearest point).
+
+        With the ELLIPSOID height_reference elevations are rounded to meters.
+        """
+        import numpy as np # type: ignore
+
+        if latitude_min > latitude_max or longitude_min > longitude_max:
+            raise Exception(f'Invalid interval ({latitude_min}, {latitude_max}), ({longitude_min}, {longitude_max})')
+
+        s = samples_per_degree or self.get_samples_per_degree(latitude_min, latitude_max, longitude_min, longitude_max)
+
+        # Indexes of the northernmost/southernmost and westernmost/easternmost
+        # points (the latitude of a point is k / s and the longitude m / s):
+        k_max = mod_math.floor(latitude_max * s + 1e-6)
+        k_min = mod_math.ceil(latitude_min * s - 1e-6)
+        m_min = mod_math.ceil(longitude_min * s - 1e-6)
+        m_max = mod_math.floor(longitude_max * s + 1e-6)
+
+        result = np.full((max(0, k_max - k_min + 1), max(0, m_max - m_min + 1)), nodata, dtype=np.int16)
+
+        # Files are processed from north to south, from west to east. The last
+        # row (column) of a file will be overwritten by the first row (column)
+        # of the next file, unless it is invalid there.
+        for file_latitude in range(k_max // s, k_min // s - 2, -1):
+            for file_longitude in range(m_min // s - 1, m_max // s + 1):
+                k_from, k_to = max(k_min, file_latitude * s), min(k_max, (file_latitude + 1) * s)
+                m_from, m_to = max(m_min, file_longitude * s), min(m_max, (file_longitude + 1) * s)
+                if k_from > k_to or m_from > m_to:
+                    continue
+
+                geo_file = self.get_file(file_latitude + .5, file_longitude + .5)
+                if not geo_file:
+                    continue
+
+                t = geo_file.square_side - 1
+                columns = (np.arange(m_from, m_to + 1) - file_longitude * s) * t
+                columns = (columns + s // 2) // s
+                column_from, column_to = int(columns[0]), int(columns[-1])
+                for k in range(k_to, k_from - 1, -1):
+                    row = (((file_latitude + 1) * s - k) * t + s // 2) // s
+                    values = geo_file.get_row_values(row, column_from, column_to + 1)
+                    if t != s:
+                        values = values[columns - column_from]
+                    invalid = (values > 10000) | (values < -1000)
+                    target = result[k_max - k, m_from - m_min : m_to - m_min + 1]
+                    target[~invalid] = values[~invalid]
+
+        if (height_reference or self.height_reference) == mod_geoid.ELLIPSOID and result.size:
+            latitudes = np.arange(k_max, k_min - 1, -1) / s
+            longitudes = np.arange(m_min, m_max + 1) / s
+            undulations = self.get_geoid().undulations(latitudes[:, np.newaxis], longitudes[np.newaxis, :])
+            valid = result != nodata
+            result[valid] = np.rint(result[valid] + undulations[valid]).astype(np.int16)
+
+        geo_transform = ((m_min - .5) / s, 1. / s, 0., (k_max + .5) / s, 0., -1. / s)
+        return result, geo_transform
+
+    def get_samples_per_degree(self, latitude_min: float, latitude_max: float, longitude_min: float, longitude_max: float) -> int:
+        """ Resolution of the first file found in the interval (1200 if there is none). """
+        for latitude, longitude in self._get_file_positions(latitude_min, latitude_max, longitude_min, longitude_max):
+            geo_file = self.get_file(latitude, longitude)
+            if geo_file:
+                return geo_file.square_side - 1
+        return 1200
+
+    def _get_file_positions(self, latitude_min: float, latitude_max: float, longitude_min: float, longitude_max: float) -> Iterator[Tuple[float, float]]:
+        """ Positions (one for every file) in the interval. """
+        for latitude in range(mod_math.floor(latitude_max), mod_math.floor(latitude_min) - 1, -1):
+            for longitude in range(mod_math.floor(longitude_min), mod_math.floor(longitude_max) + 1):
+                yield min(max(latitude + .5, latitude_min), latitude_max), min(max(longitude + .5, longitude_min), longitude_max)
+
     def get_image(self, size: Tuple[int, int], latitude_interval: Tuple[float, float], longitude_interval: Tuple[float, float], max_elevation: float, min_elevation: float=0,
                   unknown_color: mod_utils.Color = mod_utils.Color(255, 255, 255, 255), zero_color: mod_utils.Color = mod_utils.Color(0, 0, 255, 255),
                   min_color: mod_utils.Color = mod_utils.Color(0, 0, 0, 255), max_color: mod_utils.Color = mod_utils.Color(0, 255, 0, 255),
@@ -319,8 +801,11 @@ class GeoElevationFile:
     """
 
 
-    def __init__(self, file_name: str, data: bytes, geo_elevation_data: GeoElevationData) -> None:
-        """ Data is a raw file contents of the file. """
+    def __init__(self, file_name: str, data: TileData, geo_elevation_data: GeoElevationData) -> None:
+        """
+        Data is a raw file contents of the file (decoded here, once) or its
+        decoded values. Chunked files are decoded block by block when needed.
+        """
 
         self.url: Optional[str] = None
         self.geo_elevation_data = geo_elevation_data
@@ -330,14 +815,43 @@ class GeoElevationFile:
         self.longitude: float = 0
         self.parse_file_name_starting_position()
 
-        self.data = data
+        # Elevations (in the native byte order), values[row * square_side + column]:
+        self.values: Union["mod_array.array[int]", memoryview, mod_chunked.ChunkedValues]
+        if isinstance(data, mod_chunked.ChunkedFile):
+            self.values = mod_chunked.ChunkedValues(data)
+        elif isinstance(data, mod_array.array) or (isinstance(data, memoryview) and data.format == 'h'):
+            self.values = data
+        else:
+            self.values = _decode(file_name, data)
+        # The chunked file, or the values (the raw big-endian contents are not kept):
+        self.data: Union[TileData, mod_chunked.ChunkedValues] = data if isinstance(data, mod_chunked.ChunkedFile) else self.values
 
-        square_side = mod_math.sqrt(len(self.data) / 2.)
-        assert square_side == int(square_side), 'Invalid file size: {0} for file {1}'.format(len(self.data), self.file_name)
+        square_side = mod_math.sqrt(len(self.values))
+        assert square_side == int(square_side), 'Invalid file size: {0} for file {1}'.format(len(self.values) * 2, self.file_name)
 
         self.resolution = 1.0 / (square_side - 1)
         self.square_side = int(square_side)
 
+        self.void_fraction: Optional[float] = None
+
+    @property
+    def dataset(self) -> str:
+        """ SRTM1 or SRTM3. """
+        return SRTM1 if self.square_side == DATASET_SQUARE_SIDES[SRTM1] else SRTM3
+
+    def get_void_fraction(self, samples: int=40000) -> float:
+        """ Fraction of invalid points (estimated from about samples points evenly spread over the file). """
+        if self.void_fraction is None:
+            step = max(1, len(self.values) // samples)
+            indexes = range(step // 2, len(self.values), step)
+            voids = 0
+            for i in indexes:
+                value = self.values[i]
+                if value > 10000 or value < -1000:
+                    voids += 1
+            self.void_fraction = voids / len(indexes)
+        return self.void_fraction
+
     def get_row_and_column(self, latitude: float, longitude: float) -> Tuple[int, int]:
         return mod_math.floor((self.latitude + 1 - latitude) * float(self.square_side - 1)), \
                mod_math.floor((longitude - self.longitude) * float(self.square_side - 1))
@@ -375,16 +889,16 @@ class GeoElevationFile:
         # distance of the point, we'll use d-distance as importance coef
         # here:
         importance_1 = d_meters - mod_utils.distance(latitude + d, longitude, latitude, longitude)
-        elevation_1  = self.geo_elevation_data.get_elevation(latitude + d, longitude, approximate=False)
+        elevation_1  = self.geo_elevation_data.get_elevation(latitude + d, longitude, approximate=False, height_reference=mod_geoid.GEOID)
 
         importance_2 = d_meters - mod_utils.distance(latitude - d, longitude, latitude, longitude)
-        elevation_2  = self.geo_elevation_data.get_elevation(latitude - d, longitude, approximate=False)
+        elevation_2  = self.geo_elevation_data.get_elevation(latitude - d, longitude, approximate=False, height_reference=mod_geoid.GEOID)
 
         importance_3 = d_meters - mod_utils.distance(latitude, longitude + d, latitude, longitude)
-        elevation_3  = self.geo_elevation_data.get_elevation(latitude, longitude + d, approximate=False)
+        elevation_3  = self.geo_elevation_data.get_elevation(latitude, longitude + d, approximate=False, height_reference=mod_geoid.GEOID)
 
         importance_4 = d_meters - mod_utils.distance(latitude, longitude - d, latitude, longitude)
-        elevation_4  = self.geo_elevation_data.get_elevation(latitude, longitude - d, approximate=False)
+        elevation_4  = self.geo_elevation_data.get_elevation(latitude, longitude - d, approximate=False, height_reference=mod_geoid.GEOID)
         # TODO(TK) Check if coordinates inside the same file, and only then decide if to call
         # self.geo_elevation_data.get_elevation or just self.get_elevation
 
@@ -480,40 +994,137 @@ class GeoElevationFile:
 
     def get_elevation_from_row_and_column(self, row: int, column: int) -> Optional[float]:
         i = row * (self.square_side) + column
-        assert i < len(self.data) - 1
 
         #mod_logging.debug('{0}, {1} -> {2}'.format(row, column, i))
 
-        unpacked = mod_struct.unpack(">h", self.data[i * 2 : i * 2 + 2])
-        result: Optional[float] = None
-        if unpacked and len(unpacked) == 1:
-            result = unpacked[0]
-
-        if (result is None) or result > 10000 or result < -1000:
+        result = self.values[i]
+        if result > 10000 or result < -1000:
             return None
 
         return result
 
-    def parse_file_name_starting_position(self) -> None:
-        """ Returns (latitude, longitude) of lower left point of the file """
-        groups = mod_re.findall('([NS])(\d+)([EW])(\d+)\.hgt', self.file_name)
+    def get_elevations_array(self, latitudes: Any, longitudes: Any) -> Any:
+        """
+        Same as get_elevation (without approximation) for numpy arrays of
+        points in this file. Returns a float64 numpy array, with NaN for
+        invalid elevations. Only the rows between the northernmost and
+        southernmost point are read.
+        """
+        import numpy as np # type: ignore
 
-        assert groups and len(groups) == 1 and len(groups[0]) == 4, 'Invalid file name {0}'.format(self.file_name)
+        rows = np.floor((self.latitude + 1 - latitudes) * float(self.square_side - 1)).astype(np.int64)
+        columns = np.floor((longitudes - self.longitude) * float(self.square_side - 1)).astype(np.int64)
+        if len(rows) and (rows.min() < 0 or rows.max() >= self.square_side or columns.min() < 0 or columns.max() >= self.square_side):
+            raise Exception(f'Points outside file {self.file_name}')
+        if not len(rows):
+            return np.empty(0)
 
-        groups = groups[0]
+        row_from, row_to = int(rows.min()), int(rows.max()) + 1
+        values = self._get_values_array(row_from * self.square_side, row_to * self.square_side)
 
-        if groups[0] == 'N':
-            latitude = float(groups[1])
-        else:
-            latitude = - float(groups[1])
+        result = values[(rows - row_from) * self.square_side + columns].astype(np.float64)
+        result[(result > 10000) | (result < -1000)] = np.nan
+        return result
 
-        if groups[2] == 'E':
-            longitude = float(groups[3])
-        else:
-            longitude = - float(groups[3])
+    def get_row_values(self, row: int, column_from: int, column_to: int) -> Any:
+        """ Returns a numpy int16 array with raw values in row from column_from to column_to (exclusive). """
+        i = row * self.square_side
+        return self._get_values_array(i + column_from, i + column_to).copy()
+
+    def get_values_array(self) -> Any:
+        """ Returns a numpy int16 array (square_side x square_side) with all raw values. """
+        return self._get_values_array(0, len(self.values)).reshape((self.square_side, self.square_side)).copy()
+
+    def _get_values_array(self, start: int, stop: int) -> Any:
+        """ Values from start to stop as a numpy int16 array (which may share memory with this object). """
+        import numpy as np # type: ignore
+
+        if isinstance(self.data, mod_chunked.ChunkedFile):
+            return np.frombuffer(self.data[start * 2 : stop * 2], dtype='>i2').astype(np.int16)
+        assert not isinstance(self.values, mod_chunked.ChunkedValues)
+        return np.frombuffer(self.values, dtype=np.int16, count=stop - start, offset=start * 2)
 
-        self.latitude = latitude
-        self.longitude = longitude
+    def parse_file_name_starting_position(self) -> None:
+        """ Returns (latitude, longitude) of lower left point of the file """
+        self.latitude, self.longitude = parse_file_name(self.file_name)
 
     def __str__(self) -> str:
         return f'[{self.__class__}:{self.file_name}]'
+
+def _unzip(file_name: str, contents: bytes) -> bytes:
+    with mod_tracing.span(mod_tracing.UNZIP, file_name=file_name, bytes=len(contents)):
+        return mod_utils.unzip(contents)
+
+def _decode(file_name: str, data: Union[bytes, memoryview]) -> "mod_array.array[int]":
+    with mod_tracing.span(mod_tracing.DECODE, file_name=file_name, bytes=len(data)):
+        return mod_chunked.decode(data)
+
+def get_file_name(latitude: float, longitude: float) -> str:
+    """ Name of the file with the point (the file may not exist). """
+    if latitude >= 0:
+        north_south = 'N'
+    else:
+        north_south = 'S'
+
+    if longitude >= 0:
+        east_west = 'E'
+    else:
+        east_west = 'W'
+
+    return '%s%s%s%s.hgt' % (north_south, str(int(abs(mod_math.floor(latitude)))).zfill(2),
+                             east_west, str(int(abs(mod_math.floor(longitude)))).zfill(3))
+
+def check_file_data(file_name: str, data: TileData, dataset: Optional[str]=None) -> None:
+    """ Raises an exception if data is not a valid SRTM1 or SRTM3 file (or a file of the dataset). """
+    if len(data) not in (VALID_FILE_SIZES if dataset is None else (DATASET_FILE_SIZES[dataset], )):
+        raise Exception(f'Invalid file {file_name} ({len(data)} bytes)')
+
+def get_cell(latitude: float, longitude: float) -> Tuple[int, int, int, int, int, int]:
+    """
+    Cell with the point: the lower left corner of its file, and the rows and
+    columns of the point in SRTM1 and SRTM3 files. All points in a cell have
+    the same elevation (in the same file).
+    """
+    # Computed as in GeoElevationFile.get_row_and_column (rows are counted from the
+    # north), the SRTM3 row isn't always the SRTM1 row // 3 because of rounding:
+    file_latitude, file_longitude = mod_math.floor(latitude), mod_math.floor(longitude)
+    y, x = file_latitude + 1 - latitude, longitude - file_longitude
+    return file_latitude, file_longitude, mod_math.floor(y * 3600), mod_math.floor(y * 1200), mod_math.floor(x * 3600), mod_math.floor(x * 1200)
+
+def get_datasets(resolution: Optional[float]) -> List[str]:
+    """
+    Datasets in the order they should be used for the resolution (target
+    distance between points in meters): first the datasets with a
+    resolution good enough, from the coarsest (smallest files) on, then the
+    others, from the finest on. For example SRTM3 and then SRTM1 for 100m,
+    SRTM1 and then SRTM3 for 50m. Without a resolution SRTM1 is first.
+    """
+    by_resolution = sorted(DATASET_RESOLUTIONS, key=lambda dataset: DATASET_RESOLUTIONS[dataset])
+    if resolution is None:
+        return by_resolution
+    good_enough = [dataset for dataset in by_resolution if DATASET_RESOLUTIONS[dataset] <= resolution]
+    return good_enough[::-1] + [dataset for dataset in by_resolution if dataset not in good_enough]
+
+def get_dataset_file_name(file_name: str, dataset: Optional[str]) -> str:
+    """ Name under which the file of the dataset is stored (for example SRTM3_N44W072.hgt). """
+    return f'{dataset}_{file_name}' if dataset else file_name
+
+def parse_file_name(file_name: str) -> Tuple[float, float]:
+    """ Returns (latitude, longitude) of lower left point of the file """
+    groups = mod_re.findall(r'([NS])(\d+)([EW])(\d+)\.hgt', file_name)
+
+    assert groups and len(groups) == 1 and len(groups[0]) == 4, 'Invalid file name {0}'.format(file_name)
+
+    groups = groups[0]
+
+    if groups[0] == 'N':
+        latitude = float(groups[1])
+    else:
+        latitude = - float(groups[1])
+
+    if groups[2] == 'E':
+        longitude = float(groups[3])
+    else:
+        longitude = - float(groups[3])
+
+    return latitude, longitude
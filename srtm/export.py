@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2013 Tomo Krajina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Export elevations of large areas in raster files (GeoTIFF, ESRI ASCII grid or
+raw int16). The area is processed in strips of rows, so the memory used
+doesn't depend on the size of the area.
+"""
+
+import logging as mod_logging
+import math    as mod_math
+import struct  as mod_struct
+
+from . import data as mod_data
+
+from typing import *
+
+GEOTIFF = 'geotiff'
+ASCII_GRID = 'ascii'
+RAW = 'raw'
+
+DEFAULT_ROWS_PER_STRIP = 64
+
+# TIFF field types:
+TIFF_ASCII = 2
+TIFF_SHORT = 3
+TIFF_LONG = 4
+TIFF_DOUBLE = 12
+TIFF_LONG8 = 16
+
+class Strips:
+    """
+    The SRTM points in an interval, split into strips of rows (from north
+    to south).
+    """
+
+    def __init__(self, geo_elevation_data: mod_data.GeoElevationData, latitude_min: float, latitude_max: float,
+                 longitude_min: float, longitude_max: float, samples_per_degree: Optional[int]=None,
+                 rows_per_strip: int=DEFAULT_ROWS_PER_STRIP, nodata: int=mod_data.NODATA) -> None:
+        self.geo_elevation_data = geo_elevation_data
+        self.nodata = nodata
+        self.rows_per_strip = rows_per_strip
+        self.longitude_min = longitude_min
+        self.longitude_max = longitude_max
+        # Files loaded before (the others are unloaded when not needed anymore):
+        self.previous_keys = set(geo_elevation_data.files)
+
+        s = samples_per_degree or geo_elevation_data.get_samples_per_degree(latitude_min, latitude_max, longitude_min, longitude_max)
+        self.samples_per_degree = s
+
+        # Same as in GeoElevationData.get_region:
+        self.k_max = mod_math.floor(latitude_max * s + 1e-6)
+        self.k_min = mod_math.ceil(latitude_min * s - 1e-6)
+        m_min = mod_math.ceil(longitude_min * s - 1e-6)
+        m_max = mod_math.floor(longitude_max * s + 1e-6)
+
+        self.height = self.k_max - self.k_min + 1
+        self.width = m_max - m_min + 1
+        if self.height <= 0 or self.width <= 0:
+            raise Exception(f'Empty interval ({latitude_min}, {latitude_max}), ({longitude_min}, {longitude_max})')
+
+        self.geo_transform = ((m_min - .5) / s, 1. / s, 0., (self.k_max + .5) / s, 0., -1. / s)
+
+    def __len__(self) -> int:
+        return (self.height + self.rows_per_strip - 1) // self.rows_per_strip
+
+    def __iter__(self) -> Iterator[Any]:
+        """
+        Yields numpy int16 arrays with (at most) rows_per_strip rows.
+
+        Files are loaded once (also in batch_mode) and unloaded after the last
+        strip with their points, so at most two rows of files are loaded.
+        """
+        s = self.samples_per_degree
+        geo_elevation_data, previous_keys = self.geo_elevation_data, self.previous_keys
+        batch_mode, geo_elevation_data.batch_mode = geo_elevation_data.batch_mode, False
+        try:
+            for k in range(self.k_max, self.k_min - 1, -self.rows_per_strip):
+                k_to = max(self.k_min, k - self.rows_per_strip + 1)
+                strip, _ = geo_elevation_data.get_region(k_to / s, k / s, self.longitude_min, self.longitude_max,
+                                                         nodata=self.nodata, samples_per_degree=s)
+                # Files north of the next strip (their last row is k_to):
+                geo_elevation_data.unload_files(key for key, geo_file in geo_elevation_data.files.items()
+                                                if key not in previous_keys and round(geo_file.latitude) * s >= k_to)
+                yield strip
+        finally:
+            geo_elevation_data.batch_mode = batch_mode
+            geo_elevation_data.unload_files(set(geo_elevation_data.files) - previous_keys)
+
+def write_raw(strips: Strips, f: BinaryIO, byte_order: str='<') -> None:
+    """ Writes the points as int16 (little endian by default), row by row. """
+    for strip in strips:
+        f.write(strip.astype(byte_order + 'i2').tobytes())
+
+def write_ascii_grid(strips: Strips, f: TextIO) -> None:
+    """ Writes an ESRI ASCII grid. """
+    x, cell_size, _, y, _, _ = strips.geo_transform
+    f.write(f'ncols {strips.width}\n')
+    f.write(f'nrows {strips.height}\n')
+    f.write(f'xllcorner {x!r}\n')
+    f.write(f'yllcorner {y - strips.height * cell_size!r}\n')
+    f.write(f'cellsize {cell_size!r}\n')
+    f.write(f'NODATA_value {strips.nodata}\n')
+    for strip in strips:
+        for row in strip:
+            f.write(' '.join(map(str, row.tolist())))
+            f.write('\n')
+
+def write_geotiff(strips: Strips, f: BinaryIO, big: Optional[bool]=None) -> None:
+    """
+    Writes an uncompressed int16 GeoTIFF (WGS84). BigTIFF is used if big is
+    True or (by default) when the file is bigger than 4GB. The file must be
+    seekable.
+    """
+    strip_sizes = [min(strips.rows_per_strip, strips.height - n * strips.rows_per_strip) * strips.width * 2 for n in range(len(strips))]
+    if big is None:
+        big = sum(strip_sizes) + 10000 + len(strip_sizes) * 16 >= 2 ** 32
+
+    if big:
+        f.write(mod_struct.pack('<2sHHHQ', b'II', 43, 8, 0, 0))
+        ifd_offset_position = 8
+    else:
+        f.write(mod_struct.pack('<2sHI', b'II', 42, 0))
+        ifd_offset_position = 4
+
+    strip_offsets = []
+    for strip, strip_size in zip(strips, strip_sizes):
+        strip_offsets.append(f.tell())
+        contents = strip.astype('<i2').tobytes()
+        assert len(contents) == strip_size
+        f.write(contents)
+
+    x, pixel_width, _, y, _, pixel_height = strips.geo_transform
+    offsets_type = TIFF_LONG8 if big else TIFF_LONG
+    tags: List[Tuple[int, int, List[Any]]] = [
+        (256, TIFF_LONG, [strips.width]),                 # ImageWidth
+        (257, TIFF_LONG, [strips.height]),                # ImageLength
+        (258, TIFF_SHORT, [16]),                          # BitsPerSample
+        (259, TIFF_SHORT, [1]),                           # Compression: none
+        (262, TIFF_SHORT, [1]),                           # PhotometricInterpretation: BlackIsZero
+        (273, offsets_type, strip_offsets),               # StripOffsets
+        (277, TIFF_SHORT, [1]),                           # SamplesPerPixel
+        (278, TIFF_LONG, [strips.rows_per_strip]),        # RowsPerStrip
+        (279, offsets_type, strip_sizes),                 # StripByteCounts
+        (284, TIFF_SHORT, [1]),                           # PlanarConfiguration: contiguous
+        (339, TIFF_SHORT, [2]),                           # SampleFormat: signed integer
+        (33550, TIFF_DOUBLE, [pixel_width, -pixel_height, 0.]), # ModelPixelScale
+        (33922, TIFF_DOUBLE, [0., 0., 0., x, y, 0.]),     # ModelTiepoint
+        # GeoKeyDirectory: geographic model, pixel is area, WGS84:
+        (34735, TIFF_SHORT, [1, 1, 0, 3, 1024, 0, 1, 2, 1025, 0, 1, 1, 2048, 0, 1, 4326]),
+        (42113, TIFF_ASCII, [f'{strips.nodata}\0'.encode()]), # GDAL_NODATA
+    ]
+    _write_ifd(f, tags, big, ifd_offset_position)
+
+def _write_ifd(f: BinaryIO, tags: List[Tuple[int, int, List[Any]]], big: bool, ifd_offset_position: int) -> None:
+    formats = {TIFF_SHORT: 'H', TIFF_LONG: 'I', TIFF_DOUBLE: 'd', TIFF_LONG8: 'Q'}
+    value_size = 8 if big else 4
+
+    # Values which don't fit in the IFD entries are written before the IFD:
+    entries = []
+    for tag, tiff_type, values in tags:
+        if tiff_type == TIFF_ASCII:
+            contents: bytes = values[0]
+            count = len(contents)
+        else:
+            contents = mod_struct.pack(f'<{len(values)}{formats[tiff_type]}', *values)
+            count = len(values)
+        if len(contents) <= value_size:
+            entries.append((tag, tiff_type, count, contents.ljust(value_size, b'\0')))
+        else:
+            if f.tell() % 2:
+                f.write(b'\0')
+            offset = f.tell()
+            f.write(contents)
+            entries.append((tag, tiff_type, count, mod_struct.pack('<Q' if big else '<I', offset)))
+
+    if f.tell() % 2:
+        f.write(b'\0')
+    ifd_offset = f.tell()
+    f.write(mod_struct.pack('<Q' if big else '<H', len(entries)))
+    for tag, tiff_type, count, value in entries:
+        f.write(mod_struct.pack('<HHQ' if big else '<HHI', tag, tiff_type, count))
+        f.write(value)
+    f.write(mod_struct.pack('<Q' if big else '<I', 0))
+
+    f.seek(ifd_offset_position)
+    f.write(mod_struct.pack('<Q' if big else '<I', ifd_offset))
+    f.seek(0, 2)
+
+def export(geo_elevation_data: mod_data.GeoElevationData, file_name: str, latitude_min: float, latitude_max: float,
+           longitude_min: float, longitude_max: float, format: str='', samples_per_degree: Optional[int]=None,
+           rows_per_strip: int=DEFAULT_ROWS_PER_STRIP, nodata: int=mod_data.NODATA) -> Strips:
+    """
+    Writes elevations of all SRTM points in the interval to file_name.
+
+    format is one of GEOTIFF, ASCII_GRID or RAW, by default it is decided by
+    the file extension (.tif/.tiff, .asc, anything else is raw). Returns the
+    Strips object with the size and geotransform of the written raster.
+
+    Only one strip of rows_per_strip rows is in memory at a time (plus at
+    most two rows of files, see Strips).
+    """
+    if not format:
+        lower_file_name = file_name.lower()
+        if lower_file_name.endswith('.tif') or lower_file_name.endswith('.tiff'):
+            format = GEOTIFF
+        elif lower_file_name.endswith('.asc'):
+            format = ASCII_GRID
+        else:
+            format = RAW
+
+    strips = Strips(geo_elevation_data, latitude_min, latitude_max, longitude_min, longitude_max,
+                    samples_per_degree=samples_per_degree, rows_per_strip=rows_per_strip, nodata=nodata)
+    mod_logging.info(f'Exporting {strips.width}x{strips.height} points to {file_name} ({format})')
+
+    if format == GEOTIFF:
+        with open(file_name, 'wb') as f:
+            write_geotiff(strips, f)
+    elif format == ASCII_GRID:
+        with open(file_name, 'w') as text_f:
+            write_ascii_grid(strips, text_f)
+    elif format == RAW:
+        with open(file_name, 'wb') as f:
+            write_raw(strips, f)
+    else:
+        raise Exception(f'Invalid format {format}')
+
+    return strips
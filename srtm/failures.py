@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2013 Tomo Krajina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Failures of retrieving files. Files which failed (for example a broken zip
+file) are remembered for some time (also stored with the file handler), so
+they aren't downloaded again for every point. Servers which fail (timeouts,
+connection errors, server errors) are not tried for some time after a
+number of consecutive failures (circuit breaker).
+"""
+
+import json            as mod_json
+import logging         as mod_logging
+import threading       as mod_threading
+import time            as mod_time
+import urllib.parse    as mod_urllib_parse
+
+from . import utils as mod_utils
+
+from typing import *
+
+# Policies for points in files which failed:
+RAISE = 'raise'
+NONE = 'none'
+
+# Stored with the file handler:
+FILE_NAME = 'failed_files.json'
+
+DEFAULT_FILE_TTL = 24 * 60 * 60.
+DEFAULT_SERVER_FAILURES = 3
+DEFAULT_SERVER_TIMEOUT = 60.
+
+class FailureStats(NamedTuple):
+    # Files which failed (and are not retried until their TTL expires):
+    failed_files: int
+    # Files not retrieved (or loaded) because of a previous failure:
+    fast_failures: int
+    # Servers which are not tried now:
+    unavailable_servers: List[str]
+
+class Failures:
+    """
+    Failed files (file_name -> (time until which it isn't retried, error)),
+    and consecutive failures of every server.
+    """
+
+    def __init__(self, file_handler: mod_utils.FileHandler, file_ttl: float=DEFAULT_FILE_TTL,
+                 server_failures: int=DEFAULT_SERVER_FAILURES, server_timeout: float=DEFAULT_SERVER_TIMEOUT) -> None:
+        self.file_handler = file_handler
+        self.file_ttl = file_ttl
+        self.server_failures = server_failures
+        self.server_timeout = server_timeout
+
+        self.lock = mod_threading.Lock()
+        # Lazy loaded (see get_files):
+        self.files: Optional[Dict[str, Tuple[float, str]]] = None
+        # Server -> number of consecutive failures, and time until which it
+        # isn't tried:
+        self.servers: Dict[str, Tuple[int, float]] = {}
+        self.fast_failures = 0
+
+    def get_files(self) -> Dict[str, Tuple[float, str]]:
+        if self.files is None:
+            files: Dict[str, Tuple[float, str]] = {}
+            try:
+                if self.file_handler.exists(FILE_NAME):
+                    for file_name, (until, error) in mod_json.loads(self.file_handler.read(FILE_NAME)).items():
+                        files[file_name] = (float(until), str(error))
+            except Exception:
+                mod_logging.exception(f'Invalid {FILE_NAME}, ignored')
+            self.files = files
+        return self.files
+
+    def get_file_failure(self, file_name: str) -> Optional[str]:
+        """ The error, if the file failed and its TTL didn't expire. """
+        failure = self.get_files().get(file_name)
+        if failure is None:
+            return None
+        until, error = failure
+        if mod_time.time() >= until:
+            return None
+        self.fast_failures += 1
+        return error
+
+    def get_retry_time(self, file_name: str) -> float:
+        """
+        Time until which a file which just failed isn't retried: its TTL if it
+        is a failed file, the server timeout otherwise (the server failed, or
+        the stored file can't be loaded).
+        """
+        failure = self.get_files().get(file_name)
+        if failure is not None:
+            return failure[0]
+        return mod_time.time() + self.server_timeout
+
+    def add_file_failure(self, file_name: str, error: str) -> None:
+        if self.file_ttl <= 0:
+            return
+        with self.lock:
+            files = self.get_files()
+            now = mod_time.time()
+            files[file_name] = (now + self.file_ttl, error)
+            # Expired files are removed when the failures are saved:
+            for expired in [file_name for file_name, (until, _) in files.items() if until <= now]:
+                del files[expired]
+            self.file_handler.write(FILE_NAME, mod_json.dumps(files).encode())
+
+    def clear_files(self) -> None:
+        with self.lock:
+            self.files = {}
+            if self.file_handler.exists(FILE_NAME):
+                self.file_handler.remove(FILE_NAME)
+
+    def check_server(self, url: str) -> None:
+        """ Raises an exception if the server of the url is not to be tried now. """
+        server = get_server(url)
+        with self.lock:
+            failures, until = self.servers.get(server, (0, 0.))
+            if failures < self.server_failures:
+                return
+            now = mod_time.time()
+            if now >= until:
+                # One request is tried, the others wait for its result:
+                self.servers[server] = (failures, now + self.server_timeout)
+                return
+        self.fast_failures += 1
+        raise Exception(f'{server} failed {failures} times, not retried before {mod_time.ctime(until)}')
+
+    def add_server_failure(self, url: str) -> None:
+        server = get_server(url)
+        with self.lock:
+            failures, _ = self.servers.get(server, (0, 0.))
+            self.servers[server] = (failures + 1, mod_time.time() + self.server_timeout)
+        if failures + 1 == self.server_failures:
+            mod_logging.warning(f'{server} failed {failures + 1} times, not retried for {self.server_timeout}s')
+
+    def add_server_success(self, url: str) -> None:
+        with self.lock:
+            self.servers.pop(get_server(url), None)
+
+    def get_stats(self) -> FailureStats:
+        now = mod_time.time()
+        failed_files = sum(1 for until, _ in self.get_files().values() if now < until)
+        unavailable_servers = sorted(server for server, (failures, until) in self.servers.items()
+                                     if failures >= self.server_failures and now < until)
+        return FailureStats(failed_files, self.fast_failures, unavailable_servers)
+
+def get_server(url: str) -> str:
+    return mod_urllib_parse.urlsplit(url).netloc
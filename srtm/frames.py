@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2013 Tomo Krajina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Elevations for columns of pandas DataFrames and Arrow tables (and Parquet
+files). pandas and pyarrow are needed only if used.
+"""
+
+import logging as mod_logging
+
+from . import data as mod_data
+
+from typing import *
+
+DEFAULT_BATCH_SIZE = 2 ** 18
+
+def _get_library(values: Any) -> str:
+    return type(values).__module__.split('.')[0]
+
+def _to_numpy(values: Any) -> Any:
+    import numpy as np # type: ignore
+
+    if _get_library(values) == 'pyarrow':
+        # Nulls are converted to NaN:
+        return values.to_numpy(zero_copy_only=False).astype(np.float64)
+    if _get_library(values) == 'pandas':
+        return values.to_numpy(dtype=np.float64, na_value=np.nan)
+    return np.asarray(values, dtype=np.float64)
+
+def get_elevation_column(geo_elevation_data: mod_data.GeoElevationData, latitudes: Any, longitudes: Any,
+                         height_reference: Optional[str]=None) -> Any:
+    """
+    Elevations for a column of latitudes and a column of longitudes, for example:
+
+        df['elevation'] = get_elevation_column(elevation_data, df['lat'], df['lon'])
+
+    latitudes and longitudes are pandas Series, Arrow arrays (or chunked
+    arrays) or numpy arrays. Returns a float64 column of the same kind (a
+    Series with the same index, an Arrow array or a numpy array). Points
+    without an elevation are NaN (null in Arrow).
+
+    See GeoElevationData.get_elevations_array.
+    """
+    elevations = geo_elevation_data.get_elevations_array(_to_numpy(latitudes), _to_numpy(longitudes), height_reference=height_reference)
+
+    if _get_library(latitudes) == 'pandas':
+        import pandas as pd # type: ignore
+        return pd.Series(elevations, index=latitudes.index, name='elevation')
+    if _get_library(latitudes) == 'pyarrow':
+        import numpy as np
+        import pyarrow as pa # type: ignore
+        return pa.array(elevations, mask=np.isnan(elevations))
+    return elevations
+
+def enrich_parquet(geo_elevation_data: mod_data.GeoElevationData, source: str, target: str, latitude_column: str='latitude',
+                   longitude_column: str='longitude', elevation_column: str='elevation', batch_size: int=DEFAULT_BATCH_SIZE,
+                   height_reference: Optional[str]=None) -> int:
+    """
+    Copies the Parquet file source to target, with elevations in
+    elevation_column (added, or replaced if it exists). The file is
+    processed in batches of batch_size rows, so it can be larger than
+    memory (use batch_mode=True if points are spread over many files).
+
+    Returns the number of rows.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq # type: ignore
+
+    parquet_file = pq.ParquetFile(source)
+    schema = parquet_file.schema_arrow
+    field = pa.field(elevation_column, pa.float64())
+    if elevation_column in schema.names:
+        schema = schema.set(schema.get_field_index(elevation_column), field)
+    else:
+        schema = schema.append(field)
+
+    rows = 0
+    with pq.ParquetWriter(target, schema) as writer:
+        for batch in parquet_file.iter_batches(batch_size=batch_size):
+            elevations = get_elevation_column(geo_elevation_data, batch.column(latitude_column), batch.column(longitude_column),
+                                              height_reference=height_reference)
+            columns = [elevations if name == elevation_column else batch.column(name) for name in batch.schema.names]
+            if elevation_column not in batch.schema.names:
+                columns.append(elevations)
+            writer.write_batch(pa.RecordBatch.from_arrays(columns, schema=schema))
+            rows += batch.num_rows
+            mod_logging.debug(f'Enriched {rows} rows of {source}')
+    return rows
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2013 Tomo Krajina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+EGM96 geoid undulations, used to convert SRTM elevations (which are heights
+above the EGM96 geoid) to heights above the WGS84 ellipsoid (like GNSS
+heights):
+
+    ellipsoid height = geoid height + undulation
+
+The undulation grid is read from a file in the GeographicLib PGM format
+(egm96-15.pgm or egm96-5.pgm, see https://geographiclib.sourceforge.io).
+"""
+
+import array   as mod_array
+import logging as mod_logging
+import os.path as mod_path
+import sys     as mod_sys
+
+from typing import *
+
+GEOID = 'geoid'
+ELLIPSOID = 'ellipsoid'
+
+GEOID_FILE_NAMES = ['egm96-15.pgm', 'egm96-5.pgm']
+
+class Geoid:
+    """
+    Geoid undulation grid with bilinear interpolation. The grid covers
+    latitudes from 90 to -90 (both included) and longitudes from 0 to 360
+    (360 excluded).
+    """
+
+    def __init__(self, contents: bytes) -> None:
+        header_lines = []
+        position = 0
+        tokens: List[bytes] = []
+        # Header: P5, comments, width, height and max value:
+        while len(tokens) < 4:
+            end = contents.index(b'\n', position)
+            line = contents[position : end]
+            position = end + 1
+            if line.startswith(b'#'):
+                header_lines.append(line[1:].decode().strip())
+            else:
+                tokens.extend(line.split())
+        if tokens[0] != b'P5':
+            raise Exception('Invalid geoid file (not a PGM file)')
+
+        self.offset = 0.
+        self.scale = 1.
+        for header_line in header_lines:
+            if header_line.startswith('Offset '):
+                self.offset = float(header_line.split()[1])
+            elif header_line.startswith('Scale '):
+                self.scale = float(header_line.split()[1])
+
+        self.width, self.height = int(tokens[1]), int(tokens[2])
+        self.resolution = 360. / self.width
+        if abs((self.height - 1) * self.resolution - 180) > 1e-9:
+            raise Exception(f'Invalid geoid grid size {self.width}x{self.height}')
+
+        self.values = mod_array.array('H')
+        self.values.frombytes(contents[position : position + self.width * self.height * 2])
+        if len(self.values) != self.width * self.height:
+            raise Exception('Invalid geoid file (too short)')
+        if mod_sys.byteorder == 'little':
+            self.values.byteswap()
+
+        self._numpy_values: Any = None
+
+    @classmethod
+    def from_file(cls, file_name: str) -> "Geoid":
+        mod_logging.info(f'Loading geoid from {file_name}')
+        with open(file_name, 'rb') as f:
+            return cls(f.read())
+
+    def undulation(self, latitude: float, longitude: float) -> float:
+        """ Geoid height above the ellipsoid in meters. """
+        x = (longitude % 360.) / self.resolution
+        y = (90. - latitude) / self.resolution
+        # longitude % 360. may round to 360.:
+        x0, y0 = int(x) % self.width, min(int(y), self.height - 2)
+        dx, dy = x - int(x), y - y0
+        x1 = (x0 + 1) % self.width
+        row0, row1 = y0 * self.width, (y0 + 1) * self.width
+        values = self.values
+        value = (values[row0 + x0] * (1 - dx) + values[row0 + x1] * dx) * (1 - dy) + \
+                (values[row1 + x0] * (1 - dx) + values[row1 + x1] * dx) * dy
+        return self.offset + self.scale * value
+
+    def undulations(self, latitudes: Any, longitudes: Any) -> Any:
+        """ Same as undulation, for numpy arrays (of the same shape). """
+        import numpy as np # type: ignore
+
+        if self._numpy_values is None:
+            self._numpy_values = np.frombuffer(self.values, dtype=np.uint16).astype(np.float32)
+        values = self._numpy_values
+
+        x = np.mod(np.asarray(longitudes, dtype=np.float64), 360.) / self.resolution
+        y = (90. - np.asarray(latitudes, dtype=np.float64)) / self.resolution
+        x0 = np.floor(x).astype(np.int64) % self.width
+        y0 = np.minimum(np.floor(y).astype(np.int64), self.height - 2)
+        dx, dy = x - np.floor(x), y - y0
+        x1 = (x0 + 1) % self.width
+        row0, row1 = y0 * self.width, (y0 + 1) * self.width
+        value = (values[row0 + x0] * (1 - dx) + values[row0 + x1] * dx) * (1 - dy) + \
+                (values[row1 + x0] * (1 - dx) + values[row1 + x1] * dx) * dy
+        return self.offset + self.scale * value
+
+_geoid: Optional[Geoid] = None
+
+def get_geoid(file_name: str="", local_cache_dir: str="") -> Geoid:
+    """
+    Loads the geoid (only once). If file_name is not given, egm96-15.pgm or
+    egm96-5.pgm is searched in the package directory and in the local cache
+    directory (~/.cache/srtm).
+    """
+    global _geoid
+
+    if file_name:
+        return Geoid.from_file(file_name)
+    if _geoid is not None:
+        return _geoid
+
+    directories = [mod_path.dirname(__file__)]
+    if local_cache_dir:
+        directories.append(local_cache_dir)
+    else:
+        from . import utils as mod_utils
+        directories.append(mod_utils.FileHandler().local_cache_dir)
+
+    for directory in directories:
+        for geoid_file_name in GEOID_FILE_NAMES:
+            path = mod_path.join(directory, geoid_file_name)
+            if mod_path.exists(path):
+                _geoid = Geoid.from_file(path)
+                return _geoid
+
+    raise Exception(f'No geoid file ({" or ".join(GEOID_FILE_NAMES)}) found in {", ".join(directories)}. '
+                    'Download it from https://geographiclib.sourceforge.io (geoids, EGM96) and save it in one of those directories.')
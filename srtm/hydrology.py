@@ -0,0 +1,509 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2013 Tomo Krajina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Hydrology of large areas: depression filling, D8 flow directions and flow
+accumulation. The area is processed in blocks (by default one block per
+file), only the points on block borders are kept in memory between blocks:
+
+ 1. Every block is flooded from its border (priority-flood), and the spill
+    elevations between the parts drained by the border points are found.
+ 2. The spill elevations of all blocks give the water level of every border
+    point (priority-flood of the graph of border points).
+ 3. Every block is flooded again from its border with those levels, which
+    gives the filled elevations and flow directions. Flows leaving every
+    block are accumulated across blocks, and added to the flow accumulation
+    of every block in the last pass.
+
+(See Barnes, "Parallel priority-flood depression filling for trillion cell
+digital elevation models" and "Parallel non-divergent flow accumulation for
+trillion cell digital elevation models".)
+
+Points without data (and outside the area) are outlets, water flows into
+them.
+"""
+
+import heapq as mod_heapq
+import math  as mod_math
+
+from . import data as mod_data
+
+from typing import *
+
+# D8 flow directions (as in ESRI rasters), 0 for points without data:
+EAST = 1
+SOUTH_EAST = 2
+SOUTH = 4
+SOUTH_WEST = 8
+WEST = 16
+NORTH_WEST = 32
+NORTH = 64
+NORTH_EAST = 128
+
+# Direction -> (row, column) offset:
+OFFSETS = {
+    EAST: (0, 1), SOUTH_EAST: (1, 1), SOUTH: (1, 0), SOUTH_WEST: (1, -1),
+    WEST: (0, -1), NORTH_WEST: (-1, -1), NORTH: (-1, 0), NORTH_EAST: (-1, 1),
+}
+
+# Points are flooded from buckets of elevations (the priority queue), the
+# bucket of an elevation is buckets[elevation + ELEVATION_OFFSET]:
+ELEVATION_OFFSET = 32768
+
+# Floods are pure Python (about 500k points per second), areas with more
+# points (minutes of floods) raise an exception unless max_points is set:
+MAX_POINTS = 10 ** 8
+
+class HydrologyBlock(NamedTuple):
+    # Upper left point of the block in the area:
+    row: int
+    column: int
+    # int16 filled elevations (nodata for points without data):
+    filled: Any
+    # uint8 D8 flow directions (see EAST, SOUTH_EAST...):
+    directions: Any
+    # int64 number of points draining through every point (including itself):
+    accumulation: Any
+
+class _Block:
+    """ Points of a block with one more point on every side (from other blocks). """
+
+    def __init__(self, hydrology: "Hydrology", row_from: int, row_to: int, column_from: int, column_to: int) -> None:
+        import numpy as np # type: ignore
+
+        self.row_from, self.column_from = row_from, column_from
+        self.height, self.width = row_to - row_from, column_to - column_from
+        r_from, r_to = max(0, row_from - 1), min(hydrology.height, row_to + 1)
+        c_from, c_to = max(0, column_from - 1), min(hydrology.width, column_to + 1)
+        values = np.full((self.height + 2, self.width + 2), hydrology.nodata, dtype=np.int16)
+        values[r_from - row_from + 1 : r_to - row_from + 1, c_from - column_from + 1 : c_to - column_from + 1] = \
+            hydrology.read(r_from, r_to, c_from, c_to)
+        self.values = values
+
+        valid = values != hydrology.nodata
+        self.valid = valid
+        inner = np.zeros(valid.shape, dtype=bool)
+        inner[1:-1, 1:-1] = True
+        self.in_block = valid & inner
+
+        h, w = self.height, self.width
+        # Points with an invalid neighbor (water can flow out of the area):
+        outlets = np.zeros(valid.shape, dtype=bool)
+        for dr, dc in OFFSETS.values():
+            outlets[1:-1, 1:-1] |= ~valid[1 + dr : h + 1 + dr, 1 + dc : w + 1 + dc]
+        self.outlets = outlets & self.in_block
+        border = inner.copy()
+        border[2:-2, 2:-2] = False
+        # Points flooded first (see Hydrology):
+        self.seeds = self.in_block & (border | outlets)
+
+        # Indexes are of the flattened arrays (with the extra points):
+        self.n = valid.size
+        self.stride = w + 2
+        rows, columns = np.divmod(np.arange(self.n), self.stride)
+        self.ids = (rows - 1 + row_from) * hydrology.width + columns - 1 + column_from
+
+    def get_neighbors(self) -> List[int]:
+        return [dr * self.stride + dc for dr, dc in OFFSETS.values()]
+
+    def label_flood(self) -> Dict[Tuple[int, int], int]:
+        """
+        Floods the block from the seeds, every point gets the label of the
+        seed which flooded it. Returns the spill elevations between labels
+        (ids of seeds) which meet.
+        """
+        import numpy as np
+
+        n, ids = self.n, self.ids
+        dem = self.values.ravel().tolist()
+        filled = list(dem)
+        # -2 for points not in the block:
+        labels = np.where(self.in_block.ravel(), -1, -2).tolist()
+        seeds = np.flatnonzero(self.seeds).tolist()
+        buckets = _get_buckets()
+        for p in seeds:
+            labels[p] = p
+            buckets[dem[p] + ELEVATION_OFFSET].append(p)
+        neighbors = self.get_neighbors()
+        # label * n + other label -> spill elevation:
+        spills: Dict[int, int] = {}
+        for bucket in buckets:
+            bucket.sort(reverse=True)
+            while bucket:
+                # Points at the elevation of the point from the bucket:
+                pit = [bucket.pop()]
+                while pit:
+                    p = pit.pop()
+                    f, label = filled[p], labels[p]
+                    for d in neighbors:
+                        q = p + d
+                        q_label = labels[q]
+                        if q_label == label or q_label == -2:
+                            continue
+                        if q_label == -1:
+                            labels[q] = label
+                            if dem[q] <= f:
+                                filled[q] = f
+                                pit.append(q)
+                            else:
+                                buckets[dem[q] + ELEVATION_OFFSET].append(q)
+                        else:
+                            spill = max(f, filled[q])
+                            key = label * n + q_label if label < q_label else q_label * n + label
+                            if spill < spills.get(key, spill + 1):
+                                spills[key] = spill
+        return {(int(ids[key // n]), int(ids[key % n])): spill for key, spill in spills.items()}
+
+    def fill_flood(self, levels: Dict[int, int], ranks: Dict[int, int]) -> Tuple[Any, Any]:
+        """
+        Floods the block from the seeds at their levels. Returns filled
+        elevations and flow directions (of all points, including the extra
+        ones).
+        """
+        import numpy as np
+
+        n, ids = self.n, self.ids
+        dem = self.values.ravel().tolist()
+        filled = list(dem)
+        rank = [-1] * n
+        parents = [-1] * n
+        # Points not in the block (or already flooded) are done:
+        done = bytearray((~self.in_block).ravel().tobytes())
+
+        # Points on flats flow to the point they were flooded from, flats
+        # are flooded from the seed with the lowest rank first:
+        seeds = np.flatnonzero(self.seeds | (self.valid & ~self.in_block)).tolist()
+        buckets = _get_buckets()
+        for p in seeds:
+            filled[p], rank[p] = levels[int(ids[p])], ranks[int(ids[p])]
+            if not done[p]:
+                done[p] = 1
+                buckets[filled[p] + ELEVATION_OFFSET].append(rank[p] * n + p)
+        neighbors = self.get_neighbors()
+        for bucket in buckets:
+            bucket.sort(reverse=True)
+            while bucket:
+                pit = [bucket.pop() % n]
+                while pit:
+                    p = pit.pop()
+                    f, r = filled[p], rank[p]
+                    for d in neighbors:
+                        q = p + d
+                        if done[q]:
+                            continue
+                        done[q] = 1
+                        rank[q], parents[q] = r, p
+                        if dem[q] <= f:
+                            filled[q] = f
+                            pit.append(q)
+                        else:
+                            buckets[dem[q] + ELEVATION_OFFSET].append(r * n + q)
+
+        shape = self.values.shape
+        filled_array = np.array(filled, dtype=np.int16).reshape(shape)
+        return filled_array, self._get_directions(filled_array, np.array(rank).reshape(shape), np.array(parents).reshape(shape))
+
+    def _get_directions(self, filled: Any, rank: Any, parents: Any) -> Any:
+        import numpy as np
+
+        h, w = self.height, self.width
+        center = filled[1:-1, 1:-1].astype(np.float64)
+        directions = np.zeros(filled.shape, dtype=np.uint8)
+        inner_directions = directions[1:-1, 1:-1]
+        drops = np.zeros(center.shape)
+        # Steepest descent:
+        for direction, (dr, dc) in OFFSETS.items():
+            valid = self.valid[1 + dr : h + 1 + dr, 1 + dc : w + 1 + dc]
+            drop = np.where(valid, (center - filled[1 + dr : h + 1 + dr, 1 + dc : w + 1 + dc]) / mod_math.hypot(dr, dc), 0)
+            steeper = drop > drops
+            inner_directions[steeper] = direction
+            drops[steeper] = drop[steeper]
+
+        # On flats to the point flooded from:
+        flat = (directions == 0) & self.in_block & ~self.seeds
+        indexes = np.flatnonzero(flat)
+        offsets = parents.ravel()[indexes] - indexes
+        for direction, (dr, dc) in OFFSETS.items():
+            directions.ravel()[indexes[offsets == dr * self.stride + dc]] = direction
+
+        # Seeds on flats flow out of the area, or to a neighbor at the same
+        # level with a lower rank:
+        for p in np.flatnonzero((directions == 0) & self.seeds).tolist():
+            row, column = divmod(p, self.stride)
+            best_rank, best_direction = rank[row, column], 0
+            for direction, (dr, dc) in OFFSETS.items():
+                if not self.valid[row + dr, column + dc]:
+                    if self.outlets[row, column]:
+                        best_rank, best_direction = -1, direction
+                        break
+                elif filled[row + dr, column + dc] == filled[row, column] and rank[row + dr, column + dc] < best_rank:
+                    best_rank, best_direction = rank[row + dr, column + dc], direction
+            directions[row, column] = best_direction
+        directions[~self.in_block] = 0
+        return directions
+
+    def get_receivers(self, directions: Any) -> Any:
+        """ Index of the point where every point flows, -1 if none. """
+        import numpy as np
+
+        receivers = np.full(self.n, -1, dtype=np.int64)
+        flat_directions = directions.ravel()
+        for direction, (dr, dc) in OFFSETS.items():
+            indexes = np.flatnonzero(flat_directions == direction)
+            receivers[indexes] = indexes + dr * self.stride + dc
+        return receivers
+
+    def accumulate(self, receivers: Any, weights: Any) -> Any:
+        """ Flow accumulation inside the block. """
+        import numpy as np
+
+        in_block = self.in_block.ravel()
+        receivers = np.where(in_block[np.maximum(receivers, 0)] & (receivers >= 0), receivers, -1)
+        receivers[~in_block] = -1
+        accumulation = np.where(in_block, weights, 0).astype(np.int64)
+        inflows = np.bincount(receivers[receivers >= 0], minlength=self.n)
+        # Points without inflows first:
+        points = np.flatnonzero(in_block & (inflows == 0))
+        while len(points):
+            targets = receivers[points]
+            points, targets = points[targets >= 0], targets[targets >= 0]
+            np.add.at(accumulation, targets, accumulation[points])
+            np.subtract.at(inflows, targets, 1)
+            points = np.unique(targets[inflows[targets] == 0])
+        return accumulation
+
+class Hydrology:
+    """
+    Hydrology of an area of height x width points. read(row_from, row_to,
+    column_from, column_to) returns an int16 array with the points of the
+    area in those rows and columns. Block borders are in row_borders and
+    column_borders (starting with 0, ending with height and width).
+
+    Every block is flooded three times. With keep_floods=True the last flood
+    is kept from the second pass (this needs memory for the whole area).
+    """
+
+    def __init__(self, read: Callable[[int, int, int, int], Any], height: int, width: int, row_borders: List[int],
+                 column_borders: List[int], nodata: int=mod_data.NODATA, keep_floods: bool=False) -> None:
+        self.read = read
+        self.height, self.width = height, width
+        self.row_borders, self.column_borders = row_borders, column_borders
+        self.nodata = nodata
+
+        # Seed (id of the point) -> filled elevation, and the order in which
+        # they were flooded:
+        self.levels: Dict[int, int] = {}
+        self.ranks: Dict[int, int] = {}
+        # Flow from other blocks into points:
+        self.inflows: Dict[int, int] = {}
+        # Block bounds -> filled elevations and flow directions (see
+        # _Block.fill_flood), if kept:
+        self.floods: Optional[Dict[Tuple[int, int, int, int], Tuple[Any, Any]]] = {} if keep_floods else None
+
+    def get_blocks(self) -> Iterator[Tuple[int, int, int, int]]:
+        for row_from, row_to in zip(self.row_borders[:-1], self.row_borders[1:]):
+            for column_from, column_to in zip(self.column_borders[:-1], self.column_borders[1:]):
+                yield row_from, row_to, column_from, column_to
+
+    def __iter__(self) -> Iterator[HydrologyBlock]:
+        self._fill()
+        self._accumulate()
+        for bounds in self.get_blocks():
+            block = _Block(self, *bounds)
+            filled, directions = self.floods.pop(bounds) if self.floods is not None else block.fill_flood(self.levels, self.ranks)
+            accumulation = block.accumulate(block.get_receivers(directions), _get_weights(block, self.inflows)).reshape(filled.shape)
+            filled[~block.valid] = self.nodata
+            yield HydrologyBlock(block.row_from, block.column_from, filled[1:-1, 1:-1], directions[1:-1, 1:-1], accumulation[1:-1, 1:-1])
+
+    def _fill(self) -> None:
+        """ Levels of all seeds (see _Block.label_flood). """
+        import numpy as np
+
+        dem: Dict[int, int] = {}
+        edges: Dict[int, List[Tuple[int, int]]] = {}
+        def add_edge(id_1: int, id_2: int, elevation: int) -> None:
+            edges.setdefault(id_1, []).append((id_2, elevation))
+            edges.setdefault(id_2, []).append((id_1, elevation))
+
+        heap = []
+        for bounds in self.get_blocks():
+            block = _Block(self, *bounds)
+            for (id_1, id_2), elevation in block.label_flood().items():
+                add_edge(id_1, id_2, elevation)
+            seeds = np.flatnonzero(block.seeds)
+            values, ids = block.values.ravel(), block.ids
+            for p, elevation in zip(seeds.tolist(), values[seeds].tolist()):
+                dem[int(ids[p])] = elevation
+            for p in np.flatnonzero(block.outlets).tolist():
+                heap.append((int(values[p]), int(ids[p])))
+            # Seeds next to seeds of the next blocks (on the right and below):
+            for dr, dc in OFFSETS.values():
+                if (dr, dc) > (0, 0):
+                    for p in seeds.tolist():
+                        q = p + dr * block.stride + dc
+                        if block.valid.ravel()[q] and not block.in_block.ravel()[q]:
+                            add_edge(int(ids[p]), int(ids[q]), max(int(values[p]), int(values[q])))
+
+        # Priority-flood of the graph, from the outlets:
+        mod_heapq.heapify(heap)
+        while heap:
+            level, point_id = mod_heapq.heappop(heap)
+            if point_id in self.levels:
+                continue
+            self.levels[point_id] = level
+            self.ranks[point_id] = len(self.ranks)
+            for other_id, elevation in edges.pop(point_id, []):
+                if other_id not in self.levels:
+                    mod_heapq.heappush(heap, (max(level, elevation, dem[other_id]), other_id))
+
+    def _accumulate(self) -> None:
+        """ Flows between blocks (see Hydrology.inflows). """
+        import numpy as np
+
+        # Point flowing out of its block -> (accumulation in its block, point
+        # it flows to), and point flowed into -> the point where that flow
+        # leaves its block:
+        exits: Dict[int, Tuple[int, int]] = {}
+        ends: Dict[int, int] = {}
+        for bounds in self.get_blocks():
+            block = _Block(self, *bounds)
+            filled, directions = block.fill_flood(self.levels, self.ranks)
+            if self.floods is not None:
+                self.floods[bounds] = filled, directions
+            receivers = block.get_receivers(directions)
+            accumulation = block.accumulate(receivers, np.ones(block.n, dtype=np.int64))
+            in_block, valid = block.in_block.ravel(), block.valid.ravel()
+            targets = np.maximum(receivers, 0)
+            leaving = in_block & (receivers >= 0) & ~in_block[targets] & valid[targets]
+            for p, target in zip(np.flatnonzero(leaving).tolist(), receivers[leaving].tolist()):
+                exits[int(block.ids[p])] = (int(accumulation[p]), int(block.ids[target]))
+
+            # Follow flows to the points where they leave the block (or end):
+            last = np.where(in_block & (receivers >= 0) & in_block[targets], receivers, np.arange(block.n))
+            while True:
+                next_last = last[last]
+                if np.array_equal(next_last, last):
+                    break
+                last = next_last
+            border = np.flatnonzero(block.seeds)
+            for p, end in zip(border.tolist(), last[border].tolist()):
+                if leaving[end]:
+                    ends[int(block.ids[p])] = int(block.ids[end])
+
+        # Flows are added in the order of flows (the order of exits doesn't
+        # depend on the order of blocks):
+        dependencies: Dict[int, int] = {}
+        for _, target in exits.values():
+            end = ends.get(target)
+            if end is not None:
+                dependencies[end] = dependencies.get(end, 0) + 1
+        added: Dict[int, int] = {}
+        queue = [exit_id for exit_id in exits if not dependencies.get(exit_id)]
+        while queue:
+            exit_id = queue.pop()
+            local, target = exits[exit_id]
+            total = local + added.get(exit_id, 0)
+            self.inflows[target] = self.inflows.get(target, 0) + total
+            end = ends.get(target)
+            if end is not None:
+                added[end] = added.get(end, 0) + total
+                dependencies[end] -= 1
+                if not dependencies[end]:
+                    queue.append(end)
+
+def _get_buckets() -> List[List[int]]:
+    """
+    Buckets of all int16 elevations. A bucket is complete when it is reached
+    (points are added only to the buckets of higher elevations), so it is
+    sorted once, and points are flooded in the same order as from a heap.
+    """
+    return [[] for _ in range(2 * ELEVATION_OFFSET)]
+
+def _get_weights(block: _Block, inflows: Dict[int, int]) -> Any:
+    import numpy as np
+
+    weights = np.ones(block.n, dtype=np.int64)
+    for p in np.flatnonzero(block.seeds).tolist():
+        weights[p] += inflows.get(int(block.ids[p]), 0)
+    return weights
+
+def _get_borders(start: int, size: int, block_size: int) -> List[int]:
+    """ Borders of blocks of size points, at multiples of block_size (counting from -start). """
+    return [0] + [border for border in range(-start % block_size or block_size, size, block_size)] + [size]
+
+def _check_size(height: int, width: int, max_points: int) -> None:
+    if height * width > max_points:
+        raise Exception(f'{height}x{width} points, more than max_points={max_points}')
+
+def get_region_hydrology(values: Any, nodata: int=mod_data.NODATA, block_size: int=1200,
+                         max_points: int=MAX_POINTS) -> Tuple[Any, Any, Any]:
+    """
+    Filled elevations, flow directions and flow accumulation (see
+    HydrologyBlock) of a region (for example from GeoElevationData.get_region).
+
+    Every block is flooded twice, about 220k points per second (6.5s for the
+    points of a SRTM3 file). Regions with more than max_points points raise
+    an exception.
+    """
+    import numpy as np
+
+    height, width = values.shape
+    _check_size(height, width, max_points)
+    filled = np.empty(values.shape, dtype=np.int16)
+    directions = np.empty(values.shape, dtype=np.uint8)
+    accumulation = np.empty(values.shape, dtype=np.int64)
+    def read(row_from: int, row_to: int, column_from: int, column_to: int) -> Any:
+        return values[row_from : row_to, column_from : column_to]
+    hydrology = Hydrology(read, height, width, _get_borders(0, height, block_size), _get_borders(0, width, block_size),
+                          nodata=nodata, keep_floods=True)
+    for block in hydrology:
+        rows = slice(block.row, block.row + block.filled.shape[0])
+        columns = slice(block.column, block.column + block.filled.shape[1])
+        filled[rows, columns], directions[rows, columns], accumulation[rows, columns] = block.filled, block.directions, block.accumulation
+    return filled, directions, accumulation
+
+def iter_hydrology(geo_elevation_data: mod_data.GeoElevationData, latitude_min: float, latitude_max: float, longitude_min: float,
+                   longitude_max: float, samples_per_degree: Optional[int]=None, max_points: int=MAX_POINTS) -> Iterator[HydrologyBlock]:
+    """
+    Yields blocks (one for every file, from north to south) of the
+    hydrology of all SRTM points in the interval. Rows and columns of blocks
+    are in the array from GeoElevationData.get_region for the interval.
+
+    Every file is read (and flooded) three times, use batch_mode=True (and
+    chunked=True) for large intervals. That is about 160k points per second
+    (9s for a SRTM3 file, 90s for a SRTM1 file). Intervals with more than
+    max_points points raise an exception.
+    """
+    if latitude_min > latitude_max or longitude_min > longitude_max:
+        raise Exception(f'Invalid interval ({latitude_min}, {latitude_max}), ({longitude_min}, {longitude_max})')
+
+    s = samples_per_degree or geo_elevation_data.get_samples_per_degree(latitude_min, latitude_max, longitude_min, longitude_max)
+    # Same as in GeoElevationData.get_region:
+    k_max = mod_math.floor(latitude_max * s + 1e-6)
+    k_min = mod_math.ceil(latitude_min * s - 1e-6)
+    m_min = mod_math.ceil(longitude_min * s - 1e-6)
+    m_max = mod_math.floor(longitude_max * s + 1e-6)
+
+    def read(row_from: int, row_to: int, column_from: int, column_to: int) -> Any:
+        values, _ = geo_elevation_data.get_region((k_max - row_to + 1) / s, (k_max - row_from) / s, (m_min + column_from) / s,
+                                                  (m_min + column_to - 1) / s, samples_per_degree=s)
+        return values
+
+    _check_size(k_max - k_min + 1, m_max - m_min + 1, max_points)
+
+    # Block borders are on file borders:
+    hydrology = Hydrology(read, k_max - k_min + 1, m_max - m_min + 1, _get_borders(-k_max, k_max - k_min + 1, s), _get_borders(m_min, m_max - m_min + 1, s))
+    return iter(hydrology)
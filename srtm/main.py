@@ -15,15 +15,22 @@
 # limitations under the License.
 
 import json     as mod_json
+import logging  as mod_logging
 import os       as mod_os
 import os.path  as mod_path
 
+import threading as mod_threading
+
 from . import data      as mod_data
-from . import retriever as mod_retriever
+from . import failures  as mod_failures
+from . import geoid     as mod_geoid
 from . import utils     as mod_utils
 
 from typing import *
 
+if TYPE_CHECKING:
+    from . import shared as mod_shared
+
 SRTM1_URL = 'https://srtm.kurviger.de/SRTM1/'
 SRTM3_URL = 'https://srtm.kurviger.de/SRTM3/'
 
@@ -31,7 +38,10 @@ package_location = mod_data.__file__[: mod_data.__file__.rfind(mod_path.sep)]
 DEFAULT_LIST_JSON = package_location + mod_os.sep + 'list.json'
 
 def get_data(srtm1: bool=True, srtm3: bool=True, leave_zipped: bool=False, file_handler: Optional[mod_utils.FileHandler]=None,
-             use_included_urls: bool=True, batch_mode: bool=False, local_cache_dir: str = "", timeout: int = 0) -> mod_data.GeoElevationData:
+             use_included_urls: bool=True, batch_mode: bool=False, local_cache_dir: str = "", timeout: int = 0,
+             tile_store: Optional["mod_shared.SharedTileStore"]=None, chunked: bool=False,
+             height_reference: str=mod_geoid.GEOID, resolution: Optional[float]=None,
+             memo_size: int=mod_data.DEFAULT_MEMO_SIZE, failure_policy: str=mod_failures.RAISE) -> mod_data.GeoElevationData:
     """
     Get the utility object for querying elevation data.
 
@@ -50,6 +60,11 @@ def get_data(srtm1: bool=True, srtm3: bool=True, leave_zipped: bool=False, file_
     zip files. That means less disk space but more computing space for every
     file loaded.
 
+    If chunked is True then files will be stored locally compressed in blocks
+    (see srtm.chunked), almost as small as zip files, but only the blocks
+    needed for the requested points are decompressed. Existing .hgt and
+    .hgt.zip files can be converted with srtm.chunked.convert.
+
     If use_included_urls is True urls to SRTM files included in the library
     will be used. Set to false if you need to reload them on first run.
 
@@ -64,6 +79,33 @@ def get_data(srtm1: bool=True, srtm3: bool=True, leave_zipped: bool=False, file_
     Srtm1 has a resolution of one arc-second (cca 30 meters). Srtm1 is
     available only for the United states. If both srtm1 ans srtm3 are True and
     both files are present for a location -- the srtm1 will be used.
+
+    Unless resolution (the distance between points needed, in meters) is
+    set. Then srtm3 files (9 times smaller) are used when 90 meters is good
+    enough, and srtm1 files otherwise. If the file of one dataset is missing
+    or has too many invalid points the other one is used. The resolution can
+    also be set for every query, and get_elevation_and_dataset returns the
+    dataset used. Files are then stored with the dataset in the name (for
+    example SRTM3_N44W072.hgt).
+
+    If tile_store is set (see srtm.shared.SharedTileStore), loaded files are
+    kept in shared memory and shared with other processes using the same
+    store, instead of every process keeping its own copy.
+
+    With memo_size (for example srtm.data.MEMO_SIZE), elevations of the last
+    memo_size cells (of the SRTM1 grid, about 30x30 meters) used are
+    memoized, so repeated (or very near) points are fast. It is off by
+    default, because it slows down points which are not repeated.
+
+    Files which can't be retrieved (or unzipped) are not retried for a day,
+    servers are not tried for a minute after 3 consecutive failures (see
+    srtm.failures). Points in such files raise an exception, or have no
+    elevation (None) with failure_policy=srtm.failures.NONE.
+
+    SRTM elevations are heights above the EGM96 geoid. With
+    height_reference=srtm.geoid.ELLIPSOID elevations will be converted to
+    heights above the WGS84 ellipsoid (like GNSS heights), this needs the
+    geoid file, see srtm.geoid.
     """
     if not file_handler:
         file_handler = mod_utils.FileHandler(local_cache_dir)
@@ -71,34 +113,103 @@ def get_data(srtm1: bool=True, srtm3: bool=True, leave_zipped: bool=False, file_
     if not srtm1 and not srtm3:
         raise Exception('At least one of srtm1 and srtm3 must be True')
 
-    srtm1_files, srtm3_files = _get_urls(use_included_urls, file_handler, timeout)
+    # Urls are loaded only when needed (files already stored don't need them):
+    urls = _Urls(use_included_urls, file_handler, timeout)
+    srtm1_files: MutableMapping[str, str] = LazyUrls(urls, 0) if srtm1 else {}
+    srtm3_files: MutableMapping[str, str] = LazyUrls(urls, 1) if srtm3 else {}
 
-    assert srtm1_files
-    assert srtm3_files
+    return mod_data.GeoElevationData(srtm1_files, srtm3_files, file_handler=file_handler,
+                                     leave_zipped=leave_zipped, batch_mode=batch_mode,
+                                     timeout=timeout, tile_store=tile_store,
+                                     chunked=chunked, height_reference=height_reference,
+                                     resolution=resolution, memo_size=memo_size,
+                                     failure_policy=failure_policy)
 
-    if not srtm1:
-        srtm1_files = {}
-    if not srtm3:
-        srtm3_files = {}
+class _Urls:
+    """ srtm1 and srtm3 urls, loaded (or retrieved) on first use. """
 
-    assert srtm1_files or srtm3_files
+    def __init__(self, use_included_urls: bool, file_handler: mod_utils.FileHandler, timeout: int) -> None:
+        self.use_included_urls = use_included_urls
+        self.file_handler = file_handler
+        self.timeout = timeout
+        self.urls: Optional[Tuple[Dict[str, str], Dict[str, str]]] = None
+        self.lock = mod_threading.Lock()
 
-    return mod_data.GeoElevationData(srtm1_files, srtm3_files, file_handler=file_handler,
-                                     leave_zipped=leave_zipped, batch_mode=batch_mode,
-                                     timeout=timeout)
+    def get(self) -> Tuple[Dict[str, str], Dict[str, str]]:
+        with self.lock:
+            if self.urls is None:
+                self.urls = _get_urls(self.use_included_urls, self.file_handler, self.timeout)
+                assert self.urls[0]
+                assert self.urls[1]
+            return self.urls
+
+class LazyUrls(MutableMapping[str, str]):
+    """ File name -> url mapping which is loaded when first used. """
+
+    def __init__(self, urls: _Urls, index: int) -> None:
+        self.urls = urls
+        self.index = index
+
+    def _get(self) -> Dict[str, str]:
+        return self.urls.get()[self.index]
+
+    def __getitem__(self, file_name: str) -> str:
+        return self._get()[file_name]
+
+    def __setitem__(self, file_name: str, url: str) -> None:
+        self._get()[file_name] = url
+
+    def __delitem__(self, file_name: str) -> None:
+        del self._get()[file_name]
+
+    def __contains__(self, file_name: object) -> bool:
+        return file_name in self._get()
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._get())
+
+    def __len__(self) -> int:
+        return len(self._get())
 
 def _get_urls(use_included_urls: bool, file_handler: mod_utils.FileHandler, timeout: int) -> Tuple[Dict[str, str], Dict[str, str]]:
-    files_list_file_name = 'list.json'
     try:
         urls_json = _get_urls_json(use_included_urls, file_handler)
         return urls_json['srtm1'], urls_json['srtm3']
     except:
-        srtm1_files = mod_retriever.retrieve_all_files_urls(SRTM1_URL, timeout)
-        srtm3_files = mod_retriever.retrieve_all_files_urls(SRTM3_URL, timeout)
+        return update_urls(file_handler, timeout)
+
+def update_urls(file_handler: Optional[mod_utils.FileHandler]=None, timeout: int=0, workers: int=8,
+                srtm1_url: str=SRTM1_URL, srtm3_url: str=SRTM3_URL) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """
+    Retrieves urls of all SRTM files and saves them in list.json (with the
+    file handler). Use get_data(use_included_urls=False) to use them.
+
+    The update is incremental: directories which were not modified since
+    the previous update (saved in list.json) are not retrieved again, and
+    files of directories which can't be retrieved are kept. list.json is
+    replaced only when both SRTM1 and SRTM3 urls are retrieved.
+    """
+    from . import retriever as mod_retriever
+
+    files_list_file_name = 'list.json'
+    if not file_handler:
+        file_handler = mod_utils.FileHandler()
+
+    previous: Dict[str, Any] = {}
+    try:
+        previous = mod_json.loads(file_handler.read(files_list_file_name))
+    except Exception as e:
+        mod_logging.debug(f'No previous {files_list_file_name}: {e}')
+    validators = previous.get('validators') or {}
+
+    session = mod_retriever.create_session(workers)
+    srtm1 = mod_retriever.crawl(srtm1_url, timeout, previous.get('srtm1'), validators, session=session, workers=workers)
+    srtm3 = mod_retriever.crawl(srtm3_url, timeout, previous.get('srtm3'), validators, session=session, workers=workers)
 
-        file_handler.write(files_list_file_name, mod_json.dumps({'srtm1': srtm1_files, 'srtm3': srtm3_files}, sort_keys=True, indent=4).encode())
+    urls_json = {'srtm1': srtm1.urls, 'srtm3': srtm3.urls, 'validators': {**srtm1.validators, **srtm3.validators}}
+    file_handler.write(files_list_file_name, mod_json.dumps(urls_json, sort_keys=True, indent=4).encode())
 
-        return srtm1_files, srtm3_files
+    return srtm1.urls, srtm3.urls
 
 def _get_urls_json(use_included_urls: bool, file_handler: mod_utils.FileHandler) -> Any:
     if use_included_urls:
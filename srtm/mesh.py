@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2013 Tomo Krajina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Triangle meshes (TIN) of SRTM points with a maximum vertical error, for 3D
+clients. Triangles are right-angled triangles of a regular hierarchy (RTIN,
+as in Mapbox Martini), split only where needed, so the mesh has no cracks.
+"""
+
+import math as mod_math
+
+from . import data as mod_data
+
+from typing import *
+
+# Geotransform in the GDAL order (see GeoElevationData.get_region):
+GeoTransform = Tuple[float, float, float, float, float, float]
+
+class Mesh(NamedTuple):
+    """
+    Compact buffers for 3D clients: vertices are points of the region, given
+    by their grid coordinates (see get_vertices for latitudes, longitudes
+    and elevations).
+    """
+    # Of the region (latitudes and longitudes of the grid coordinates):
+    geo_transform: GeoTransform
+    # uint16 array with (column, row) of every vertex (uint32 for regions
+    # with more than 65536 rows or columns):
+    points: Any
+    # int16 elevations of the vertices (float32 for non integer values or void_elevation):
+    heights: Any
+    # uint16 array with indexes of the three vertices of every triangle
+    # (uint32 for meshes with more than 65536 vertices), counterclockwise
+    # looking from above:
+    triangles: Any
+
+    def get_vertices(self) -> Any:
+        """ float64 array with (latitude, longitude, elevation) of every vertex. """
+        import numpy as np
+
+        x, pixel_width, _, y, _, pixel_height = self.geo_transform
+        columns, rows = self.points[:, 0].astype(np.float64), self.points[:, 1].astype(np.float64)
+        return np.stack((y + (rows + .5) * pixel_height, x + (columns + .5) * pixel_width, self.heights.astype(np.float64)), axis=1)
+
+def _get_children(triangles: Any) -> Any:
+    """
+    Triangles are rows of (ax, ay, bx, by, cx, cy) with the hypotenuse a-b,
+    the children are split by the line from c to the middle of a-b.
+    """
+    import numpy as np # type: ignore
+
+    ax, ay, bx, by, cx, cy = triangles.T
+    mx, my = (ax + bx) // 2, (ay + by) // 2
+    return np.concatenate((np.stack((cx, cy, ax, ay, mx, my), axis=1), np.stack((bx, by, cx, cy, mx, my), axis=1)))
+
+# Windows of points processed at once:
+CHUNK_POINTS = 2 ** 20
+
+def _max_errors(windows: Any, get_planes: Callable[[slice, Any, Any, Any], Any], mask: Any) -> Any:
+    """
+    Maximum difference between windows of points and planes of triangles
+    (only where mask, NaN points are ignored). get_planes(rows, windows, u, v)
+    returns elevations of the triangles at column u and row v of windows
+    (with the given rows of windows).
+    """
+    import numpy as np
+
+    size = windows.shape[-1]
+    u, v = np.arange(size, dtype=np.float32)[np.newaxis, :], np.arange(size, dtype=np.float32)[:, np.newaxis]
+    result = np.empty(windows.shape[:2], dtype=np.float32)
+    step = max(1, CHUNK_POINTS // (size * size * windows.shape[1]))
+    for n in range(0, windows.shape[0], step):
+        rows = slice(n, n + step)
+        differences = np.where(mask, np.abs(get_planes(rows, windows[rows], u, v) - windows[rows]), 0)
+        result[n : n + step] = np.nanmax(differences, axis=(-2, -1))
+    return result
+
+def _add_edge_errors(errors: Any, heights: Any, length: int) -> None:
+    """
+    Errors of triangles with horizontal hypotenuses of the given length (call
+    with transposed arrays for vertical ones).
+    """
+    import numpy as np
+    from numpy.lib.stride_tricks import sliding_window_view # type: ignore
+
+    h, q = length // 2, length // 4
+    # Triangles above and below of every hypotenuse (NaN outside the grid):
+    padded = np.pad(heights, h, constant_values=np.nan)
+    windows = sliding_window_view(padded, (length + 1, length + 1))[0::length, h::length]
+
+    def get_planes(rows: slice, w: Any, u: Any, v: Any) -> Any:
+        a, b = w[..., h, 0, np.newaxis, np.newaxis], w[..., h, length, np.newaxis, np.newaxis]
+        c = np.where(v < h, np.nan_to_num(w[..., 0, h, np.newaxis, np.newaxis]), np.nan_to_num(w[..., length, h, np.newaxis, np.newaxis]))
+        return a + (b - a) * u / length + (c - (a + b) / 2) * np.abs(h - v) / h
+
+    u, v = np.arange(length + 1)[np.newaxis, :], np.arange(length + 1)[:, np.newaxis]
+    middles = errors[0::length, h::length]
+    np.maximum(middles, _max_errors(windows, get_planes, np.abs(u - h) + np.abs(v - h) <= h), out=middles)
+    if q:
+        # Middles of children above and below:
+        for m in (h - q, h + q):
+            np.maximum(middles[1:], errors[length - q::length, m::length], out=middles[1:])
+            np.maximum(middles[:-1], errors[q::length, m::length], out=middles[:-1])
+
+def _add_square_errors(errors: Any, heights: Any, length: int) -> None:
+    """ Errors of triangles with diagonal hypotenuses, in squares of the given length. """
+    import numpy as np
+    from numpy.lib.stride_tricks import sliding_window_view
+
+    t, h = errors.shape[0] - 1, length // 2
+    windows = sliding_window_view(heights, (length + 1, length + 1))[0::length, 0::length]
+    # The diagonal goes through the center of the parent square:
+    i, j = np.indices(windows.shape[:2])
+    main_diagonal = ((i + j) % 2 == 0)[..., np.newaxis, np.newaxis]
+
+    def get_planes(rows: slice, w: Any, u: Any, v: Any) -> Any:
+        tl, tr = w[..., 0, 0, np.newaxis, np.newaxis], w[..., 0, length, np.newaxis, np.newaxis]
+        bl, br = w[..., length, 0, np.newaxis, np.newaxis], w[..., length, length, np.newaxis, np.newaxis]
+        # Mirrored, the other diagonal is the main diagonal:
+        main = main_diagonal[rows]
+        tl, tr, bl, br = np.where(main, tl, tr), np.where(main, tr, tl), np.where(main, bl, br), np.where(main, br, bl)
+        u = np.where(main, u, length - u) / length
+        v = v / length
+        upper = u >= v
+        return tl + np.where(upper, tr - tl, br - bl) * u + np.where(upper, br - tr, bl - tl) * v
+
+    middles = errors[h::length, h::length]
+    np.maximum(middles, _max_errors(windows, get_planes, True), out=middles)
+    # Middles of children (sides of the square):
+    for children in (errors[h::length, 0:t:length], errors[h::length, length::length],
+                     errors[0:t:length, h::length], errors[length::length, h::length]):
+        np.maximum(middles, children, out=middles)
+
+def _get_errors(heights: Any, forced: Any) -> Any:
+    """
+    Maximum error (of a 2 ** n + 1 square of heights) of triangles with the
+    point in the middle of the hypotenuse, and of all their descendants.
+    Points where forced are always used.
+    """
+    import numpy as np
+
+    errors = np.where(forced, np.inf, 0.).astype(np.float32)
+    length = 2
+    # From the smallest triangles up:
+    while length < heights.shape[0]:
+        _add_edge_errors(errors, heights, length)
+        _add_edge_errors(errors.T, heights.T, length)
+        _add_square_errors(errors, heights, length)
+        length *= 2
+    return errors.ravel()
+
+def _get_triangles(errors: Any, size: int, max_error: float) -> Any:
+    """ Triangles (as in _get_children) of the mesh. """
+    import numpy as np
+
+    t = size - 1
+    triangles = np.array([[0, 0, t, t, t, 0], [t, t, 0, 0, 0, t]], dtype=np.int32)
+    result = []
+    while len(triangles):
+        ax, ay, bx, by, cx, cy = triangles.T
+        split = (np.abs(ax - cx) + np.abs(ay - cy) > 1) & (errors[(ay + by) // 2 * size + (ax + bx) // 2] > max_error)
+        result.append(triangles[~split])
+        triangles = _get_children(triangles[split])
+    return np.concatenate(result)
+
+def get_region_mesh(values: Any, geo_transform: GeoTransform, max_error: float, nodata: int=mod_data.NODATA,
+                    void_elevation: float=0.) -> Mesh:
+    """
+    Mesh of a region (for example from GeoElevationData.get_region) where the
+    elevation of every point differs by at most max_error meters from the
+    mesh. Points with nodata are at void_elevation.
+    """
+    import numpy as np
+
+    if max_error < 0:
+        raise Exception(f'Invalid max_error {max_error}')
+    height, width = values.shape
+    if height < 2 or width < 2:
+        raise Exception(f'Region {values.shape} too small for a mesh')
+
+    # The hierarchy of triangles needs a square of 2 ** n + 1 points, the rest
+    # is filled with the values on the border:
+    size = 2 ** mod_math.ceil(mod_math.log2(max(height, width) - 1)) + 1
+    heights = np.where(values == nodata, void_elevation, values).astype(np.float32)
+    heights = np.pad(heights, ((0, size - height), (0, size - width)), mode='edge')
+
+    # With all points on the last row and column of the region used, no
+    # triangle crosses them, and triangles outside can be removed:
+    forced = np.zeros((size, size), dtype=bool)
+    if height < size:
+        forced[height - 1, :width] = True
+    if width < size:
+        forced[:height, width - 1] = True
+
+    errors = _get_errors(heights, forced)
+    triangles = _get_triangles(errors, size, max_error)
+    ax, ay, bx, by, cx, cy = triangles.T
+    inside = (np.maximum(np.maximum(ax, bx), cx) < width) & (np.maximum(np.maximum(ay, by), cy) < height)
+    triangles = triangles[inside]
+
+    # Rows are y, so (a, b, c) is counterclockwise looking from above if it
+    # is clockwise in (x, y):
+    ax, ay, bx, by, cx, cy = triangles.T
+    clockwise = (bx - ax) * (cy - ay) - (by - ay) * (cx - ax) > 0
+    points = np.stack((ay * size + ax, np.where(clockwise, cy * size + cx, by * size + bx),
+                       np.where(clockwise, by * size + bx, cy * size + cx)), axis=1)
+    point_indexes, indexes = np.unique(points, return_inverse=True)
+    rows, columns = point_indexes // size, point_indexes % size
+
+    heights_type = np.int16 if values.dtype.kind in 'iu' and void_elevation == int(void_elevation) else np.float32
+    points_type = np.uint16 if max(height, width) <= 2 ** 16 else np.uint32
+    indexes_type = np.uint16 if len(point_indexes) <= 2 ** 16 else np.uint32
+    return Mesh(geo_transform, np.stack((columns, rows), axis=1).astype(points_type),
+                heights[rows, columns].astype(heights_type), indexes.reshape(-1, 3).astype(indexes_type))
+
+def get_mesh(geo_elevation_data: mod_data.GeoElevationData, max_error: float, latitude_min: float, latitude_max: float,
+             longitude_min: float, longitude_max: float, samples_per_degree: Optional[int]=None, void_elevation: float=0.) -> Mesh:
+    """ Mesh of all SRTM points in the interval (see get_region_mesh). """
+    values, geo_transform = geo_elevation_data.get_region(latitude_min, latitude_max, longitude_min, longitude_max,
+                                                          samples_per_degree=samples_per_degree)
+    return get_region_mesh(values, geo_transform, max_error, void_elevation=void_elevation)
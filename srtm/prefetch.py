@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2013 Tomo Krajina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Loads files (and blocks of chunked files) in a background thread before
+they are needed, for queries of points moving along a trajectory.
+"""
+
+import collections        as mod_collections
+import concurrent.futures as mod_futures
+import logging            as mod_logging
+import math               as mod_math
+import threading          as mod_threading
+
+from . import chunked as mod_chunked
+from . import data    as mod_data
+from . import utils   as mod_utils
+
+from typing import *
+
+DEFAULT_LOOKAHEAD = 20000.
+DEFAULT_HISTORY = 8
+
+class PrefetchStats(NamedTuple):
+    queries: int
+    # Queries entering another file, for which the file was not loaded (the
+    # query waited for the file, or for its prefetch in progress):
+    stalls: int
+    # Queries entering another file which was already prefetched:
+    stalls_avoided: int
+    prefetched_files: int
+    prefetched_blocks: int
+    # Files which couldn't be prefetched (for example no connection):
+    failed: int
+
+class Prefetcher:
+    """
+    Use get_elevation of the prefetcher instead of get_elevation of
+    geo_elevation_data (or call observe for every point queried). From the
+    last history points the prefetcher finds the heading, and loads files
+    (and blocks of chunked files) up to lookahead meters ahead in a
+    background thread.
+
+    The files are loaded in geo_elevation_data, so it can't be in
+    batch_mode. Use it as a context manager, or call close().
+    """
+
+    def __init__(self, geo_elevation_data: mod_data.GeoElevationData, lookahead: float=DEFAULT_LOOKAHEAD,
+                 history: int=DEFAULT_HISTORY, blocks: bool=True) -> None:
+        if geo_elevation_data.batch_mode:
+            raise Exception('Prefetching doesn\'t work in batch mode (prefetched files would replace the current one)')
+        self.geo_elevation_data = geo_elevation_data
+        self.lookahead = lookahead
+        self.blocks = blocks
+        self.positions: "mod_collections.deque[Tuple[float, float]]" = mod_collections.deque(maxlen=max(2, history))
+
+        self.executor = mod_futures.ThreadPoolExecutor(max_workers=1)
+        self.lock = mod_threading.Lock()
+        # Files prefetched or being prefetched:
+        self.requested: Dict[str, "mod_futures.Future[None]"] = {}
+        self.prefetched: Set[str] = set()
+        # Position of the last prediction:
+        self.predicted_from: Optional[Tuple[float, float]] = None
+
+        self.file_name: Optional[str] = None
+        self.queries = self.stalls = self.stalls_avoided = self.prefetched_blocks = self.failed = 0
+
+    def __enter__(self) -> "Prefetcher":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def get_elevation(self, latitude: float, longitude: float, approximate: bool=False,
+                      height_reference: Optional[str]=None) -> Optional[float]:
+        self.observe(latitude, longitude)
+        return self.geo_elevation_data.get_elevation(latitude, longitude, approximate=approximate, height_reference=height_reference)
+
+    def observe(self, latitude: float, longitude: float) -> None:
+        """ Records a query (before it is made) and prefetches what will be needed next. """
+        self.queries += 1
+        file_name = mod_data.get_file_name(latitude, longitude)
+        if file_name != self.file_name:
+            self.file_name = file_name
+            self._enter_file(file_name)
+
+        self.positions.append((latitude, longitude))
+        # Predict again after a quarter of the lookahead:
+        if self.predicted_from is None or \
+           mod_utils.distance(latitude, longitude, *self.predicted_from) > self.lookahead / 4:
+            points = self._predict()
+            if points:
+                self.predicted_from = (latitude, longitude)
+                self._prefetch(points)
+
+    def _enter_file(self, file_name: str) -> None:
+        if file_name in self.prefetched:
+            self.stalls_avoided += 1
+            return
+        with self.lock:
+            future = self.requested.get(file_name)
+        if future is not None and not future.done():
+            self.stalls += 1
+            future.result()
+        elif not self._is_loaded(file_name) and file_name not in self.geo_elevation_data.missing_file_names:
+            self.stalls += 1
+
+    def _is_loaded(self, file_name: str) -> bool:
+        files = self.geo_elevation_data.files
+        return any(mod_data.get_dataset_file_name(file_name, dataset) in files for dataset in (None, mod_data.SRTM1, mod_data.SRTM3))
+
+    def _predict(self) -> List[Tuple[float, float]]:
+        """ Points from the last position to lookahead meters ahead. """
+        if len(self.positions) < 2:
+            return []
+        (latitude_1, longitude_1), (latitude_2, longitude_2) = self.positions[0], self.positions[-1]
+        distance = mod_utils.distance(latitude_1, longitude_1, latitude_2, longitude_2)
+        if distance == 0:
+            return []
+        # Every point is at most 1/16 of a degree from the previous one:
+        steps = max(1, mod_math.ceil(self.lookahead / mod_utils.ONE_DEGREE * 16))
+        coef = self.lookahead / distance / steps
+        d_latitude, d_longitude = (latitude_2 - latitude_1) * coef, (longitude_2 - longitude_1) * coef
+        return [(latitude_2 + d_latitude * n, longitude_2 + d_longitude * n) for n in range(steps + 1)]
+
+    def _prefetch(self, points: List[Tuple[float, float]]) -> None:
+        for latitude, longitude in points:
+            if not -90 <= latitude < 90:
+                continue
+            longitude = (longitude + 180) % 360 - 180
+            file_name = mod_data.get_file_name(latitude, longitude)
+            with self.lock:
+                if file_name not in self.requested and not self._is_loaded(file_name):
+                    self.requested[file_name] = self.executor.submit(self._load_file, file_name, latitude, longitude)
+                if self.blocks:
+                    self.executor.submit(self._load_block, file_name, latitude, longitude)
+
+    def _load_file(self, file_name: str, latitude: float, longitude: float) -> None:
+        try:
+            if self.geo_elevation_data.get_file(latitude, longitude):
+                self.prefetched.add(file_name)
+                mod_logging.debug(f'Prefetched {file_name}')
+        except Exception:
+            mod_logging.exception(f'Error prefetching {file_name}')
+            self.failed += 1
+
+    def _load_block(self, file_name: str, latitude: float, longitude: float) -> None:
+        """ Decompresses the block with the point, if the file is chunked (and loaded). """
+        if file_name not in self.prefetched and not self._is_loaded(file_name):
+            return
+        geo_file = self.geo_elevation_data.get_file(latitude, longitude)
+        if not geo_file or not isinstance(geo_file.data, mod_chunked.ChunkedFile):
+            return
+        block_no = geo_file.data.get_block_no(*geo_file.get_row_and_column(latitude, longitude))
+        if block_no not in geo_file.data.blocks:
+            geo_file.data.get_block(block_no)
+            self.prefetched_blocks += 1
+
+    def get_stats(self) -> PrefetchStats:
+        return PrefetchStats(self.queries, self.stalls, self.stalls_avoided, len(self.prefetched), self.prefetched_blocks, self.failed)
@@ -14,32 +14,127 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import concurrent.futures as mod_futures
 import logging        as mod_logging
-import requests       as mod_requests
 import re             as mod_re
 
 from . import utils   as mod_utils
 
 from typing import *
 
+if TYPE_CHECKING:
+    import requests as mod_requests
+
+DEFAULT_WORKERS = 8
+
+# Validators (ETag and Last-Modified headers) of a directory page:
+Validators = Dict[str, str]
+
+class CrawlResult(NamedTuple):
+    # File name -> url:
+    urls: Dict[str, str]
+    # Directory url -> validators, for the next (incremental) crawl:
+    validators: Dict[str, Validators]
+    # Directories which weren't modified since the previous crawl:
+    not_modified: List[str]
+    # Directories which couldn't be retrieved (their previous files are kept):
+    failed: List[str]
+
+def create_session(workers: int=DEFAULT_WORKERS) -> "mod_requests.Session":
+    """ Session with a connection pool big enough for workers threads. """
+    import requests as mod_requests
+
+    session = mod_requests.Session()
+    adapter = mod_requests.adapters.HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
 def retrieve_all_files_urls(url: str, timeout: int) -> Dict[str, str]:
-    mod_logging.info('Retrieving {0}'.format(url))
-    contents = mod_requests.get(url, timeout=timeout or mod_utils.DEFAULT_TIMEOUT).text
+    return crawl(url, timeout).urls
 
-    url_candidates = mod_re.findall('href="(.*?)"', contents)
-    urls: Dict[str, str] = {}
+def crawl(url: str, timeout: int, previous_urls: Optional[Dict[str, str]]=None, previous_validators: Optional[Dict[str, Validators]]=None,
+          session: Optional["mod_requests.Session"]=None, workers: int=DEFAULT_WORKERS) -> CrawlResult:
+    """
+    Retrieves urls of all files in the directories listed on the url page,
+    (at most workers) directories at a time.
 
-    for url_candidate in url_candidates:
+    If previous_urls and previous_validators (from a previous crawl) are
+    given, directories are retrieved with conditional requests, and files
+    of unmodified directories are taken from previous_urls. Files of
+    directories which can't be retrieved are also taken from previous_urls.
+    """
+    previous_urls = previous_urls or {}
+    previous_validators = previous_validators or {}
+    if session is None:
+        session = create_session(workers)
+
+    mod_logging.info('Retrieving {0}'.format(url))
+    response = session.get(url, timeout=timeout or mod_utils.DEFAULT_TIMEOUT)
+    response.raise_for_status()
+
+    directory_urls = []
+    for url_candidate in mod_re.findall('href="(.*?)"', response.text):
         if url_candidate.endswith('/') and not url_candidate in url:
-            files_url = '{0}/{1}'.format(url, url_candidate)
+            directory_urls.append('{0}/{1}'.format(url, url_candidate))
 
-            urls.update(get_files(files_url, timeout))
+    def get_directory(directory_url: str) -> Tuple[Optional[Dict[str, str]], Validators]:
+        return get_directory_files(directory_url, timeout, session, previous_validators.get(directory_url))
 
-    return urls
+    result = CrawlResult({}, {}, [], [])
+    with mod_futures.ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = [executor.submit(get_directory, directory_url) for directory_url in directory_urls]
+        for directory_url, future in zip(directory_urls, futures):
+            try:
+                files, validators = future.result()
+            except Exception as e:
+                mod_logging.error(f'Error retrieving {directory_url}: {e}')
+                result.failed.append(directory_url)
+                files, validators = None, previous_validators.get(directory_url, {})
+            if files is None:
+                if directory_url not in result.failed:
+                    result.not_modified.append(directory_url)
+                files = {file_name: file_url for file_name, file_url in previous_urls.items() if file_url.startswith(directory_url)}
+            result.urls.update(files)
+            if validators:
+                result.validators[directory_url] = validators
+
+    mod_logging.info(f'Found {len(result.urls)} files in {url} ({len(result.not_modified)} directories not modified, {len(result.failed)} failed)')
+    return result
 
 def get_files(url: str, timeout: int) -> Dict[str, str]:
+    files, _ = get_directory_files(url, timeout)
+    assert files is not None
+    return files
+
+def get_directory_files(url: str, timeout: int, session: Optional["mod_requests.Session"]=None,
+                        validators: Optional[Validators]=None) -> Tuple[Optional[Dict[str, str]], Validators]:
+    """
+    Returns urls of files in the directory and its validators. If
+    validators are given and the directory isn't modified the files are
+    None.
+    """
     mod_logging.info('Retrieving {0}'.format(url))
-    contents = mod_requests.get(url, timeout=timeout or mod_utils.DEFAULT_TIMEOUT).text
+    headers = {}
+    if validators and validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators and validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
+
+    import requests as mod_requests
+
+    response = (session or mod_requests).get(url, timeout=timeout or mod_utils.DEFAULT_TIMEOUT, headers=headers)
+    if response.status_code == 304:
+        mod_logging.info('Not modified {0}'.format(url))
+        return None, validators or {}
+    response.raise_for_status()
+    contents = response.text
+
+    new_validators = {}
+    if response.headers.get('ETag'):
+        new_validators['etag'] = response.headers['ETag']
+    if response.headers.get('Last-Modified'):
+        new_validators['last_modified'] = response.headers['Last-Modified']
 
     result: Dict[str, str] = {}
 
@@ -51,4 +146,4 @@ def get_files(url: str, timeout: int) -> Dict[str, str]:
 
     mod_logging.info('Found {0} files'.format(len(result)))
 
-    return result
+    return result, new_validators
@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2013 Tomo Krajina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tile store keeping SRTM files in shared memory, so that many processes on the
+same host can read the same tiles without every process loading its own copy.
+"""
+
+import logging                          as mod_logging
+import os                               as mod_os
+import os.path                          as mod_path
+import struct                           as mod_struct
+import sys                              as mod_sys
+import tempfile                         as mod_tempfile
+import multiprocessing.shared_memory    as mod_shared_memory
+import multiprocessing.resource_tracker as mod_resource_tracker
+
+from typing import *
+
+MAGIC = b'SRTM'
+VERSION = 2
+
+# Maximum length of (encoded) file names, for example SRTM3_N44W072.hgt:
+NAME_SIZE = 32
+
+HEADER = mod_struct.Struct('<4sIII')
+ENTRY = mod_struct.Struct(f'<{NAME_SIZE}sQI')
+LEASE = mod_struct.Struct('<iii')
+
+ENTRY_EMPTY = 0
+ENTRY_LIVE = 1
+ENTRY_EVICTED = 2
+
+class _FileLock:
+    """ Lock shared by all processes using the same store name. """
+
+    def __init__(self, file_name: str) -> None:
+        self.file_name = file_name
+        self.fd: Optional[int] = None
+
+    def __enter__(self) -> "_FileLock":
+        self.fd = mod_os.open(self.file_name, mod_os.O_RDWR | mod_os.O_CREAT, 0o666)
+        if mod_sys.platform == 'win32':
+            import msvcrt as mod_msvcrt
+            mod_msvcrt.locking(self.fd, mod_msvcrt.LK_LOCK, 1) # type: ignore
+        else:
+            import fcntl as mod_fcntl
+            mod_fcntl.flock(self.fd, mod_fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        if self.fd is not None:
+            # Closing the descriptor releases the lock (also when the process dies):
+            mod_os.close(self.fd)
+            self.fd = None
+
+def _attach(name: str, create: bool=False, size: int=0) -> mod_shared_memory.SharedMemory:
+    """
+    The segments are owned by the store (and unlinked in SharedTileStore.close),
+    so they must not be unlinked by the resource tracker when the process which
+    created or attached them exits.
+    """
+    if mod_sys.version_info >= (3, 13):
+        return mod_shared_memory.SharedMemory(name, create=create, size=size, track=False) # type: ignore
+    segment = mod_shared_memory.SharedMemory(name, create=create, size=size)
+    try:
+        mod_resource_tracker.unregister(segment._name, 'shared_memory') # type: ignore
+    except Exception as e:
+        mod_logging.debug(f'Cannot unregister {name} from resource tracker: {e}')
+    return segment
+
+def _unlink(segment: mod_shared_memory.SharedMemory) -> None:
+    """ Before 3.13 unlink() also unregisters the segment, it must be registered again (see _attach). """
+    if mod_sys.version_info < (3, 13):
+        mod_resource_tracker.register(segment._name, 'shared_memory') # type: ignore
+    segment.unlink()
+
+def _is_alive(pid: int) -> bool:
+    if mod_sys.platform == 'win32':
+        # On Windows os.kill(pid, 0) sends CTRL_C_EVENT, it isn't a probe:
+        import ctypes as mod_ctypes
+        PROCESS_QUERY_LIMITED_INFORMATION, STILL_ACTIVE, ERROR_ACCESS_DENIED = 0x1000, 259, 5
+        kernel32 = mod_ctypes.windll.kernel32 # type: ignore
+        handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        if not handle:
+            # Access denied means the process exists:
+            return bool(kernel32.GetLastError() == ERROR_ACCESS_DENIED)
+        try:
+            exit_code = mod_ctypes.c_ulong()
+            if not kernel32.GetExitCodeProcess(handle, mod_ctypes.byref(exit_code)):
+                return True
+            return exit_code.value == STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        mod_os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+class SharedTileStore:
+    """
+    Stores the raw contents of SRTM files in shared memory segments.
+
+    One process (the owner) creates the store with create=True, the others
+    attach to it by name. Every process which uses a tile holds a lease on it
+    (leases are stored with the pid of the process in an index segment), so a
+    tile evicted by the owner is unlinked only when nobody uses it anymore.
+    Leases of dead processes are removed by collect().
+
+    Use it with GeoElevationData(..., tile_store=store) or
+    srtm.get_data(tile_store=store).
+    """
+
+    def __init__(self, name: str='srtm', create: bool=False, capacity: int=1024, lease_capacity: int=4096) -> None:
+        self.name = name
+        self.owner = create
+        self.pid = mod_os.getpid()
+        self.lock = _FileLock(mod_path.join(mod_tempfile.gettempdir(), f'{name}.lock'))
+
+        # Segments attached by this process:
+        self.segments: Dict[str, mod_shared_memory.SharedMemory] = {}
+        # Number of leases this process holds, per file:
+        self.leases: Dict[str, int] = {}
+
+        if create:
+            size = HEADER.size + capacity * ENTRY.size + lease_capacity * LEASE.size
+            self.index = _attach(name, create=True, size=size)
+            self.buf[:size] = bytes(size)
+            HEADER.pack_into(self.buf, 0, MAGIC, VERSION, capacity, lease_capacity)
+        else:
+            self.index = _attach(name)
+            magic, version, capacity, lease_capacity = HEADER.unpack_from(self.buf, 0)
+            if magic != MAGIC or version != VERSION:
+                raise Exception(f'Invalid tile store {name}')
+
+        self.capacity = capacity
+        self.lease_capacity = lease_capacity
+
+    @property
+    def buf(self) -> memoryview:
+        buf = self.index.buf
+        assert buf is not None, f'Tile store {self.name} is closed'
+        return buf
+
+    def _check_fork(self) -> None:
+        """ Leases are per process, a forked child starts without any (and is not the owner). """
+        pid = mod_os.getpid()
+        if pid != self.pid:
+            self.pid = pid
+            self.owner = False
+            self.leases = {}
+
+    def _entry_offset(self, n: int) -> int:
+        return HEADER.size + n * ENTRY.size
+
+    def _lease_offset(self, n: int) -> int:
+        return HEADER.size + self.capacity * ENTRY.size + n * LEASE.size
+
+    def _segment_name(self, file_name: str) -> str:
+        return '{0}-{1}'.format(self.name, file_name.replace('.hgt', ''))
+
+    def _find_entry(self, file_name: str) -> Tuple[int, int, int]:
+        """ Returns (entry_no, size, state), entry_no is -1 if not found. """
+        key = file_name.encode()
+        for n in range(self.capacity):
+            name, size, state = ENTRY.unpack_from(self.buf, self._entry_offset(n))
+            if state != ENTRY_EMPTY and name.rstrip(b'\0') == key:
+                return n, size, state
+        return -1, 0, ENTRY_EMPTY
+
+    def _add_lease(self, entry_no: int, delta: int) -> None:
+        free = -1
+        for n in range(self.lease_capacity):
+            pid, lease_entry_no, count = LEASE.unpack_from(self.buf, self._lease_offset(n))
+            if count > 0 and pid == self.pid and lease_entry_no == entry_no:
+                LEASE.pack_into(self.buf, self._lease_offset(n), pid, entry_no, max(0, count + delta))
+                return
+            if count <= 0 and free < 0:
+                free = n
+        if delta <= 0:
+            return
+        if free < 0:
+            raise Exception(f'No free lease slots in tile store {self.name}')
+        LEASE.pack_into(self.buf, self._lease_offset(free), self.pid, entry_no, delta)
+
+    def _references(self) -> Dict[int, int]:
+        """ Number of leases per entry. """
+        result: Dict[int, int] = {}
+        for n in range(self.lease_capacity):
+            pid, entry_no, count = LEASE.unpack_from(self.buf, self._lease_offset(n))
+            if count > 0:
+                result[entry_no] = result.get(entry_no, 0) + count
+        return result
+
+    def _view(self, file_name: str, size: int) -> memoryview:
+        segment = self.segments.get(file_name)
+        if segment is None:
+            segment = _attach(self._segment_name(file_name))
+            self.segments[file_name] = segment
+        assert segment.buf is not None
+        return segment.buf[:size]
+
+    def get(self, file_name: str) -> Optional[memoryview]:
+        """
+        Returns the (read only) file contents and leases the file to this
+        process, or None if the file is not in the store.
+        """
+        self._check_fork()
+        with self.lock:
+            entry_no, size, state = self._find_entry(file_name)
+            if state != ENTRY_LIVE:
+                return None
+            self._add_lease(entry_no, 1)
+        self.leases[file_name] = self.leases.get(file_name, 0) + 1
+        return self._view(file_name, size).toreadonly()
+
+    def put(self, file_name: str, data: Union[bytes, memoryview]) -> memoryview:
+        """
+        Adds the file to the store (if not already there) and leases it to
+        this process. Returns the shared (read only) file contents.
+        """
+        self._check_fork()
+        if len(file_name.encode()) > NAME_SIZE:
+            raise Exception(f'File name {file_name} too long for tile store {self.name}')
+        with self.lock:
+            entry_no, size, state = self._find_entry(file_name)
+            if state != ENTRY_LIVE:
+                entry_no = -1
+                for n in range(self.capacity):
+                    if ENTRY.unpack_from(self.buf, self._entry_offset(n))[2] == ENTRY_EMPTY:
+                        entry_no = n
+                        break
+                if entry_no < 0:
+                    raise Exception(f'Tile store {self.name} is full ({self.capacity} files)')
+                size = len(data)
+                segment = _attach(self._segment_name(file_name), create=True, size=size)
+                assert segment.buf is not None
+                segment.buf[:size] = data
+                self.segments[file_name] = segment
+                ENTRY.pack_into(self.buf, self._entry_offset(entry_no), file_name.encode(), size, ENTRY_LIVE)
+                mod_logging.debug(f'Stored {file_name} ({size} bytes) in shared memory')
+            self._add_lease(entry_no, 1)
+        self.leases[file_name] = self.leases.get(file_name, 0) + 1
+        return self._view(file_name, size).toreadonly()
+
+    def release(self, file_name: str) -> None:
+        """ Releases one lease of this process on the file. """
+        self._check_fork()
+        if not self.leases.get(file_name):
+            return
+        with self.lock:
+            entry_no, _, state = self._find_entry(file_name)
+            if entry_no >= 0:
+                self._add_lease(entry_no, -1)
+        self.leases[file_name] -= 1
+        if not self.leases[file_name]:
+            del self.leases[file_name]
+
+    def evict(self, file_name: str) -> None:
+        """
+        Removes the file from the store. The memory is freed when the last
+        process using it releases it (or dies and collect() is called).
+        """
+        with self.lock:
+            entry_no, size, state = self._find_entry(file_name)
+            if state == ENTRY_LIVE:
+                ENTRY.pack_into(self.buf, self._entry_offset(entry_no), file_name.encode(), size, ENTRY_EVICTED)
+        self.collect()
+
+    def collect(self) -> int:
+        """
+        Removes leases of dead processes and unlinks evicted files not used
+        anymore. Returns the number of removed leases.
+        """
+        removed = 0
+        with self.lock:
+            for n in range(self.lease_capacity):
+                pid, entry_no, count = LEASE.unpack_from(self.buf, self._lease_offset(n))
+                if count > 0 and not _is_alive(pid):
+                    mod_logging.info(f'Removing {count} leases of dead process {pid}')
+                    LEASE.pack_into(self.buf, self._lease_offset(n), 0, 0, 0)
+                    removed += count
+            references = self._references()
+            for n in range(self.capacity):
+                name, size, state = ENTRY.unpack_from(self.buf, self._entry_offset(n))
+                if state == ENTRY_EVICTED and not references.get(n):
+                    self._unlink(name.rstrip(b'\0').decode())
+                    ENTRY.pack_into(self.buf, self._entry_offset(n), b'', 0, ENTRY_EMPTY)
+        return removed
+
+    def references(self, file_name: str) -> int:
+        """ Number of leases (by all processes) on the file. """
+        with self.lock:
+            entry_no, _, _ = self._find_entry(file_name)
+            return self._references().get(entry_no, 0) if entry_no >= 0 else 0
+
+    def file_names(self) -> List[str]:
+        result = []
+        with self.lock:
+            for n in range(self.capacity):
+                name, _, state = ENTRY.unpack_from(self.buf, self._entry_offset(n))
+                if state == ENTRY_LIVE:
+                    result.append(name.rstrip(b'\0').decode())
+        return result
+
+    def _unlink(self, file_name: str) -> None:
+        segment = self.segments.pop(file_name, None)
+        try:
+            if segment is None:
+                segment = _attach(self._segment_name(file_name))
+            _unlink(segment)
+            segment.close()
+        except FileNotFoundError:
+            pass
+        except BufferError:
+            # Still referenced from this process, the memory will be freed when
+            # the last view is garbage collected
+            pass
+
+    def close(self) -> None:
+        """
+        Releases all the leases of this process. If this is the owner of the
+        store, all files and the index are unlinked.
+
+        Note that GeoElevationFile instances using the store must not be used
+        after this.
+        """
+        self._check_fork()
+        with self.lock:
+            for file_name, count in self.leases.items():
+                entry_no, _, _ = self._find_entry(file_name)
+                if entry_no >= 0:
+                    self._add_lease(entry_no, -count)
+            self.leases = {}
+            if self.owner:
+                for n in range(self.capacity):
+                    name, _, state = ENTRY.unpack_from(self.buf, self._entry_offset(n))
+                    if state != ENTRY_EMPTY:
+                        self._unlink(name.rstrip(b'\0').decode())
+        for segment in self.segments.values():
+            try:
+                segment.close()
+            except BufferError:
+                pass
+        self.segments = {}
+        if self.owner:
+            _unlink(self.index)
+        try:
+            self.index.close()
+        except BufferError:
+            pass
+
+    def __enter__(self) -> "SharedTileStore":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2013 Tomo Krajina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+File handler storing all SRTM files in a single SQLite database.
+"""
+
+import logging   as mod_logging
+import os        as mod_os
+import os.path   as mod_path
+import sqlite3   as mod_sqlite3
+import threading as mod_threading
+import zlib      as mod_zlib
+
+from . import utils as mod_utils
+
+from typing import *
+
+DEFAULT_BLOCK_SIZE = 2 ** 16
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    name TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    block_size INTEGER NOT NULL,
+    compressed INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS blocks (
+    name TEXT NOT NULL,
+    block INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (name, block)
+);
+"""
+
+class SqliteFileHandler(mod_utils.FileHandler):
+    """
+    Stores files as blobs in a single SQLite database, which is much faster
+    than many small files on network file systems.
+
+    Every file is split into blocks of block_size bytes. If compress is True,
+    every block is compressed with zlib separately, so reading a part of a
+    file decompresses only the blocks needed. Uncompressed blocks are read
+    incrementally (only the requested bytes).
+
+    The database is opened in WAL mode, so any number of threads and
+    processes can read while one writes. Every thread uses its own connection.
+    """
+
+    def __init__(self, database_file_name: str="", block_size: int=DEFAULT_BLOCK_SIZE, compress: bool=False, timeout: float=60) -> None:
+        if database_file_name:
+            self.database_file_name = database_file_name
+        else:
+            self.database_file_name = mod_os.path.join(mod_utils.FileHandler().local_cache_dir, 'srtm.sqlite')
+        self.local_cache_dir = mod_path.dirname(mod_path.abspath(self.database_file_name))
+        mod_os.makedirs(self.local_cache_dir, exist_ok=True)
+        self.block_size = block_size
+        self.compress = compress
+        self.timeout = timeout
+        self.local = mod_threading.local()
+
+        connection = self.connection()
+        with connection:
+            connection.executescript(SCHEMA)
+
+    def connection(self) -> mod_sqlite3.Connection:
+        connection: Optional[mod_sqlite3.Connection] = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = mod_sqlite3.connect(self.database_file_name, timeout=self.timeout)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+        return connection
+
+    def close(self) -> None:
+        """ Closes the connection of the current thread. """
+        connection: Optional[mod_sqlite3.Connection] = getattr(self.local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self.local.connection = None
+
+    def _file_info(self, file_name: str) -> Optional[Tuple[int, int, int]]:
+        """ Returns (size, block_size, compressed) or None. """
+        row = self.connection().execute('SELECT size, block_size, compressed FROM files WHERE name = ?', (file_name, )).fetchone()
+        return None if row is None else (row[0], row[1], row[2])
+
+    def exists(self, file_name: str) -> bool:
+        return self._file_info(file_name) is not None
+
+    def _write(self, connection: mod_sqlite3.Connection, file_name: str, contents: bytes) -> None:
+        connection.execute('DELETE FROM blocks WHERE name = ?', (file_name, ))
+        connection.execute('INSERT OR REPLACE INTO files (name, size, block_size, compressed) VALUES (?, ?, ?, ?)',
+                           (file_name, len(contents), self.block_size, int(self.compress)))
+        blocks = []
+        for block_no, start in enumerate(range(0, len(contents), self.block_size)):
+            block = contents[start : start + self.block_size]
+            blocks.append((file_name, block_no, mod_zlib.compress(block) if self.compress else block))
+        connection.executemany('INSERT INTO blocks (name, block, data) VALUES (?, ?, ?)', blocks)
+
+    def write(self, file_name: str, contents: bytes) -> None:
+        connection = self.connection()
+        with connection:
+            self._write(connection, file_name, contents)
+        mod_logging.debug(f"saved {len(contents)} bytes in {self.database_file_name}:{file_name}")
+
+    def read(self, file_name: str) -> bytes:
+        info = self._file_info(file_name)
+        if info is None:
+            raise FileNotFoundError(f'{file_name} not found in {self.database_file_name}')
+        return self.read_range(file_name, 0, info[0])
+
+    def _read_block(self, file_name: str, block_no: int, compressed: int, offset: int, length: int) -> bytes:
+        connection = self.connection()
+        if compressed:
+            row = connection.execute('SELECT data FROM blocks WHERE name = ? AND block = ?', (file_name, block_no)).fetchone()
+            return mod_zlib.decompress(row[0])[offset : offset + length]
+        if hasattr(connection, 'blobopen'):
+            row = connection.execute('SELECT rowid FROM blocks WHERE name = ? AND block = ?', (file_name, block_no)).fetchone()
+            with connection.blobopen('blocks', 'data', row[0], readonly=True) as blob:
+                blob.seek(offset)
+                result: bytes = blob.read(length)
+                return result
+        row = connection.execute('SELECT substr(data, ?, ?) FROM blocks WHERE name = ? AND block = ?',
+                                 (offset + 1, length, file_name, block_no)).fetchone()
+        return bytes(row[0])
+
+    def read_range(self, file_name: str, offset: int, length: int) -> bytes:
+        info = self._file_info(file_name)
+        if info is None:
+            raise FileNotFoundError(f'{file_name} not found in {self.database_file_name}')
+        size, block_size, compressed = info
+        end = min(size, offset + length)
+        result = []
+        position = offset
+        while position < end:
+            block_no, block_offset = divmod(position, block_size)
+            part = self._read_block(file_name, block_no, compressed, block_offset, min(end - position, block_size - block_offset))
+            result.append(part)
+            position += len(part)
+        return b''.join(result)
+
+    def remove(self, file_name: str) -> None:
+        connection = self.connection()
+        with connection:
+            connection.execute('DELETE FROM blocks WHERE name = ?', (file_name, ))
+            connection.execute('DELETE FROM files WHERE name = ?', (file_name, ))
+
+    def list_files(self) -> List[str]:
+        return [row[0] for row in self.connection().execute('SELECT name FROM files ORDER BY name')]
+
+    def import_directory(self, directory: str="") -> int:
+        """
+        Imports all files from a directory (by default the standard local
+        cache directory, ~/.cache/srtm) in a single transaction. Returns the
+        number of imported files.
+        """
+        if not directory:
+            directory = mod_utils.FileHandler().local_cache_dir
+        # Skip the database itself (and its -wal and -shm files) if in the same directory:
+        database_prefix = mod_path.basename(self.database_file_name)
+        file_names = [fn for fn in sorted(mod_os.listdir(directory))
+                      if mod_path.isfile(mod_path.join(directory, fn)) and not fn.startswith(database_prefix)]
+        connection = self.connection()
+        with connection:
+            for file_name in file_names:
+                with open(mod_path.join(directory, file_name), 'rb') as f:
+                    self._write(connection, file_name, f.read())
+        mod_logging.info(f'Imported {len(file_names)} files from {directory} in {self.database_file_name}')
+        return len(file_names)
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2013 Tomo Krajina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Per file summaries (min, max, mean, number of voids and a quadtree of block
+min/max values), stored next to the SRTM files. Queries like the maximum
+elevation in an area use them to skip whole files or blocks.
+"""
+
+import logging as mod_logging
+import math    as mod_math
+import struct  as mod_struct
+
+from . import data as mod_data
+
+from typing import *
+
+EXTENSION = '.summary'
+
+MAGIC = b'SRTS'
+VERSION = 1
+
+DEFAULT_BLOCK_SIZE = 64
+
+HEADER = mod_struct.Struct('>4sBHHhhdI')
+
+# Block min/max of blocks without any valid point:
+NO_MIN = 32767
+NO_MAX = -32768
+
+class TileSummary:
+    """
+    Summary of a single SRTM file.
+
+    levels[0] contains numpy arrays (mins, maxs, voids) for blocks of
+    block_size x block_size points, every next level has blocks 2x2 bigger,
+    the last level is a single block with the whole file.
+    """
+
+    def __init__(self, square_side: int, block_size: int, min: int, max: int, mean: float, void_count: int,
+                 mins: Any, maxs: Any, voids: Any) -> None:
+        import numpy as np # type: ignore
+
+        self.square_side = square_side
+        self.block_size = block_size
+        self.min = min
+        self.max = max
+        self.mean = mean
+        self.void_count = void_count
+
+        self.levels = [(mins, maxs, voids)]
+        while mins.shape[0] > 1:
+            # Pad to an even number of blocks and merge 2x2 blocks:
+            n = mins.shape[0] + mins.shape[0] % 2
+            mins = np.pad(mins, ((0, n - mins.shape[0]), (0, n - mins.shape[1])), constant_values=NO_MIN)
+            maxs = np.pad(maxs, ((0, n - maxs.shape[0]), (0, n - maxs.shape[1])), constant_values=NO_MAX)
+            voids = np.pad(voids, ((0, n - voids.shape[0]), (0, n - voids.shape[1])), constant_values=0)
+            mins = mins.reshape(n // 2, 2, n // 2, 2).min(axis=(1, 3))
+            maxs = maxs.reshape(n // 2, 2, n // 2, 2).max(axis=(1, 3))
+            voids = voids.reshape(n // 2, 2, n // 2, 2).sum(axis=(1, 3))
+            self.levels.append((mins, maxs, voids))
+
+    @property
+    def dataset(self) -> str:
+        """ SRTM1 or SRTM3. """
+        return mod_data.SRTM1 if self.square_side == mod_data.DATASET_SQUARE_SIDES[mod_data.SRTM1] else mod_data.SRTM3
+
+    @classmethod
+    def from_file(cls, geo_file: mod_data.GeoElevationFile, block_size: int=DEFAULT_BLOCK_SIZE) -> "TileSummary":
+        import numpy as np
+
+        side = geo_file.square_side
+        values = geo_file.get_values_array()
+        invalid = (values > 10000) | (values < -1000)
+
+        blocks = (side + block_size - 1) // block_size
+        padded = blocks * block_size
+        valid_values = np.pad(values, ((0, padded - side), (0, padded - side)))
+        padded_invalid = np.pad(invalid, ((0, padded - side), (0, padded - side)), constant_values=False)
+        padding = np.ones((padded, padded), dtype=bool)
+        padding[:side, :side] = False
+
+        ignored = padded_invalid | padding
+        mins = np.where(ignored, NO_MIN, valid_values).reshape(blocks, block_size, blocks, block_size).min(axis=(1, 3)).astype(np.int16)
+        maxs = np.where(ignored, NO_MAX, valid_values).reshape(blocks, block_size, blocks, block_size).max(axis=(1, 3)).astype(np.int16)
+        voids = padded_invalid.reshape(blocks, block_size, blocks, block_size).sum(axis=(1, 3)).astype(np.uint32)
+
+        valid = values[~invalid]
+        return cls(side, block_size,
+                   int(valid.min()) if valid.size else NO_MIN,
+                   int(valid.max()) if valid.size else NO_MAX,
+                   float(valid.mean()) if valid.size else 0.,
+                   int(invalid.sum()), mins, maxs, voids)
+
+    def to_bytes(self) -> bytes:
+        mins, maxs, voids = self.levels[0]
+        header = HEADER.pack(MAGIC, VERSION, self.square_side, self.block_size, self.min, self.max, self.mean, self.void_count)
+        return b''.join([header, mins.astype('>i2').tobytes(), maxs.astype('>i2').tobytes(), voids.astype('>u4').tobytes()])
+
+    @classmethod
+    def from_bytes(cls, contents: bytes) -> "TileSummary":
+        import numpy as np
+
+        magic, version, square_side, block_size, minimum, maximum, mean, void_count = HEADER.unpack_from(contents, 0)
+        if magic != MAGIC or version != VERSION:
+            raise Exception('Invalid summary')
+        blocks = (square_side + block_size - 1) // block_size
+        n = blocks * blocks
+        mins = np.frombuffer(contents, dtype='>i2', count=n, offset=HEADER.size).astype(np.int16).reshape(blocks, blocks)
+        maxs = np.frombuffer(contents, dtype='>i2', count=n, offset=HEADER.size + 2 * n).astype(np.int16).reshape(blocks, blocks)
+        voids = np.frombuffer(contents, dtype='>u4', count=n, offset=HEADER.size + 4 * n).astype(np.uint32).reshape(blocks, blocks)
+        return cls(square_side, block_size, minimum, maximum, mean, void_count, mins, maxs, voids)
+
+def _block_window(summary: TileSummary, level: int, i: int, j: int, row_from: int, row_to: int,
+                  column_from: int, column_to: int) -> Optional[Tuple[int, int, int, int, bool]]:
+    """
+    Intersection (row_from, row_to, column_from, column_to) of the block with
+    the (inclusive) rows and columns, and True if the whole block is inside.
+    None if they don't intersect.
+    """
+    size = summary.block_size * 2 ** level
+    block_row_to = min((i + 1) * size, summary.square_side) - 1
+    block_column_to = min((j + 1) * size, summary.square_side) - 1
+    r0, r1 = max(row_from, i * size), min(row_to, block_row_to)
+    c0, c1 = max(column_from, j * size), min(column_to, block_column_to)
+    if r0 > r1 or c0 > c1:
+        return None
+    return r0, r1, c0, c1, (r0, r1, c0, c1) == (i * size, block_row_to, j * size, block_column_to)
+
+class SummaryIndex:
+    """
+    Summaries of files, loaded from (or computed and saved with) the file
+    handler of geo_elevation_data.
+
+    Summaries are of the files of a dataset (saved as, for example,
+    SRTM3_N44W072.hgt.summary), chosen as in GeoElevationData.get_file from
+    the resolution of geo_elevation_data. Points are read from the file of
+    the same dataset.
+    """
+
+    def __init__(self, geo_elevation_data: mod_data.GeoElevationData, block_size: int=DEFAULT_BLOCK_SIZE) -> None:
+        self.geo_elevation_data = geo_elevation_data
+        self.block_size = block_size
+        # By file name with the dataset (see get_dataset_file_name):
+        self.summaries: Dict[str, TileSummary] = {}
+
+    def load_all(self) -> int:
+        """ Loads summaries of all files with a saved summary, returns their number. """
+        file_handler = self.geo_elevation_data.file_handler
+        for file_name in file_handler.list_files():
+            if file_name.endswith(EXTENSION):
+                self.summaries[file_name[: -len(EXTENSION)]] = TileSummary.from_bytes(file_handler.read(file_name))
+        return len(self.summaries)
+
+    def get(self, file_name: str) -> Optional[TileSummary]:
+        """ Summary of the file (None if there is no such file). """
+        geo_elevation_data = self.geo_elevation_data
+        result = None
+        for dataset in mod_data.get_datasets(geo_elevation_data.resolution):
+            summary = self._get_summary(file_name, dataset)
+            if summary is None:
+                continue
+            if geo_elevation_data.resolution is None or summary.void_count <= geo_elevation_data.max_void_fraction * summary.square_side ** 2:
+                return summary
+            result = result or summary
+        return result
+
+    def _get_summary(self, file_name: str, dataset: str) -> Optional[TileSummary]:
+        key = mod_data.get_dataset_file_name(file_name, dataset)
+        summary = self.summaries.get(key)
+        if summary is not None:
+            return summary
+
+        file_handler = self.geo_elevation_data.file_handler
+        if file_handler.exists(key + EXTENSION):
+            summary = TileSummary.from_bytes(file_handler.read(key + EXTENSION))
+        else:
+            geo_file = self.geo_elevation_data.get_dataset_file(file_name, dataset)
+            if geo_file is None:
+                return None
+            summary = TileSummary.from_file(geo_file, self.block_size)
+            file_handler.write(key + EXTENSION, summary.to_bytes())
+            mod_logging.debug(f'Saved summary of {key}')
+
+        self.summaries[key] = summary
+        return summary
+
+    def _get_file(self, file_name: str, summary: TileSummary) -> mod_data.GeoElevationFile:
+        """ The file of the summary. """
+        geo_file = self.geo_elevation_data.get_dataset_file(file_name, summary.dataset)
+        assert geo_file, f'No {summary.dataset} file {file_name}'
+        return geo_file
+
+    def _windows(self, latitude_min: float, latitude_max: float, longitude_min: float, longitude_max: float) -> Iterator[Tuple[str, TileSummary, int, int, int, int]]:
+        """ Yields (file_name, summary, row_from, row_to, column_from, column_to) for all files in the interval. """
+        for latitude in range(mod_math.floor(latitude_min), mod_math.floor(latitude_max) + 1):
+            for longitude in range(mod_math.floor(longitude_min), mod_math.floor(longitude_max) + 1):
+                file_name = self.geo_elevation_data.get_file_name(latitude + .5, longitude + .5)
+                if not file_name:
+                    continue
+                summary = self.get(file_name)
+                if summary is None:
+                    continue
+                t = summary.square_side - 1
+                row_from = max(0, mod_math.ceil((latitude + 1 - latitude_max) * t - 1e-6))
+                row_to = min(t, mod_math.floor((latitude + 1 - latitude_min) * t + 1e-6))
+                column_from = max(0, mod_math.ceil((longitude_min - longitude) * t - 1e-6))
+                column_to = min(t, mod_math.floor((longitude_max - longitude) * t + 1e-6))
+                if row_from <= row_to and column_from <= column_to:
+                    yield file_name, summary, row_from, row_to, column_from, column_to
+
+    def _window_values(self, file_name: str, summary: TileSummary, row_from: int, row_to: int, column_from: int, column_to: int) -> Any:
+        """ Valid values in the (inclusive) window as a flat numpy array. """
+        import numpy as np
+
+        geo_file = self._get_file(file_name, summary)
+        values = np.concatenate([geo_file.get_row_values(row, column_from, column_to + 1) for row in range(row_from, row_to + 1)])
+        return values[(values <= 10000) & (values >= -1000)]
+
+    def _extreme(self, latitude_min: float, latitude_max: float, longitude_min: float, longitude_max: float, maximum: bool) -> Optional[int]:
+        best: Optional[int] = None
+
+        def better(value: int) -> bool:
+            return best is None or (value > best if maximum else value < best)
+
+        for file_name, summary, row_from, row_to, column_from, column_to in self._windows(latitude_min, latitude_max, longitude_min, longitude_max):
+            tile_value = summary.max if maximum else summary.min
+            if summary.void_count == summary.square_side ** 2 or not better(tile_value):
+                continue
+            # Blocks are visited from the top of the quadtree, the ones which
+            # can't be better than the current best are skipped:
+            stack = [(len(summary.levels) - 1, 0, 0)]
+            while stack:
+                level, i, j = stack.pop()
+                mins, maxs, _ = summary.levels[level]
+                block_value = int(maxs[i, j] if maximum else mins[i, j])
+                if block_value in (NO_MIN, NO_MAX) or not better(block_value):
+                    continue
+                window = _block_window(summary, level, i, j, row_from, row_to, column_from, column_to)
+                if window is None:
+                    continue
+                r0, r1, c0, c1, inside = window
+                if inside:
+                    best = block_value
+                elif level == 0:
+                    values = self._window_values(file_name, summary, r0, r1, c0, c1)
+                    if values.size:
+                        value = int(values.max() if maximum else values.min())
+                        if better(value):
+                            best = value
+                else:
+                    lower_values = summary.levels[level - 1][1 if maximum else 0]
+                    children = [(level - 1, ci, cj) for ci in (2 * i, 2 * i + 1) for cj in (2 * j, 2 * j + 1)
+                                if ci < lower_values.shape[0] and cj < lower_values.shape[1]]
+                    # The most promising child is processed first:
+                    children.sort(key=lambda child: int(lower_values[child[1], child[2]]), reverse=not maximum)
+                    stack.extend(children)
+        return best
+
+    def get_max_elevation(self, latitude_min: float, latitude_max: float, longitude_min: float, longitude_max: float) -> Optional[int]:
+        """ Maximum elevation of SRTM points in the interval (None if there are no valid points). """
+        return self._extreme(latitude_min, latitude_max, longitude_min, longitude_max, maximum=True)
+
+    def get_min_elevation(self, latitude_min: float, latitude_max: float, longitude_min: float, longitude_max: float) -> Optional[int]:
+        """ Minimum elevation of SRTM points in the interval (None if there are no valid points). """
+        return self._extreme(latitude_min, latitude_max, longitude_min, longitude_max, maximum=False)
+
+    def has_voids(self, latitude_min: float, latitude_max: float, longitude_min: float, longitude_max: float) -> bool:
+        """ True if there are points without a valid elevation in the interval (files without voids are not loaded). """
+        for file_name, summary, row_from, row_to, column_from, column_to in self._windows(latitude_min, latitude_max, longitude_min, longitude_max):
+            if not summary.void_count:
+                continue
+            stack = [(len(summary.levels) - 1, 0, 0)]
+            while stack:
+                level, i, j = stack.pop()
+                voids = summary.levels[level][2]
+                if not voids[i, j]:
+                    continue
+                window = _block_window(summary, level, i, j, row_from, row_to, column_from, column_to)
+                if window is None:
+                    continue
+                r0, r1, c0, c1, inside = window
+                if inside:
+                    return True
+                elif level == 0:
+                    geo_file = self._get_file(file_name, summary)
+                    for row in range(r0, r1 + 1):
+                        values = geo_file.get_row_values(row, c0, c1 + 1)
+                        if ((values > 10000) | (values < -1000)).any():
+                            return True
+                else:
+                    lower_voids = summary.levels[level - 1][2]
+                    stack.extend((level - 1, ci, cj) for ci in (2 * i, 2 * i + 1) for cj in (2 * j, 2 * j + 1)
+                                 if ci < lower_voids.shape[0] and cj < lower_voids.shape[1])
+        return False
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2013 Tomo Krajina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Optional tracing of the stages of loading files (checking the cache,
+reading, downloading, unzipping, decoding...). Spans are recorded only
+while a sink is set:
+
+    with srtm.tracing.tracing(srtm.tracing.RingBufferSink()) as sink:
+        elevation_data.get_elevation(45.5, 13.5)
+    print(sink.get_totals())
+
+Lookups of points in loaded files are not traced, so tracing doesn't slow
+them down (even when enabled).
+"""
+
+import collections as mod_collections
+import contextlib  as mod_contextlib
+import json        as mod_json
+import logging     as mod_logging
+import os          as mod_os
+import threading   as mod_threading
+import time        as mod_time
+
+from typing import *
+
+# Stages:
+LOAD_FILE = 'load_file'
+EXISTS = 'exists'
+READ = 'read'
+FETCH = 'fetch'
+UNZIP = 'unzip'
+WRITE = 'write'
+DECODE = 'decode'
+BLOCK = 'block'
+
+class Span(NamedTuple):
+    name: str
+    # time.perf_counter() seconds:
+    start: float
+    duration: float
+    thread: int
+    # For example file_name and bytes:
+    args: Dict[str, Any]
+
+class Totals(NamedTuple):
+    spans: int
+    seconds: float
+    bytes: int
+
+class Sink:
+    """ Receives spans (possibly from more threads). """
+
+    def record(self, span: Span) -> None:
+        raise NotImplementedError()
+
+    def close(self) -> None:
+        pass
+
+class LoggingSink(Sink):
+    def __init__(self, level: int=mod_logging.DEBUG) -> None:
+        self.level = level
+
+    def record(self, span: Span) -> None:
+        mod_logging.log(self.level, f'{span.name} {span.duration * 1000:.3f}ms {span.args}')
+
+class RingBufferSink(Sink):
+    """ Keeps the last capacity spans in memory. """
+
+    def __init__(self, capacity: int=10000) -> None:
+        self.spans: "mod_collections.deque[Span]" = mod_collections.deque(maxlen=capacity)
+
+    def record(self, span: Span) -> None:
+        self.spans.append(span)
+
+    def get_totals(self) -> Dict[str, Totals]:
+        """ Stage -> number of spans, time and bytes (of the spans kept). """
+        result: Dict[str, Totals] = {}
+        for span in list(self.spans):
+            count, seconds, byts = result.get(span.name, Totals(0, 0., 0))
+            result[span.name] = Totals(count + 1, seconds + span.duration, byts + span.args.get('bytes', 0))
+        return result
+
+class ChromeTraceSink(Sink):
+    """ Writes spans in the Chrome trace format (for chrome://tracing or Perfetto) when closed. """
+
+    def __init__(self, file_name: str) -> None:
+        self.file_name = file_name
+        self.lock = mod_threading.Lock()
+        self.events: List[Dict[str, Any]] = []
+
+    def record(self, span: Span) -> None:
+        with self.lock:
+            self.events.append({'name': span.name, 'cat': 'srtm', 'ph': 'X', 'ts': span.start * 1e6, 'dur': span.duration * 1e6,
+                                'pid': mod_os.getpid(), 'tid': span.thread, 'args': span.args})
+
+    def close(self) -> None:
+        with self.lock:
+            with open(self.file_name, 'w') as f:
+                mod_json.dump({'traceEvents': self.events}, f)
+
+# The current sink, None if tracing is disabled:
+sink: Optional[Sink] = None
+
+def set_sink(new_sink: Optional[Sink]) -> Optional[Sink]:
+    """ Enables tracing (disables it if new_sink is None), returns the previous sink. """
+    global sink
+    previous, sink = sink, new_sink
+    return previous
+
+@mod_contextlib.contextmanager
+def tracing(new_sink: Sink) -> Iterator[Sink]:
+    """ Traces with new_sink in the block, and closes it at the end. """
+    previous = set_sink(new_sink)
+    try:
+        yield new_sink
+    finally:
+        set_sink(previous)
+        new_sink.close()
+
+class _Span:
+    __slots__ = ('sink', 'name', 'args', 'start')
+
+    def __init__(self, sink: Sink, name: str, args: Dict[str, Any]) -> None:
+        self.sink = sink
+        self.name = name
+        self.args = args
+        self.start = 0.
+
+    def __enter__(self) -> "_Span":
+        self.start = mod_time.perf_counter()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.sink.record(Span(self.name, self.start, mod_time.perf_counter() - self.start, mod_threading.get_ident(), self.args))
+
+    def set(self, **args: Any) -> None:
+        """ Adds args (for example bytes, when known). """
+        self.args.update(args)
+
+class _NoSpan:
+    def __enter__(self) -> "_NoSpan":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        pass
+
+    def set(self, **args: Any) -> None:
+        pass
+
+_NO_SPAN = _NoSpan()
+
+def span(name: str, **args: Any) -> Union[_Span, _NoSpan]:
+    """
+    Context manager measuring a stage:
+
+        with span(READ, file_name=file_name) as s:
+            data = ...
+            s.set(bytes=len(data))
+    """
+    if sink is None:
+        return _NO_SPAN
+    return _Span(sink, name, args)
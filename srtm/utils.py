@@ -16,9 +16,8 @@
 
 import logging    as mod_logging
 import math       as mod_math
-import zipfile    as mod_zipfile
-import pathlib    as mod_pathlib
 import os         as mod_os
+import threading  as mod_threading
 import os.path    as mod_path
 
 from io import BytesIO as cStringIO # looks hacky but we are working with bytes
@@ -55,7 +54,65 @@ def get_color_between(color1: Color, color2: Color, i: float) -> Color:
             int(color1[2] + (color2[2] - color1[2]) * i),
             int(color1[3] + (color2[3] - color1[3]) * i))
 
+# Space filling curves for ordering points (see get_locality_order):
+HILBERT = 'hilbert'
+Z_ORDER = 'z-order'
+
+def hilbert_index(x: int, y: int, bits: int) -> int:
+    """ Position of the cell (x, y) on the Hilbert curve over a 2**bits x 2**bits grid. """
+    mask = (1 << bits) - 1
+    d = 0
+    s = 1 << (bits - 1)
+    while s > 0:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        d += s * s * ((3 * rx) ^ ry)
+        if ry == 0:
+            if rx == 1:
+                x, y = x ^ mask, y ^ mask
+            x, y = y, x
+        s >>= 1
+    return d
+
+def z_order_index(x: int, y: int, bits: int) -> int:
+    """ Position of the cell (x, y) on the Z-order (Morton) curve over a 2**bits x 2**bits grid. """
+    d = 0
+    for bit in range(bits):
+        d |= ((x >> bit) & 1) << (2 * bit) | ((y >> bit) & 1) << (2 * bit + 1)
+    return d
+
+def get_locality_order(points: Sequence[Tuple[float, float]], curve: str=HILBERT, cells_per_degree: int=16) -> List[int]:
+    """
+    Indexes of the (latitude, longitude) points sorted along a space filling
+    curve (HILBERT or Z_ORDER) over a grid of cells_per_degree x
+    cells_per_degree cells per degree. When cells_per_degree is a power of two,
+    the points of every SRTM file (and every cell in it) are consecutive.
+    """
+    if curve == HILBERT:
+        index = hilbert_index
+    elif curve == Z_ORDER:
+        index = z_order_index
+    else:
+        raise Exception(f'Invalid curve {curve}')
+
+    # Cells are counted from (-90, -180), the grid is a square with a side
+    # which is the smallest power of two with all the cells:
+    bits = (360 * cells_per_degree - 1).bit_length()
+    # Many points are usually in the same cell:
+    cell_keys: Dict[Tuple[int, int], int] = {}
+    keys = []
+    for latitude, longitude in points:
+        x = min(max(int(mod_math.floor((longitude + 180.) * cells_per_degree)), 0), 360 * cells_per_degree - 1)
+        y = min(max(int(mod_math.floor((latitude + 90.) * cells_per_degree)), 0), 180 * cells_per_degree - 1)
+        key = cell_keys.get((x, y))
+        if key is None:
+            key = cell_keys[(x, y)] = index(x, y, bits)
+        keys.append(key)
+    return sorted(range(len(keys)), key=keys.__getitem__)
+
 def zip(contents: bytes, file_name: str) -> bytes:
+    import zipfile as mod_zipfile
+
     mod_logging.debug('Zipping %s bytes' % len(contents))
     result = cStringIO()
     zip_file = mod_zipfile.ZipFile(result, 'w', mod_zipfile.ZIP_DEFLATED, False)
@@ -66,6 +123,8 @@ def zip(contents: bytes, file_name: str) -> bytes:
     return result.read()
 
 def unzip(contents: bytes) -> bytes:
+    import zipfile as mod_zipfile
+
     mod_logging.debug('Unzipping %s bytes' % len(contents))
     zip_file = mod_zipfile.ZipFile(cStringIO(contents))
     zip_info_list = zip_file.infolist()
@@ -86,15 +145,18 @@ class FileHandler:
         if local_cache_dir:
             self.local_cache_dir = local_cache_dir
         else:
+            import pathlib as mod_pathlib
             home_dir = str(mod_pathlib.Path.home()) or mod_os.environ.get("HOME") or mod_os.environ.get("HOMEPATH") or ""
             if not home_dir:
                 raise Exception('No default HOME directory found')
             self.local_cache_dir = mod_os.sep.join([home_dir, '.cache', 'srtm'])
+        # The directory is created before the first write
 
+    def _create_local_cache_dir(self) -> None:
         if not mod_path.exists(self.local_cache_dir):
             print(f"Creating {self.local_cache_dir}")
             try:
-                mod_os.makedirs(self.local_cache_dir)
+                mod_os.makedirs(self.local_cache_dir, exist_ok=True)
             except Exception as e:
                 print(f"Local cache dir: {self.local_cache_dir}")
                 raise Exception(f"Error creating directory {self.local_cache_dir}: {e}")
@@ -104,11 +166,30 @@ class FileHandler:
 
     def write(self, file_name: str, contents: bytes) -> None:
         print(4, len(contents))
+        self._create_local_cache_dir()
         fn = mod_os.path.join(self.local_cache_dir, file_name)
-        with open(fn, 'wb') as f:
+        # Written in a temporary file first, so that readers never see a partial file:
+        temp_fn = f'{fn}.{mod_os.getpid()}.{mod_threading.get_ident()}.tmp'
+        with open(temp_fn, 'wb') as f:
             n = f.write(contents)
-            mod_logging.debug(f"saved {n} bytes in {fn}")
+        mod_os.replace(temp_fn, fn)
+        mod_logging.debug(f"saved {n} bytes in {fn}")
 
     def read(self, file_name: str) -> bytes:
         with open(mod_os.path.join(self.local_cache_dir, file_name), 'rb') as f:
-            return f.read()
\ No newline at end of file
+            return f.read()
+
+    def read_range(self, file_name: str, offset: int, length: int) -> bytes:
+        """ Reads only length bytes starting at offset. """
+        with open(mod_os.path.join(self.local_cache_dir, file_name), 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def remove(self, file_name: str) -> None:
+        mod_os.remove(mod_os.path.join(self.local_cache_dir, file_name))
+
+    def list_files(self) -> List[str]:
+        if not mod_path.exists(self.local_cache_dir):
+            return []
+        return sorted(fn for fn in mod_os.listdir(self.local_cache_dir)
+                      if mod_path.isfile(mod_os.path.join(self.local_cache_dir, fn)))
\ No newline at end of file
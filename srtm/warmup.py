@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2013 Tomo Krajina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Downloads all the files needed for an area, a route or a list of points in
+advance, so that no file is downloaded while processing them.
+"""
+
+import concurrent.futures as mod_futures
+import logging            as mod_logging
+import math               as mod_math
+import threading          as mod_threading
+import time               as mod_time
+
+from . import data  as mod_data
+from . import utils as mod_utils
+from . import zonal as mod_zonal
+
+from typing import *
+
+DEFAULT_WORKERS = 4
+
+class WarmUpProgress(NamedTuple):
+    file_name: str
+    # Number of processed and all files:
+    done: int
+    total: int
+    # Size of the (unzipped) files downloaded so far:
+    downloaded_bytes: int
+    seconds: float
+
+class WarmUpResult(NamedTuple):
+    downloaded: List[str]
+    # Already stored files:
+    stored: List[str]
+    # Files which couldn't be downloaded (file name -> error):
+    failed: Dict[str, str]
+    downloaded_bytes: int
+    seconds: float
+
+def _get_existing_file_names(geo_elevation_data: mod_data.GeoElevationData, positions: Iterable[Tuple[int, int]]) -> List[str]:
+    """ Names of the existing files with lower left corners in positions. """
+    file_names = set()
+    for latitude, longitude in positions:
+        file_name = geo_elevation_data.get_file_name(latitude + .5, longitude + .5)
+        if file_name:
+            file_names.add(file_name)
+    return sorted(file_names)
+
+def get_interval_file_names(geo_elevation_data: mod_data.GeoElevationData, latitude_min: float, latitude_max: float,
+                            longitude_min: float, longitude_max: float) -> List[str]:
+    """ Files with points in the interval. """
+    return _get_existing_file_names(geo_elevation_data, ((latitude, longitude)
+                                    for latitude in range(mod_math.floor(latitude_min), mod_math.floor(latitude_max) + 1)
+                                    for longitude in range(mod_math.floor(longitude_min), mod_math.floor(longitude_max) + 1)))
+
+def get_points_file_names(geo_elevation_data: mod_data.GeoElevationData, points: Iterable[Tuple[float, float]]) -> List[str]:
+    """ Files needed for the elevations of the (latitude, longitude) points. """
+    return _get_existing_file_names(geo_elevation_data, ((mod_math.floor(latitude), mod_math.floor(longitude)) for latitude, longitude in points))
+
+def get_gpx_file_names(geo_elevation_data: mod_data.GeoElevationData, gpx: Any) -> List[str]:
+    """ Files needed for GeoElevationData.add_elevations of the gpx (a gpxpy GPX object). """
+    return get_points_file_names(geo_elevation_data, ((point.latitude, point.longitude) for point in gpx.walk(only_points=True)))
+
+def get_polygon_file_names(geo_elevation_data: mod_data.GeoElevationData, polygon: mod_zonal.Polygon) -> List[str]:
+    """ Files intersecting the polygon (see srtm.zonal). """
+    points = [point for ring in polygon for point in ring]
+    if not points:
+        return []
+    positions = []
+    for latitude in range(mod_math.floor(min(p[0] for p in points)), mod_math.floor(max(p[0] for p in points)) + 1):
+        for longitude in range(mod_math.floor(min(p[1] for p in points)), mod_math.floor(max(p[1] for p in points)) + 1):
+            if _intersects(polygon, latitude, longitude):
+                positions.append((latitude, longitude))
+    return _get_existing_file_names(geo_elevation_data, positions)
+
+def _intersects(polygon: mod_zonal.Polygon, latitude: int, longitude: int) -> bool:
+    """ True if the polygon intersects the 1x1 degree square with the lower left corner (latitude, longitude). """
+    # An edge crosses (or is inside) the square:
+    for ring in polygon:
+        for n in range(len(ring)):
+            if _segment_intersects_square(ring[n - 1], ring[n], latitude, longitude):
+                return True
+    # Or the square is inside the polygon (then the center is inside):
+    center_latitude, center_longitude = latitude + .5, longitude + .5
+    inside = False
+    for ring in polygon:
+        for n in range(len(ring)):
+            (lat1, lon1), (lat2, lon2) = ring[n - 1], ring[n]
+            if (lat1 > center_latitude) != (lat2 > center_latitude):
+                if center_longitude < lon1 + (center_latitude - lat1) * (lon2 - lon1) / (lat2 - lat1):
+                    inside = not inside
+    return inside
+
+def _segment_intersects_square(point_1: Tuple[float, float], point_2: Tuple[float, float], latitude: int, longitude: int) -> bool:
+    """ Liang-Barsky clipping of the segment with the square. """
+    t_min, t_max = 0., 1.
+    for start, delta, low, high in ((point_1[0], point_2[0] - point_1[0], latitude, latitude + 1),
+                                    (point_1[1], point_2[1] - point_1[1], longitude, longitude + 1)):
+        if delta == 0:
+            if not low <= start <= high:
+                return False
+            continue
+        t1, t2 = (low - start) / delta, (high - start) / delta
+        t_min, t_max = max(t_min, min(t1, t2)), min(t_max, max(t1, t2))
+        if t_min > t_max:
+            return False
+    return True
+
+def warm_up(geo_elevation_data: mod_data.GeoElevationData, file_names: Iterable[str], workers: int=DEFAULT_WORKERS,
+            convert: bool=False, progress: Optional[Callable[[WarmUpProgress], None]]=None,
+            resolution: Optional[float]=None) -> WarmUpResult:
+    """
+    Downloads (at most workers at a time) all the files which are not yet
+    stored by the file handler. Every downloaded file is checked before it is
+    saved.
+
+    Files are saved in the format of geo_elevation_data (leave_zipped,
+    chunked). If convert is True they are saved (and already stored .hgt.zip
+    files are converted) as .hgt, which is the fastest to load.
+
+    With a resolution (by default the resolution of geo_elevation_data) the
+    files of the datasets GeoElevationData.get_file would use are
+    downloaded, and saved with the dataset in the name (for example
+    SRTM3_N44W072.hgt, see get_dataset_file_name). Results are reported
+    under those names.
+
+    progress is called after every file.
+    """
+    file_names = sorted(set(file_names))
+    if resolution is None:
+        resolution = geo_elevation_data.resolution
+    datasets: List[Optional[str]] = [None] if resolution is None else list(mod_data.get_datasets(resolution))
+    start = mod_time.time()
+    lock = mod_threading.Lock()
+    downloaded: List[str] = []
+    stored: List[str] = []
+    failed: Dict[str, str] = {}
+    downloaded_bytes = 0
+    done = 0
+
+    def process_dataset(file_name: str, dataset: Optional[str]) -> Optional[mod_data.TileData]:
+        """
+        Returns the file contents, None if there is no such file (or it
+        failed, or it is stored and the dataset is not given).
+        """
+        nonlocal downloaded_bytes
+        data_file_name = mod_data.get_dataset_file_name(file_name, dataset)
+        size = 0
+        data: Optional[mod_data.TileData] = None
+        try:
+            # A file stored without the dataset in the name is used if it is of the dataset:
+            if dataset:
+                data = geo_elevation_data.load_stored_file_data(file_name, dataset)
+                if data is None and geo_elevation_data.get_file_url(file_name, dataset) is None:
+                    return None
+            if data is not None or (not dataset and geo_elevation_data.is_file_stored(file_name)):
+                if convert:
+                    _unzip_stored_file(geo_elevation_data, data_file_name if geo_elevation_data.is_file_stored(data_file_name) else file_name)
+                result = stored
+            else:
+                data = geo_elevation_data.retrieve_file_data(file_name, leave_zipped=False if convert else None,
+                                                             chunked=False if convert else None, dataset=dataset)
+                if data is None:
+                    raise Exception(f'No url for {data_file_name}')
+                size = len(data)
+                result = downloaded
+        except Exception as e:
+            mod_logging.exception(f'Error retrieving {data_file_name}')
+            with lock:
+                failed[data_file_name] = str(e)
+            return None
+        with lock:
+            result.append(data_file_name)
+            downloaded_bytes += size
+        return data
+
+    def process(file_name: str) -> None:
+        nonlocal done
+        # As in GeoElevationData.get_file, the next dataset is used if the file has too many voids:
+        for n, dataset in enumerate(datasets):
+            data = process_dataset(file_name, dataset)
+            if data is not None and n < len(datasets) - 1 and \
+                    mod_data.GeoElevationFile(file_name, data, geo_elevation_data).get_void_fraction() <= geo_elevation_data.max_void_fraction:
+                break
+        with lock:
+            done += 1
+            report = WarmUpProgress(file_name, done, len(file_names), downloaded_bytes, mod_time.time() - start)
+        mod_logging.info(f'{report.done}/{report.total} {file_name}')
+        if progress:
+            progress(report)
+
+    with mod_futures.ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for future in [executor.submit(process, file_name) for file_name in file_names]:
+            future.result()
+
+    return WarmUpResult(sorted(downloaded), sorted(stored), failed, downloaded_bytes, mod_time.time() - start)
+
+def _unzip_stored_file(geo_elevation_data: mod_data.GeoElevationData, file_name: str) -> None:
+    file_handler = geo_elevation_data.file_handler
+    if file_handler.exists(file_name) or not file_handler.exists(file_name + '.zip'):
+        return
+    data = mod_utils.unzip(file_handler.read(file_name + '.zip'))
+    mod_data.check_file_data(file_name, data)
+    file_handler.write(file_name, data)
+    file_handler.remove(file_name + '.zip')
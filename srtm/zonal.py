@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2013 Tomo Krajina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Elevation statistics of all SRTM points inside polygons.
+"""
+
+import math as mod_math
+
+from . import data as mod_data
+
+from typing import *
+
+# A ring is a list of (latitude, longitude) points, a polygon is a list of
+# rings (points inside an odd number of rings are inside the polygon, so the
+# rings after the first one can be holes):
+Ring = Sequence[Tuple[float, float]]
+Polygon = Sequence[Ring]
+
+DEFAULT_ROWS_PER_STRIP = 256
+
+class ZonalStatistics(NamedTuple):
+    # Number of points (with valid elevations) inside the polygon:
+    valid_count: int
+    # Number of points inside the polygon without a valid elevation (or file):
+    void_count: int
+    min: Optional[int]
+    max: Optional[int]
+    mean: Optional[float]
+    # Lower bound of the elevation interval -> number of points:
+    histogram: Dict[float, int]
+
+def _edges(polygon: Polygon) -> Tuple[Any, Any, Any, Any]:
+    """ Returns numpy arrays (lat1, lon1, lat2, lon2) of all (non horizontal) edges. """
+    import numpy as np # type: ignore
+
+    edges = []
+    for ring in polygon:
+        for n in range(len(ring)):
+            (lat1, lon1), (lat2, lon2) = ring[n - 1], ring[n]
+            if lat1 != lat2:
+                edges.append((lat1, lon1, lat2, lon2))
+    array = np.array(edges, dtype=np.float64).reshape((-1, 4))
+    return array[:, 0], array[:, 1], array[:, 2], array[:, 3]
+
+def get_mask(polygon: Polygon, latitudes: Any, longitudes: Any) -> Any:
+    """
+    Boolean numpy array (len(latitudes) x len(longitudes)) with True for
+    points of the grid inside the polygon. Uses a scanline over every row,
+    so the cost is proportional to rows x (edges + columns).
+    """
+    import numpy as np
+
+    lat1, lon1, lat2, lon2 = _edges(polygon)
+    result = np.zeros((len(latitudes), len(longitudes)), dtype=bool)
+    for row, latitude in enumerate(latitudes):
+        crossing = (lat1 > latitude) != (lat2 > latitude)
+        if not crossing.any():
+            continue
+        c_lat1, c_lon1, c_lat2, c_lon2 = lat1[crossing], lon1[crossing], lat2[crossing], lon2[crossing]
+        crossings = np.sort(c_lon1 + (latitude - c_lat1) * (c_lon2 - c_lon1) / (c_lat2 - c_lat1))
+        result[row] = np.searchsorted(crossings, longitudes, side='right') % 2 == 1
+    return result
+
+def get_zonal_statistics(geo_elevation_data: mod_data.GeoElevationData, polygons: Sequence[Polygon], bin_size: float=100.,
+                         samples_per_degree: Optional[int]=None, rows_per_strip: int=DEFAULT_ROWS_PER_STRIP) -> List[ZonalStatistics]:
+    """
+    Computes statistics for every polygon. The area of the polygon is
+    processed in strips of rows_per_strip rows, and every strip covers only
+    the longitudes of the polygon edges in it, so only the files touched by
+    the polygon are loaded and memory doesn't depend on the size of the
+    polygon (use batch_mode=True for very large polygons).
+
+    The histogram counts points in intervals of bin_size meters.
+    """
+    return [_get_zonal_statistics(geo_elevation_data, polygon, bin_size, samples_per_degree, rows_per_strip)
+            for polygon in polygons]
+
+def _get_zonal_statistics(geo_elevation_data: mod_data.GeoElevationData, polygon: Polygon, bin_size: float,
+                          samples_per_degree: Optional[int], rows_per_strip: int) -> ZonalStatistics:
+    import numpy as np
+
+    lat1, lon1, lat2, lon2 = _edges(polygon)
+    if not len(lat1):
+        return ZonalStatistics(0, 0, None, None, None, {})
+
+    latitude_min, latitude_max = float(min(lat1.min(), lat2.min())), float(max(lat1.max(), lat2.max()))
+    longitude_min, longitude_max = float(min(lon1.min(), lon2.min())), float(max(lon1.max(), lon2.max()))
+
+    s = samples_per_degree or geo_elevation_data.get_samples_per_degree(latitude_min, latitude_max, longitude_min, longitude_max)
+    k_max = mod_math.floor(latitude_max * s + 1e-6)
+    k_min = mod_math.ceil(latitude_min * s - 1e-6)
+
+    count = void_count = 0
+    total = 0
+    minimum: Optional[int] = None
+    maximum: Optional[int] = None
+    histogram: Dict[float, int] = {}
+
+    for k in range(k_max, k_min - 1, -rows_per_strip):
+        k_to = max(k_min, k - rows_per_strip + 1)
+        strip_latitude_min, strip_latitude_max = k_to / s, k / s
+
+        # Longitudes of the polygon in this strip:
+        in_strip = (np.minimum(lat1, lat2) <= strip_latitude_max) & (np.maximum(lat1, lat2) >= strip_latitude_min)
+        if not in_strip.any():
+            continue
+        strip_longitude_min = float(min(lon1[in_strip].min(), lon2[in_strip].min()))
+        strip_longitude_max = float(max(lon1[in_strip].max(), lon2[in_strip].max()))
+
+        strip, _ = geo_elevation_data.get_region(strip_latitude_min, strip_latitude_max, strip_longitude_min, strip_longitude_max,
+                                                 samples_per_degree=s)
+        if not strip.size:
+            continue
+        # From the indexes of points (as in get_region), so that points on
+        # edges are in or out independently of the strips:
+        m_min = mod_math.ceil(strip_longitude_min * s - 1e-6)
+        latitudes = (k - np.arange(strip.shape[0])) / s
+        longitudes = (m_min + np.arange(strip.shape[1])) / s
+
+        values = strip[get_mask(polygon, latitudes, longitudes)]
+        valid = values[values != mod_data.NODATA]
+        void_count += len(values) - len(valid)
+        if not len(valid):
+            continue
+
+        count += len(valid)
+        total += int(valid.sum(dtype=np.int64))
+        minimum = int(valid.min()) if minimum is None else min(minimum, int(valid.min()))
+        maximum = int(valid.max()) if maximum is None else max(maximum, int(valid.max()))
+
+        bins, bin_counts = np.unique(np.floor(valid / bin_size), return_counts=True)
+        for bin_no, bin_count in zip(bins.tolist(), bin_counts.tolist()):
+            histogram[bin_no * bin_size] = histogram.get(bin_no * bin_size, 0) + bin_count
+
+    return ZonalStatistics(valid_count=count, void_count=void_count, min=minimum, max=maximum,
+                           mean=total / count if count else None, histogram=dict(sorted(histogram.items())))
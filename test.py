@@ -19,16 +19,103 @@ Run all tests with:
     $ python -m unittest test
 """
 
+import array          as mod_array
+import functools      as mod_functools
+import http.server    as mod_http_server
+import json           as mod_json
 import logging        as mod_logging
+import math           as mod_math
+import multiprocessing as mod_multiprocessing
+import os             as mod_os
+import random         as mod_random
+import re             as mod_re
+import requests       as mod_requests
+import shutil         as mod_shutil
+import struct         as mod_struct
+import subprocess     as mod_subprocess
+import sys            as mod_sys
+import tempfile       as mod_tempfile
+import threading      as mod_threading
 import unittest       as mod_unittest
 import srtm           as mod_srtm
+from srtm import bulk as mod_bulk
+from srtm import chunked as mod_chunked
+from srtm import contours as mod_contours
 from srtm import data as mod_data
+from srtm import failures as mod_failures
+from srtm import export as mod_export
+from srtm import frames as mod_frames
+from srtm import geoid as mod_geoid
+from srtm import hydrology as mod_hydrology
 from srtm import main as mod_main
+from srtm import mesh as mod_mesh
+from srtm import prefetch as mod_prefetch
+from srtm import retriever as mod_retriever
+from srtm import shared as mod_shared
+from srtm import sqlite as mod_sqlite
+from srtm import summary as mod_summary
+from srtm import tracing as mod_tracing
 from srtm import utils as mod_utils
+from srtm import warmup as mod_warmup
+from srtm import zonal as mod_zonal
+
+from typing import *
 
 mod_logging.basicConfig(level=mod_logging.DEBUG,
                         format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s')
 
+def _local_cache_dir() -> str:
+    """ Temporary cache dir with the test SRTM3 file (N44W072.hgt). """
+    cache_dir = mod_tempfile.mkdtemp()
+    mod_shutil.copy("test_files/N44W072.hgt", cache_dir)
+    return cache_dir
+
+def _get_elevation_from_store(store_name: str, queue: Any) -> None:
+    # Attach to the store, lease the file and die without releasing it:
+    store = mod_shared.SharedTileStore(store_name)
+    geo_elevation_data = mod_data.GeoElevationData({}, {"N44W072.hgt": ""}, file_handler=mod_utils.FileHandler(mod_tempfile.mkdtemp()), tile_store=store)
+    queue.put(geo_elevation_data.get_elevation(44.1756325, -71.5965699))
+
+def _linear_geoid() -> mod_geoid.Geoid:
+    """ 1 degree geoid grid with undulation -108 + 0.3 * ((90 - lat) + (lon % 360)). """
+    header = b"P5\n# Offset -108\n# Scale 0.003\n360 181\n65535\n"
+    values = [row * 100 + column * 100 for row in range(181) for column in range(360)]
+    return mod_geoid.Geoid(header + mod_struct.pack(f">{len(values)}H", *values))
+
+class _QuietHandler(mod_http_server.SimpleHTTPRequestHandler):
+    def log_message(self, *args: Any) -> None:
+        pass
+
+def _serve_directory(directory: str) -> Tuple[mod_http_server.HTTPServer, str]:
+    """ Serves files from directory (in a thread), returns the server and its url. """
+    server = mod_http_server.ThreadingHTTPServer(('127.0.0.1', 0), mod_functools.partial(_QuietHandler, directory=directory))
+    mod_threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+class _IndexHandler(mod_http_server.BaseHTTPRequestHandler):
+    """ Stand-in for the SRTM server: pages (path -> (etag, html)), with conditional requests. """
+
+    pages: Dict[str, Tuple[str, str]] = {}
+    requests: List[Tuple[str, int]] = []
+
+    def do_GET(self) -> None:
+        path = mod_re.sub('/+', '/', self.path)
+        if path not in self.pages:
+            status, etag, contents = 500, '', ''
+        else:
+            etag, contents = self.pages[path]
+            status = 304 if self.headers.get('If-None-Match') == etag else 200
+        self.requests.append((path, status))
+        self.send_response(status)
+        if etag:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        if status != 304:
+            self.wfile.write(contents.encode())
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
 class Tests(mod_unittest.TestCase):
 
     def test_dead_sea(self) -> None:
@@ -250,6 +337,682 @@ class Tests(mod_unittest.TestCase):
         self.assertTrue(len(geo_elevation_data.files) == 1)
         self.assertFalse(geo_elevation_data.files.keys() == keys1)
 
+    def test_locality_order(self) -> None:
+        # Consecutive cells on the Hilbert curve are neighbours:
+        cells = sorted(((x, y) for x in range(8) for y in range(8)), key=lambda cell: mod_utils.hilbert_index(cell[0], cell[1], 3))
+        for (x1, y1), (x2, y2) in zip(cells, cells[1:]):
+            self.assertEqual(1, abs(x1 - x2) + abs(y1 - y2))
+        self.assertEqual(0b100111, mod_utils.z_order_index(0b011, 0b101, 3))
+
+        random = mod_random.Random(1)
+        points = [(random.uniform(43.9, 45.1), random.uniform(-72.1, -70.9)) for _ in range(1000)]
+        geo_elevation_data = mod_data.GeoElevationData({}, {"N44W072.hgt": ""}, file_handler=mod_utils.FileHandler(_local_cache_dir()), batch_mode=True)
+        expected = [geo_elevation_data.get_elevation(latitude, longitude) for latitude, longitude in points]
+        self.assertTrue(None in expected)
+        for order in (None, mod_utils.HILBERT, mod_utils.Z_ORDER):
+            self.assertEqual(expected, geo_elevation_data.get_elevations(points, order=order))
+
+        # Points of the same file are consecutive:
+        file_names = [(mod_math.floor(points[i][0]), mod_math.floor(points[i][1])) for i in mod_utils.get_locality_order(points)]
+        self.assertEqual(len(set(file_names)), sum(1 for n in range(len(file_names)) if n == 0 or file_names[n] != file_names[n - 1]))
+
+    def test_elevation_columns(self) -> None:
+        import numpy as np # type: ignore
+
+        random = mod_random.Random(1)
+        points = [(random.uniform(43.9, 45.1), random.uniform(-72.1, -70.9)) for _ in range(1000)] + [(44.1756325, -71.5965699), (44, -72)]
+        geo_elevation_data = mod_data.GeoElevationData({}, {"N44W072.hgt": ""}, file_handler=mod_utils.FileHandler(_local_cache_dir()))
+        expected = [geo_elevation_data.get_elevation(latitude, longitude) for latitude, longitude in points]
+        latitudes, longitudes = np.array(points).T
+        elevations = geo_elevation_data.get_elevations_array(latitudes, longitudes)
+        self.assertTrue(np.array_equal([np.nan if elevation is None else elevation for elevation in expected], elevations, equal_nan=True))
+        self.assertEqual([806, 341], elevations[-2:].tolist())
+
+        try:
+            import pandas as pd # type: ignore
+            import pyarrow as pa # type: ignore
+            import pyarrow.parquet as pq # type: ignore
+        except ImportError:
+            self.skipTest('pandas and pyarrow not installed')
+
+        df = pd.DataFrame({'lat': latitudes, 'lon': longitudes}, index=range(10, 10 + len(points)))
+        column = mod_frames.get_elevation_column(geo_elevation_data, df['lat'], df['lon'])
+        self.assertEqual(list(df.index), list(column.index))
+        self.assertTrue(np.array_equal(elevations, column.to_numpy(), equal_nan=True))
+        arrow_column = mod_frames.get_elevation_column(geo_elevation_data, pa.array(latitudes), pa.array(longitudes))
+        self.assertEqual([None if elevation is None else float(elevation) for elevation in expected], arrow_column.to_pylist())
+
+        parquet_dir = mod_tempfile.mkdtemp()
+        pq.write_table(pa.table({'latitude': latitudes, 'longitude': longitudes, 'n': range(len(points))}), f'{parquet_dir}/points.parquet')
+        rows = mod_frames.enrich_parquet(geo_elevation_data, f'{parquet_dir}/points.parquet', f'{parquet_dir}/enriched.parquet', batch_size=100)
+        self.assertEqual(len(points), rows)
+        table = pq.read_table(f'{parquet_dir}/enriched.parquet')
+        self.assertEqual(['latitude', 'longitude', 'n', 'elevation'], table.column_names)
+        self.assertEqual(list(range(len(points))), table.column('n').to_pylist())
+        self.assertEqual(arrow_column.to_pylist(), table.column('elevation').to_pylist())
+
+    def test_failures(self) -> None:
+        server_dir = mod_tempfile.mkdtemp()
+        with open(f"{server_dir}/N21E035.hgt.zip", "wb") as f:
+            f.write(b"not a zip file")
+        server, url = _serve_directory(server_dir)
+        self.addCleanup(server.shutdown)
+        # Nothing listens on the port of a closed server:
+        closed_server, closed_url = _serve_directory(server_dir)
+        closed_server.shutdown()
+        closed_server.server_close()
+
+        files = {"N21E035.hgt": f"{url}/N21E035.hgt.zip", "N22E035.hgt": f"{closed_url}/N22E035.hgt.zip",
+                 "N23E035.hgt": f"{closed_url}/N23E035.hgt.zip"}
+        cache_dir = mod_tempfile.mkdtemp()
+        geo_elevation_data = mod_data.GeoElevationData({}, files, file_handler=mod_utils.FileHandler(cache_dir),
+                                                       failures=mod_failures.Failures(mod_utils.FileHandler(cache_dir), server_failures=2))
+        with self.assertRaises(Exception):
+            geo_elevation_data.get_elevation(21.5, 35.5)
+        with self.assertRaisesRegex(Exception, "failed recently"):
+            geo_elevation_data.get_elevation(21.6, 35.5)
+
+        # The server is not tried after two failures:
+        for n in range(2):
+            with self.assertRaises(mod_requests.exceptions.ConnectionError):
+                geo_elevation_data.get_elevation(22.5 + n * .1, 35.5)
+        with self.assertRaisesRegex(Exception, "not retried"):
+            geo_elevation_data.get_elevation(23.5, 35.5)
+        self.assertEqual(mod_failures.FailureStats(1, 2, [closed_url[len("http://"):]]), geo_elevation_data.get_failure_stats())
+
+        # Failed files are stored, and with the NONE policy have no elevations:
+        geo_elevation_data = mod_data.GeoElevationData({}, files, file_handler=mod_utils.FileHandler(cache_dir), failure_policy=mod_failures.NONE)
+        self.assertIsNone(geo_elevation_data.get_elevation(21.5, 35.5))
+        self.assertEqual(1, geo_elevation_data.get_failure_stats().fast_failures)
+        geo_elevation_data.failures.clear_files()
+        self.assertEqual(0, geo_elevation_data.get_failure_stats().failed_files)
+
+        # Files which can't be loaded aren't tried again by the same object:
+        calls: List[str] = []
+        class CountingFileHandler(mod_utils.FileHandler):
+            def exists(self, file_name: str) -> bool:
+                calls.append(file_name)
+                return super().exists(file_name)
+            def read(self, file_name: str) -> bytes:
+                calls.append(file_name)
+                return super().read(file_name)
+        with open(f"{cache_dir}/N24E035.hgt.zip", "wb") as f:
+            f.write(b"not a zip file")
+        geo_elevation_data = mod_data.GeoElevationData({}, {}, file_handler=CountingFileHandler(cache_dir), failure_policy=mod_failures.NONE)
+        self.assertIsNone(geo_elevation_data.get_elevation(24.5, 35.5))
+        self.assertTrue(calls)
+        del calls[:]
+        self.assertIsNone(geo_elevation_data.get_elevation(24.6, 35.5))
+        self.assertEqual([], calls)
+        self.assertEqual(1, geo_elevation_data.get_failure_stats().fast_failures)
+
+    def test_warm_up(self) -> None:
+        server_dir = mod_tempfile.mkdtemp()
+        with open("test_files/N44W072.hgt", "rb") as f:
+            contents = f.read()
+        with open(f"{server_dir}/N44W072.hgt.zip", "wb") as zip_f:
+            zip_f.write(mod_utils.zip(contents, "N44W072.hgt"))
+        with open(f"{server_dir}/N45W072.hgt.zip", "wb") as zip_f:
+            zip_f.write(mod_utils.zip(contents[:1000], "N45W072.hgt"))
+        server, url = _serve_directory(server_dir)
+        self.addCleanup(server.shutdown)
+
+        files = {f"{name}.hgt": f"{url}/{name}.hgt.zip" for name in ("N44W072", "N45W072", "N44W071", "N43W073")}
+        cache_dir = mod_tempfile.mkdtemp()
+        mod_shutil.copy(f"{server_dir}/N44W072.hgt.zip", f"{cache_dir}/N43W073.hgt.zip")
+        geo_elevation_data = mod_data.GeoElevationData({}, files, file_handler=mod_utils.FileHandler(cache_dir))
+
+        self.assertEqual(["N44W071.hgt", "N44W072.hgt", "N45W072.hgt"], mod_warmup.get_interval_file_names(geo_elevation_data, 44.5, 45, -71.9, -70.1))
+        self.assertEqual(["N44W072.hgt"], mod_warmup.get_points_file_names(geo_elevation_data, [(44.1, -71.1), (44.9, -71.9), (10, 10)]))
+        # A triangle touching N44W072, N45W072 and N44W071, but not N45W071:
+        triangle = [[(44.5, -71.5), (45.2, -71.9), (44.5, -70.5)]]
+        self.assertEqual(["N44W071.hgt", "N44W072.hgt", "N45W072.hgt"], mod_warmup.get_polygon_file_names(geo_elevation_data, triangle))
+
+        progress: List[mod_warmup.WarmUpProgress] = []
+        result = mod_warmup.warm_up(geo_elevation_data, files, workers=2, convert=True, progress=progress.append)
+        self.assertEqual(["N44W072.hgt"], result.downloaded)
+        self.assertEqual(["N43W073.hgt"], result.stored)
+        self.assertEqual(["N44W071.hgt", "N45W072.hgt"], sorted(result.failed))
+        self.assertEqual(len(contents), result.downloaded_bytes)
+        self.assertEqual([1, 2, 3, 4], sorted(p.done for p in progress))
+        # Failed files are remembered:
+        self.assertEqual(["N43W073.hgt", "N44W072.hgt", mod_failures.FILE_NAME], mod_utils.FileHandler(cache_dir).list_files())
+        self.assertEqual(806, geo_elevation_data.get_elevation(44.1756325, -71.5965699))
+
+        # With a resolution, the files of the dataset are downloaded (a stored SRTM1 file isn't used for 90m):
+        cache_dir = mod_tempfile.mkdtemp()
+        with open(f"{cache_dir}/N44W072.hgt", "wb") as f:
+            f.write(bytes(mod_data.DATASET_FILE_SIZES[mod_data.SRTM1]))
+        srtm1_files, srtm3_files = {"N44W072.hgt": f"{url}/missing.hgt.zip"}, {"N44W072.hgt": f"{url}/N44W072.hgt.zip"}
+        geo_elevation_data = mod_data.GeoElevationData(srtm1_files, srtm3_files, file_handler=mod_utils.FileHandler(cache_dir), resolution=90)
+        result = mod_warmup.warm_up(geo_elevation_data, ["N44W072.hgt"])
+        self.assertEqual(["SRTM3_N44W072.hgt"], result.downloaded)
+        self.assertEqual({}, result.failed)
+        result = mod_warmup.warm_up(geo_elevation_data, ["N44W072.hgt"])
+        self.assertEqual(["SRTM3_N44W072.hgt"], result.stored)
+        # Nothing is downloaded for the elevations:
+        srtm3_files["N44W072.hgt"] = f"{url}/missing.hgt.zip"
+        self.assertEqual(806, geo_elevation_data.get_elevation(44.1756325, -71.5965699))
+
+    def test_crawler(self) -> None:
+        def links(*hrefs: str) -> str:
+            return ''.join(f'<a href="{href}">{href}</a>' for href in hrefs)
+
+        _IndexHandler.pages = {
+            '/SRTM1/': ('', links('../', 'Region_01/')),
+            '/SRTM1/Region_01/': ('"1"', links('N40W100.hgt.zip')),
+            '/SRTM3/': ('', links('../', 'Africa/', 'Eurasia/', 'Islands/')),
+            '/SRTM3/Africa/': ('"a"', links('N00E006.hgt.zip', 'N00E009.hgt.zip')),
+            '/SRTM3/Eurasia/': ('"e"', links('N44E013.hgt.zip')),
+            '/SRTM3/Islands/': ('"i"', links('S10W140.hgt.zip')),
+        }
+        server = mod_http_server.ThreadingHTTPServer(('127.0.0.1', 0), _IndexHandler)
+        mod_threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.shutdown)
+        url = f'http://127.0.0.1:{server.server_address[1]}'
+
+        file_handler = mod_utils.FileHandler(mod_tempfile.mkdtemp())
+        srtm1, srtm3 = mod_main.update_urls(file_handler, srtm1_url=f'{url}/SRTM1/', srtm3_url=f'{url}/SRTM3/')
+        self.assertEqual({'N40W100.hgt': f'{url}/SRTM1//Region_01//N40W100.hgt.zip'}, srtm1)
+        self.assertEqual(['N00E006.hgt', 'N00E009.hgt', 'N44E013.hgt', 'S10W140.hgt'], sorted(srtm3))
+        self.assertEqual(['list.json'], file_handler.list_files())
+
+        # Eurasia changed, Islands can't be retrieved (its files are kept):
+        _IndexHandler.pages['/SRTM3/Eurasia/'] = ('"e2"', links('N44E013.hgt.zip', 'N45E013.hgt.zip'))
+        del _IndexHandler.pages['/SRTM3/Islands/']
+        _IndexHandler.requests = []
+        srtm1, srtm3 = mod_main.update_urls(file_handler, srtm1_url=f'{url}/SRTM1/', srtm3_url=f'{url}/SRTM3/')
+        self.assertEqual(['N00E006.hgt', 'N00E009.hgt', 'N44E013.hgt', 'N45E013.hgt', 'S10W140.hgt'], sorted(srtm3))
+        self.assertEqual(1, len(srtm1))
+        self.assertEqual([('/SRTM1/Region_01/', 304), ('/SRTM3/Africa/', 304), ('/SRTM3/Eurasia/', 200), ('/SRTM3/Islands/', 500)],
+                         sorted(request for request in _IndexHandler.requests if request[0].count('/') > 2))
+
+        geo_elevation_data = mod_srtm.get_data(file_handler=file_handler, use_included_urls=False)
+        self.assertEqual(srtm3, geo_elevation_data.srtm3_files)
+
+        result = mod_retriever.crawl(f'{url}/SRTM3/', 0, srtm3, {f'{url}/SRTM3//Africa/': {'etag': '"a"'}}, workers=2)
+        self.assertEqual([f'{url}/SRTM3//Africa/'], result.not_modified)
+        self.assertEqual([f'{url}/SRTM3//Islands/'], result.failed)
+        self.assertEqual(srtm3, result.urls)
+
+    def test_lazy_initialization(self) -> None:
+        # Stored files don't need urls or requests:
+        script = "import sys, srtm; print(srtm.get_data(local_cache_dir=sys.argv[1]).get_elevation(44.1756325, -71.5965699), 'requests' in sys.modules)"
+        output = mod_subprocess.check_output([mod_sys.executable, '-c', script, _local_cache_dir()])
+        self.assertEqual(['806', 'False'], output.decode().split()[-2:])
+
+        geo_elevation_data = mod_srtm.get_data(local_cache_dir=_local_cache_dir())
+        srtm3_files = geo_elevation_data.srtm3_files
+        assert isinstance(srtm3_files, mod_main.LazyUrls)
+        self.assertIsNone(srtm3_files.urls.urls)
+        self.assertEqual(None, geo_elevation_data.get_elevation(44.5, -170))
+        self.assertTrue("N44W072.hgt" in geo_elevation_data.srtm3_files)
+
+        # The cache directory is created on first write:
+        cache_dir = mod_os.path.join(mod_tempfile.mkdtemp(), "cache")
+        file_handler = mod_utils.FileHandler(cache_dir)
+        self.assertFalse(mod_os.path.exists(cache_dir))
+        self.assertEqual([], file_handler.list_files())
+        file_handler.write("test", b"test")
+        self.assertEqual(["test"], file_handler.list_files())
+
+    def test_memo(self) -> None:
+        geo_elevation_data = mod_data.GeoElevationData({}, {"N44W072.hgt": ""}, file_handler=mod_utils.FileHandler(_local_cache_dir()), memo_size=2)
+        without_memo = mod_data.GeoElevationData({}, {"N44W072.hgt": ""}, file_handler=mod_utils.FileHandler(_local_cache_dir()))
+        # The second point is in the same cell:
+        points = [(44.1756325, -71.5965699), (44.1756325 - 0.00001, -71.5965699 + 0.00001), (44.5, -71.5), (44, -72), (45.5, -71.5), (44, -72)]
+        for latitude, longitude in points:
+            self.assertEqual(without_memo.get_elevation(latitude, longitude), geo_elevation_data.get_elevation(latitude, longitude))
+        self.assertEqual((2, 4, 2), geo_elevation_data.get_memo_stats())
+        self.assertAlmostEqual(1 / 3, geo_elevation_data.get_memo_stats().hit_rate)
+        self.assertEqual(mod_data.get_cell(*points[0]), mod_data.get_cell(*points[1]))
+        self.assertNotEqual(mod_data.get_cell(44, -71.5), mod_data.get_cell(44 - 1e-9, -71.5))
+
+        geo_elevation_data.clear_memo()
+        self.assertEqual([806, 806, 341, 341], geo_elevation_data.get_elevations([points[0], points[1], points[3], points[3]]))
+        self.assertEqual(2, geo_elevation_data.get_memo_stats().misses)
+
+        # Points on the grid lines (and just before them) have the same elevations with and without the memo:
+        geo_elevation_data = mod_data.GeoElevationData({}, {"N44W072.hgt": ""}, file_handler=mod_utils.FileHandler(_local_cache_dir()), memo_size=mod_data.MEMO_SIZE)
+        points = [(44 + k / side - delta, -72 + (k + 7) % side / side + delta) for side in (1200, 3600) for k in range(1, side, 7) for delta in (1e-9, 0)]
+        expected = [without_memo.get_elevation(latitude, longitude) for latitude, longitude in points]
+        self.assertEqual(expected, [geo_elevation_data.get_elevation(latitude, longitude) for latitude, longitude in points])
+        self.assertEqual(expected, without_memo.get_elevations(points))
+        self.assertEqual((0, 0, 0), without_memo.get_memo_stats())
+
+    def test_resolution_planner(self) -> None:
+        self.assertEqual([mod_data.SRTM3, mod_data.SRTM1], mod_data.get_datasets(100))
+        self.assertEqual([mod_data.SRTM1, mod_data.SRTM3], mod_data.get_datasets(50))
+        self.assertEqual([mod_data.SRTM1, mod_data.SRTM3], mod_data.get_datasets(10))
+
+        cache_dir = _local_cache_dir()
+        file_handler = mod_utils.FileHandler(cache_dir)
+        # N44W072.hgt is a SRTM3 file, the SRTM1 file has the same elevation everywhere:
+        srtm1 = mod_array.array("h", [500]) * (3601 * 3601)
+        file_handler.write("SRTM1_N44W072.hgt", mod_chunked.encode(srtm1))
+        urls = {"N44W072.hgt": ""}
+
+        geo_elevation_data = mod_data.GeoElevationData(urls, urls, file_handler=file_handler, resolution=100)
+        self.assertEqual((806, mod_data.SRTM3), geo_elevation_data.get_elevation_and_dataset(44.1756325, -71.5965699))
+        self.assertEqual((500, mod_data.SRTM1), geo_elevation_data.get_elevation_and_dataset(44.1756325, -71.5965699, resolution=30))
+        self.assertEqual((None, None), geo_elevation_data.get_elevation_and_dataset(45.5, -71.5))
+
+        # A SRTM1 file with too many invalid points:
+        srtm1[: len(srtm1) // 2] = mod_array.array("h", [mod_data.NODATA]) * (len(srtm1) // 2)
+        file_handler.write("SRTM1_N44W072.hgt", mod_chunked.encode(srtm1))
+        geo_elevation_data = mod_data.GeoElevationData(urls, urls, file_handler=file_handler, resolution=30)
+        self.assertEqual((806, mod_data.SRTM3), geo_elevation_data.get_elevation_and_dataset(44.1756325, -71.5965699))
+        self.assertAlmostEqual(.5, geo_elevation_data._get_file("N44W072.hgt", mod_data.SRTM1).get_void_fraction(), places=2) # type: ignore
+
+    def test_bulk_engine(self) -> None:
+        import numpy as np
+
+        cache_dir = _local_cache_dir()
+        mod_shutil.copy("test_files/N44W072.hgt", mod_os.path.join(cache_dir, "N44W071.hgt"))
+        random = np.random.default_rng(1)
+        latitudes, longitudes = random.uniform(44, 45, 10000), random.uniform(-72, -70, 10000)
+        expected = mod_srtm.get_data(local_cache_dir=cache_dir).get_elevations_array(latitudes, longitudes)
+
+        with mod_bulk.BulkEngine(workers=2, local_cache_dir=cache_dir) as engine:
+            self.assertTrue(np.array_equal(expected, engine.get_elevations_array(latitudes, longitudes), equal_nan=True))
+            self.assertEqual([806, None], engine.get_elevations([(44.1756325, -71.5965699), (float("nan"), -71.5)]))
+            # Every file is loaded by only one worker:
+            self.assertEqual([["N44W071.hgt"], ["N44W072.hgt"]], sorted(engine.get_loaded_file_names()))
+
+    def test_prefetch(self) -> None:
+        cache_dir = _local_cache_dir()
+        mod_shutil.copy("test_files/N44W072.hgt", mod_os.path.join(cache_dir, "N44W071.hgt"))
+        mod_chunked.convert(mod_utils.FileHandler(cache_dir), remove=True)
+        geo_elevation_data = mod_data.GeoElevationData({}, {"N44W072.hgt": "", "N44W071.hgt": ""}, file_handler=mod_utils.FileHandler(cache_dir),
+                                                       chunked=True, memo_size=0)
+
+        with mod_prefetch.Prefetcher(geo_elevation_data, lookahead=30000) as prefetcher:
+            # Moving east, the next file is loaded before it is needed:
+            for n in range(10):
+                prefetcher.get_elevation(44.5, -71.3 + n * 0.01)
+            prefetcher.requested["N44W071.hgt"].result()
+            self.assertEqual(geo_elevation_data.get_elevation(44.5, -70.9), prefetcher.get_elevation(44.5, -70.9))
+            stats = prefetcher.get_stats()
+        self.assertEqual((11, 1, 1, 1), stats[:4])
+        self.assertTrue(stats.prefetched_blocks > 0)
+
+    def test_tracing(self) -> None:
+        cache_dir = _local_cache_dir()
+        mod_utils.FileHandler(cache_dir).write("N44W071.hgt.zip", mod_utils.zip(open("test_files/N44W072.hgt", "rb").read(), "N44W071.hgt"))
+        geo_elevation_data = mod_data.GeoElevationData({}, {"N44W072.hgt": "", "N44W071.hgt": ""}, file_handler=mod_utils.FileHandler(cache_dir))
+        trace_file_name = mod_os.path.join(cache_dir, "trace.json")
+
+        with mod_tracing.tracing(mod_tracing.RingBufferSink()) as sink:
+            geo_elevation_data.get_elevation(44.5, -71.5)
+            geo_elevation_data.get_elevation(44.5, -70.5)
+            geo_elevation_data.get_elevation(44.6, -71.5)
+        self.assertIsNone(mod_tracing.sink)
+
+        totals = cast(mod_tracing.RingBufferSink, sink).get_totals()
+        self.assertEqual(2, totals[mod_tracing.LOAD_FILE].spans)
+        self.assertEqual(2, totals[mod_tracing.DECODE].spans)
+        self.assertEqual(1, totals[mod_tracing.UNZIP].spans)
+        self.assertEqual(2 * mod_data.DATASET_FILE_SIZES[mod_data.SRTM3], totals[mod_tracing.DECODE].bytes)
+        self.assertTrue(totals[mod_tracing.READ].bytes > 0)
+
+        geo_elevation_data.files = {}
+        geo_elevation_data.clear_memo()
+        with mod_tracing.tracing(mod_tracing.ChromeTraceSink(trace_file_name)):
+            geo_elevation_data.get_elevation(44.5, -71.5)
+        with open(trace_file_name) as f:
+            events = mod_json.load(f)["traceEvents"]
+        self.assertIn("load_file", [event["name"] for event in events])
+        self.assertTrue(all(event["ph"] == "X" for event in events))
+
+    def test_shared_tile_store(self) -> None:
+        store_name = f"srtm-test-{mod_os.getpid()}"
+        with mod_shared.SharedTileStore(store_name, create=True) as store:
+            geo_elevation_data = mod_data.GeoElevationData({}, {"N44W072.hgt": ""}, file_handler=mod_utils.FileHandler(_local_cache_dir()), tile_store=store)
+            elevation = geo_elevation_data.get_elevation(44.1756325, -71.5965699)
+            self.assertEqual(["N44W072.hgt"], store.file_names())
+            self.assertEqual(1, store.references("N44W072.hgt"))
+
+            # Another process reads the same tile from the shared memory (its
+            # own cache dir is empty):
+            context = mod_multiprocessing.get_context("spawn")
+            queue = context.Queue()
+            process = context.Process(target=_get_elevation_from_store, args=(store_name, queue))
+            process.start()
+            self.assertEqual(elevation, queue.get(timeout=30))
+            process.join()
+            self.assertEqual(2, store.references("N44W072.hgt"))
+
+            # The lease of the dead process is removed:
+            self.assertEqual(1, store.collect())
+            self.assertEqual(1, store.references("N44W072.hgt"))
+
+            geo_elevation_data.files = {}
+            store.release("N44W072.hgt")
+            store.evict("N44W072.hgt")
+            self.assertEqual([], store.file_names())
+
+        # Files of a dataset (with the dataset in the name) are shared too:
+        with mod_shared.SharedTileStore(store_name, create=True) as store:
+            cache_dir = _local_cache_dir()
+            all_data = [mod_data.GeoElevationData({}, {"N44W072.hgt": ""}, file_handler=mod_utils.FileHandler(cache_dir), tile_store=store, resolution=90)
+                        for _ in range(2)]
+            self.assertEqual([806, 806], [data.get_elevation(44.1756325, -71.5965699) for data in all_data])
+            self.assertEqual(["SRTM3_N44W072.hgt"], store.file_names())
+            self.assertEqual(2, store.references("SRTM3_N44W072.hgt"))
+            for data in all_data:
+                data.unload_files(list(data.files))
+            with self.assertRaises(Exception):
+                store.put("x" * (mod_shared.NAME_SIZE + 1), b"")
+        if mod_os.path.isdir("/dev/shm"):
+            self.assertEqual([], [name for name in mod_os.listdir("/dev/shm") if name.startswith(store_name)])
+
+    def test_sqlite_file_handler(self) -> None:
+        with open("test_files/N44W072.hgt","rb") as hgtfile:
+            hgt = hgtfile.read()
+        for compress in (False, True):
+            file_handler = mod_sqlite.SqliteFileHandler(mod_os.path.join(mod_tempfile.mkdtemp(), "srtm.sqlite"), compress=compress)
+            self.assertEqual(1, file_handler.import_directory(_local_cache_dir()))
+            self.assertEqual(["N44W072.hgt"], file_handler.list_files())
+            self.assertTrue(file_handler.exists("N44W072.hgt"))
+            self.assertFalse(file_handler.exists("N45W072.hgt"))
+            self.assertEqual(hgt, file_handler.read("N44W072.hgt"))
+            self.assertEqual(hgt[65530:65550], file_handler.read_range("N44W072.hgt", 65530, 20))
+
+            geo_elevation_data = mod_data.GeoElevationData({}, {"N44W072.hgt": ""}, file_handler=file_handler)
+            self.assertEqual(806, geo_elevation_data.get_elevation(44.1756325, -71.5965699))
+
+    def test_chunked_file(self) -> None:
+        with open("test_files/N44W072.hgt","rb") as hgtfile:
+            hgt = hgtfile.read()
+        chunked = mod_chunked.compress(hgt)
+        chunked_file = mod_chunked.ChunkedFile.from_bytes(chunked, cached_blocks=2)
+        self.assertEqual(len(hgt), len(chunked_file))
+        for start, end in ((0, 2), (511, 514), (2400, 5000), (len(hgt) - 3, len(hgt))):
+            self.assertEqual(hgt[start:end], chunked_file[start:end])
+        self.assertTrue(len(chunked_file.blocks) <= 2)
+        self.assertEqual(hgt, mod_chunked.ChunkedFile.from_bytes(chunked)[:])
+
+    def test_decoded_values(self) -> None:
+        with open("test_files/N44W072.hgt","rb") as hgtfile:
+            hgt = hgtfile.read()
+        values = mod_chunked.decode(hgt)
+        self.assertEqual(hgt, mod_chunked.encode(values))
+        chunked_values = mod_chunked.ChunkedValues(mod_chunked.ChunkedFile.from_bytes(mod_chunked.compress(hgt)))
+        self.assertEqual(len(values), len(chunked_values))
+        for n in (0, 1, 1200, 1201, 700000, len(values) - 1):
+            self.assertEqual(mod_struct.unpack(">h", hgt[n * 2 : n * 2 + 2])[0], values[n])
+            self.assertEqual(values[n], chunked_values[n])
+
+        geo_file = mod_data.GeoElevationFile("N44W072.hgt", hgt, mod_data.GeoElevationData({}, {}, file_handler=mod_utils.FileHandler(_local_cache_dir())))
+        self.assertEqual(values[600 * 1201 + 700], geo_file.get_elevation_from_row_and_column(600, 700))
+        self.assertEqual(list(values[600 * 1201 + 10 : 600 * 1201 + 20]), list(geo_file.get_row_values(600, 10, 20)))
+
+    def test_chunked_cache(self) -> None:
+        file_handler = mod_utils.FileHandler(_local_cache_dir())
+        self.assertEqual(["N44W072.hgt"], mod_chunked.convert(file_handler, remove=True))
+        self.assertEqual(["N44W072.hgt.chunked"], file_handler.list_files())
+
+        geo_elevation_data = mod_data.GeoElevationData({}, {"N44W072.hgt": ""}, file_handler=file_handler, chunked=True)
+        geo_file = geo_elevation_data.get_file(44.1756325, -71.5965699)
+        self.assertTrue(isinstance(geo_file.data, mod_chunked.ChunkedFile)) # type: ignore
+        self.assertEqual(806, geo_elevation_data.get_elevation(44.1756325, -71.5965699))
+        self.assertEqual(341, geo_elevation_data.get_elevation(44, -72))
+
+    def test_region(self) -> None:
+        cache_dir = _local_cache_dir()
+        # Same data in the next file on the east:
+        mod_shutil.copy("test_files/N44W072.hgt", mod_os.path.join(cache_dir, "N44W071.hgt"))
+        geo_elevation_data = mod_data.GeoElevationData({}, {"N44W072.hgt": "", "N44W071.hgt": ""}, file_handler=mod_utils.FileHandler(cache_dir))
+        geo_file = geo_elevation_data.get_file(44.5, -71.5)
+
+        region, geo_transform = geo_elevation_data.get_region(43.5, 45, -72, -70)
+        # The column on -71 is in both files, but only once in the region:
+        self.assertEqual((1801, 2401), region.shape)
+        self.assertAlmostEqual(-72 - 0.5 / 1200, geo_transform[0])
+        self.assertAlmostEqual(45 + 0.5 / 1200, geo_transform[3])
+        self.assertAlmostEqual(1. / 1200, geo_transform[1])
+
+        self.assertEqual(geo_file.get_elevation_from_row_and_column(0, 0), region[0, 0]) # type: ignore
+        self.assertEqual(geo_file.get_elevation_from_row_and_column(600, 600), region[600, 600]) # type: ignore
+        self.assertEqual(geo_file.get_elevation_from_row_and_column(600, 0), region[600, 1200]) # type: ignore
+        self.assertEqual(geo_file.get_elevation_from_row_and_column(600, 1200), region[600, 2400]) # type: ignore
+        # No file south of 44:
+        self.assertTrue((region[1201:] == mod_data.NODATA).all())
+        self.assertFalse((region[:1201] == mod_data.NODATA).any())
+
+    def test_export(self) -> None:
+        import numpy as np # type: ignore
+
+        geo_elevation_data = mod_data.GeoElevationData({}, {"N44W072.hgt": ""}, file_handler=mod_utils.FileHandler(_local_cache_dir()))
+        region, geo_transform = geo_elevation_data.get_region(43.9, 44.6, -72.5, -71.3)
+        output_dir = mod_tempfile.mkdtemp()
+
+        strips = mod_export.export(geo_elevation_data, mod_os.path.join(output_dir, "region.raw"), 43.9, 44.6, -72.5, -71.3, rows_per_strip=50)
+        self.assertEqual(geo_transform, strips.geo_transform)
+        self.assertEqual(17, len(strips))
+        raw = np.fromfile(mod_os.path.join(output_dir, "region.raw"), dtype="<i2").reshape(region.shape)
+        self.assertTrue((raw == region).all())
+
+        mod_export.export(geo_elevation_data, mod_os.path.join(output_dir, "region.asc"), 43.9, 44.6, -72.5, -71.3)
+        asc = np.loadtxt(mod_os.path.join(output_dir, "region.asc"), skiprows=6)
+        self.assertTrue((asc == region).all())
+
+        mod_export.export(geo_elevation_data, mod_os.path.join(output_dir, "region.tif"), 43.9, 44.6, -72.5, -71.3, rows_per_strip=region.shape[0])
+        with open(mod_os.path.join(output_dir, "region.tif"), "rb") as f:
+            tiff = f.read()
+        self.assertEqual((b"II", 42), mod_struct.unpack("<2sH", tiff[:4]))
+        # Single strip, written just after the header:
+        self.assertEqual(region.astype("<i2").tobytes(), tiff[8 : 8 + region.size * 2])
+
+        # Every file is loaded once (also in batch mode), and unloaded after its last strip:
+        cache_dir = _local_cache_dir()
+        mod_shutil.copy("test_files/N44W072.hgt", mod_os.path.join(cache_dir, "N45W072.hgt"))
+        geo_elevation_data = mod_data.GeoElevationData({}, {"N44W072.hgt": "", "N45W072.hgt": ""}, file_handler=mod_utils.FileHandler(cache_dir), batch_mode=True)
+        loaded: List[str] = []
+        load_file_data = geo_elevation_data.load_file_data
+        def load(file_name: str, dataset: Optional[str]=None) -> Optional[mod_data.TileData]:
+            loaded.append(file_name)
+            return load_file_data(file_name, dataset)
+        geo_elevation_data.load_file_data = load # type: ignore
+        strips = mod_export.Strips(geo_elevation_data, 44.2, 45.8, -72, -71.5)
+        self.assertEqual([["N45W072.hgt"]] * 15 + [["N44W072.hgt"]] * (len(strips) - 15), [sorted(geo_elevation_data.files) for _ in strips])
+        self.assertEqual(["N45W072.hgt", "N44W072.hgt"], loaded)
+        self.assertEqual({}, geo_elevation_data.files)
+        self.assertTrue(geo_elevation_data.batch_mode)
+
+    def test_contours(self) -> None:
+        import numpy as np
+
+        # A cone with the top in the middle:
+        x = np.arange(-50, 51)
+        cone = (100 - np.hypot(x[:, np.newaxis], x[np.newaxis, :])).astype(np.int16)
+        ring, = mod_contours.get_region_contours(cone, (0, 1, 0, 0, 0, -1), [60.5])[60.5]
+        self.assertEqual(ring[0], ring[-1])
+        for latitude, longitude in ring:
+            self.assertTrue(38 < mod_math.hypot(latitude + 50.5, longitude - 50.5) <= 39.5)
+
+        cache_dir = _local_cache_dir()
+        mod_shutil.copy("test_files/N44W072.hgt", mod_os.path.join(cache_dir, "N44W071.hgt"))
+        geo_elevation_data = mod_data.GeoElevationData({}, {"N44W072.hgt": "", "N44W071.hgt": ""}, file_handler=mod_utils.FileHandler(cache_dir))
+        # Lines are joined across the border of files (on -71):
+        contours = mod_contours.get_contours(geo_elevation_data, [800, 1200], 44.3, 44.6, -71.3, -70.8)
+        region, geo_transform = geo_elevation_data.get_region(44.3, 44.6, -71.3, -70.8)
+        for level, lines in mod_contours.get_region_contours(region, geo_transform, [800, 1200]).items():
+            self.assertTrue(lines)
+            self.assertEqual(sorted(map(len, lines)), sorted(map(len, contours[level])))
+
+    def test_mesh(self) -> None:
+        import numpy as np
+
+        geo_elevation_data = mod_data.GeoElevationData({}, {"N44W072.hgt": ""}, file_handler=mod_utils.FileHandler(_local_cache_dir()))
+        region, geo_transform = geo_elevation_data.get_region(44.2, 44.25, -71.7, -71.64)
+        full = mod_mesh.get_region_mesh(region, geo_transform, 0)
+        mesh = mod_mesh.get_mesh(geo_elevation_data, 10, 44.2, 44.25, -71.7, -71.64)
+        self.assertTrue(len(mesh.points) < len(full.points) / 2)
+        self.assertTrue(len(full.points) <= region.size)
+        self.assertEqual((np.uint16, np.int16, np.uint16), (mesh.points.dtype, mesh.heights.dtype, mesh.triangles.dtype))
+        # Compact buffers, a fraction of the file:
+        tile, tile_geo_transform = geo_elevation_data.get_region(44, 45, -72, -71)
+        tile_mesh = mod_mesh.get_region_mesh(tile, tile_geo_transform, 50)
+        self.assertTrue(tile_mesh.points.nbytes + tile_mesh.heights.nbytes + tile_mesh.triangles.nbytes < tile.nbytes / 4)
+
+        columns, rows = mesh.points.T.astype(int)
+        self.assertTrue(np.array_equal(region[rows, columns], mesh.heights))
+        vertices = mesh.get_vertices()
+        self.assertTrue(np.allclose(geo_transform[3] - (rows + .5) / 1200, vertices[:, 0]))
+        self.assertTrue(np.allclose(geo_transform[0] + (columns + .5) / 1200, vertices[:, 1]))
+        area = 0.
+        for a, b, c in mesh.triangles.tolist():
+            # Counterclockwise (columns are x, rows are -y):
+            cross = (columns[b] - columns[a]) * (rows[a] - rows[c]) - (rows[a] - rows[b]) * (columns[c] - columns[a])
+            self.assertTrue(cross > 0)
+            area += cross / 2
+            for row in range(min(rows[[a, b, c]]), max(rows[[a, b, c]]) + 1):
+                for column in range(min(columns[[a, b, c]]), max(columns[[a, b, c]]) + 1):
+                    weights = np.linalg.solve([[columns[a], columns[b], columns[c]], [rows[a], rows[b], rows[c]], [1, 1, 1]], [column, row, 1])
+                    if weights.min() >= -1e-9:
+                        self.assertTrue(abs(weights @ mesh.heights[[a, b, c]] - region[row, column]) <= 10 + 1e-6)
+        self.assertEqual((region.shape[0] - 1) * (region.shape[1] - 1), area)
+
+    def test_hydrology(self) -> None:
+        import numpy as np
+
+        # A pit in the middle of a slope (and a point without data):
+        values = np.array([[9, 9, 9, 9, 9],
+                           [8, 7, 7, 7, 8],
+                           [7, 6, 2, 6, 7],
+                           [6, 5, 5, 5, 6],
+                           [5, 4, 3, 4, mod_data.NODATA]], dtype=np.int16)
+        for block_size in (2, 3, 100):
+            filled, directions, accumulation = mod_hydrology.get_region_hydrology(values, block_size=block_size)
+            self.assertEqual(5, filled[2, 2])
+            self.assertEqual(values[3, 2], filled[3, 2])
+            self.assertEqual(0, directions[4, 4])
+            self.assertEqual(0, accumulation[4, 4])
+            # The filled pit drains over the row below:
+            self.assertIn(directions[2, 2], (mod_hydrology.SOUTH_WEST, mod_hydrology.SOUTH, mod_hydrology.SOUTH_EAST))
+
+            # Every point drains out of the area, accumulation is the number
+            # of points on the way:
+            counts = np.zeros(values.shape, dtype=np.int64)
+            for row, column in np.argwhere(values != mod_data.NODATA).tolist():
+                while 0 <= row < 5 and 0 <= column < 5 and values[row, column] != mod_data.NODATA:
+                    counts[row, column] += 1
+                    d_row, d_column = mod_hydrology.OFFSETS[directions[row, column]]
+                    row, column = row + d_row, column + d_column
+                    self.assertTrue(counts.sum() < 1000)
+            self.assertEqual(counts.tolist(), accumulation.tolist())
+
+        cache_dir = _local_cache_dir()
+        mod_shutil.copy("test_files/N44W072.hgt", mod_os.path.join(cache_dir, "N44W071.hgt"))
+        geo_elevation_data = mod_data.GeoElevationData({}, {"N44W072.hgt": "", "N44W071.hgt": ""}, file_handler=mod_utils.FileHandler(cache_dir))
+        region, _ = geo_elevation_data.get_region(44.4, 44.5, -71.1, -70.9)
+        filled, directions, accumulation = mod_hydrology.get_region_hydrology(region)
+        blocks = list(mod_hydrology.iter_hydrology(geo_elevation_data, 44.4, 44.5, -71.1, -70.9))
+        # One block for every file:
+        self.assertEqual([(0, 0), (0, 120)], [(block.row, block.column) for block in blocks])
+        for block in blocks:
+            rows, columns = block.filled.shape
+            self.assertTrue(np.array_equal(filled[block.row : block.row + rows, block.column : block.column + columns], block.filled))
+            self.assertTrue(np.all(block.directions > 0))
+        self.assertTrue(np.all(filled >= region))
+        with self.assertRaisesRegex(Exception, "max_points"):
+            mod_hydrology.get_region_hydrology(region, max_points=region.size - 1)
+        with self.assertRaisesRegex(Exception, "max_points"):
+            mod_hydrology.iter_hydrology(geo_elevation_data, 44.4, 44.5, -71.1, -70.9, max_points=100)
+
+    def test_zonal_statistics(self) -> None:
+        geo_elevation_data = mod_data.GeoElevationData({}, {"N44W072.hgt": ""}, file_handler=mod_utils.FileHandler(_local_cache_dir()))
+        outer = [(44.20001, -71.80001), (44.40001, -71.80001), (44.40001, -71.60001), (44.20001, -71.60001)]
+        hole = [(44.25001, -71.75001), (44.35001, -71.75001), (44.35001, -71.65001), (44.25001, -71.65001)]
+
+        square, square_with_hole = mod_zonal.get_zonal_statistics(geo_elevation_data, [[outer], [outer, hole]], rows_per_strip=50)
+
+        region, _ = geo_elevation_data.get_region(44.20001, 44.40001, -71.80001, -71.60001)
+        self.assertEqual(region.size, square.valid_count)
+        self.assertEqual(0, square.void_count)
+        self.assertEqual(region.min(), square.min)
+        self.assertEqual(region.max(), square.max)
+        self.assertAlmostEqual(region.mean(), square.mean) # type: ignore
+        self.assertEqual(square.valid_count, sum(square.histogram.values()))
+        self.assertEqual(200., min(square.histogram))
+
+        hole_region, _ = geo_elevation_data.get_region(44.25001, 44.35001, -71.75001, -71.65001)
+        self.assertEqual(region.size - hole_region.size, square_with_hole.valid_count)
+
+        # Points on edges are counted the same with any strips:
+        triangle = [[(44.2, -71.8), (44.6, -71.2), (44.1, -71.3)], [(44.25, -71.45), (44.3, -71.4), (44.22, -71.38)]]
+        counts = [mod_zonal.get_zonal_statistics(geo_elevation_data, [triangle], rows_per_strip=rows_per_strip)[0].valid_count
+                  for rows_per_strip in (1, 37, 256, 100000)]
+        self.assertEqual([counts[0]] * 4, counts)
+
+    def test_summary_index(self) -> None:
+        cache_dir = _local_cache_dir()
+        # Same data on the east, but with a void at row 600, column 600:
+        with open("test_files/N44W072.hgt","rb") as hgtfile:
+            hgt = bytearray(hgtfile.read())
+        hgt[(600 * 1201 + 600) * 2 : (600 * 1201 + 600) * 2 + 2] = b"\x80\x00"
+        with open(mod_os.path.join(cache_dir, "N44W071.hgt"), "wb") as f:
+            f.write(hgt)
+        files = {"N44W072.hgt": "", "N44W071.hgt": ""}
+
+        geo_elevation_data = mod_data.GeoElevationData({}, files, file_handler=mod_utils.FileHandler(cache_dir))
+        summary_index = mod_summary.SummaryIndex(geo_elevation_data)
+        for interval in ((44.2, 44.31, -71.91, -71.7), (44.01, 44.99, -71.2, -70.95), (43, 46, -73, -70)):
+            region, _ = geo_elevation_data.get_region(*interval)
+            valid = region[region != mod_data.NODATA]
+            self.assertEqual(valid.max(), summary_index.get_max_elevation(*interval))
+            self.assertEqual(valid.min(), summary_index.get_min_elevation(*interval))
+
+        self.assertTrue(summary_index.has_voids(44.4, 44.6, -70.6, -70.4))
+        self.assertFalse(summary_index.has_voids(44.4, 44.6, -70.4, -70.2))
+        self.assertFalse(summary_index.has_voids(44.4, 44.6, -71.6, -71.4))
+
+        # Summaries are saved, the maximum of whole files is known without loading them:
+        geo_elevation_data = mod_data.GeoElevationData({}, files, file_handler=mod_utils.FileHandler(cache_dir))
+        summary_index = mod_summary.SummaryIndex(geo_elevation_data)
+        self.assertEqual(2, summary_index.load_all())
+        self.assertEqual(1908, summary_index.get_max_elevation(43, 46, -73, -69))
+        self.assertEqual({}, geo_elevation_data.files)
+
+        # Summaries are of the dataset used for the resolution (SRTM1 here is SRTM3 + 1000):
+        import numpy as np
+        cache_dir = _local_cache_dir()
+        srtm3 = np.fromfile("test_files/N44W072.hgt", dtype=">i2").reshape(1201, 1201)
+        srtm3.tofile(mod_os.path.join(cache_dir, "SRTM3_N44W072.hgt"))
+        srtm1 = srtm3[np.arange(3601) // 3][:, np.arange(3601) // 3] + 1000
+        srtm1.astype(">i2").tofile(mod_os.path.join(cache_dir, "SRTM1_N44W072.hgt"))
+        for resolution, expected in ((30, srtm1), (90, srtm3), (30, srtm1)):
+            geo_elevation_data = mod_data.GeoElevationData({"N44W072.hgt": ""}, {"N44W072.hgt": ""}, file_handler=mod_utils.FileHandler(cache_dir), resolution=resolution)
+            summary_index = mod_summary.SummaryIndex(geo_elevation_data)
+            self.assertEqual(expected.max(), summary_index.get_max_elevation(44, 45, -72, -71))
+            self.assertEqual(expected[:100, :100].min(), summary_index.get_min_elevation(45 - 99 / (len(expected) - 1), 45, -72, -72 + 99 / (len(expected) - 1)))
+        self.assertTrue(mod_os.path.exists(mod_os.path.join(cache_dir, "SRTM1_N44W072.hgt" + mod_summary.EXTENSION)))
+
+    def test_geoid(self) -> None:
+        import numpy as np # type: ignore
+
+        geoid = _linear_geoid()
+        self.assertAlmostEqual(-7.8, geoid.undulation(44.5, -71.5))
+        # Interpolated between 359 and 0 (360):
+        self.assertAlmostEqual((geoid.undulation(0, 359) + geoid.undulation(0, 0)) / 2, geoid.undulation(0, -0.5))
+        # Longitudes which wrap to 360 (also on the last row):
+        for latitude in (0, -90):
+            for longitude in (-1e-14, 359.9999999999):
+                self.assertAlmostEqual(geoid.undulation(latitude, 0), geoid.undulation(latitude, longitude))
+                self.assertAlmostEqual(geoid.undulations(np.array([latitude]), np.array([longitude]))[0], geoid.undulation(latitude, longitude), places=4)
+        undulations = geoid.undulations(np.array([44.5, 44.5, -89.9]), np.array([-71.5, 288.5, 10]))
+        self.assertTrue(np.allclose([-7.8, -7.8, geoid.undulation(-89.9, 10)], undulations))
+
+        geo_elevation_data = mod_data.GeoElevationData({}, {"N44W072.hgt": ""}, file_handler=mod_utils.FileHandler(_local_cache_dir()),
+                                                       height_reference=mod_geoid.ELLIPSOID, geoid=geoid)
+        geoid_elevation = geo_elevation_data.get_elevation(44.5, -71.5, height_reference=mod_geoid.GEOID)
+        self.assertAlmostEqual(geoid_elevation - 7.8, geo_elevation_data.get_elevation(44.5, -71.5)) # type: ignore
+        self.assertTrue(geo_elevation_data.get_elevation(44.5, -71.5, approximate=True) is not None)
+
+        region, _ = geo_elevation_data.get_region(44.5, 44.5, -71.5, -71.5)
+        self.assertEqual(round(geoid_elevation - 7.8), region[0, 0]) # type: ignore
+
 
 if __name__ == '__main__':
     mod_unittest.main()